@@ -0,0 +1,341 @@
+"""
+Batch invoice extraction.
+
+A batch job accepts many files (or ZIP archives of files), spools them to a
+temp directory and enqueues one work item per file on an internal queue. A
+fixed set of workers drains the queue through the normal extraction pipeline
+and records per-file status, so clients can poll the job or stream results
+as NDJSON while it runs.
+
+Short OCR texts are grouped by GroupedExtractor so several invoices share a
+single LLM round-trip.
+"""
+import asyncio
+import json
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from typing import Awaitable, BinaryIO, Callable, Dict, List, Optional, Set, Tuple
+
+from ocr_engine import OCREngineBusy
+from scheduler import ANONYMOUS
+from uploads import CHUNK_SIZE, Upload, UploadTooLarge
+
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+BATCH_MAX_FILE_MB = int(os.getenv("BATCH_MAX_FILE_MB", "25"))
+# All files of a batch together, ZIP members counted uncompressed
+BATCH_MAX_TOTAL_MB = int(os.getenv("BATCH_MAX_TOTAL_MB", "1024"))
+BATCH_JOB_TTL = int(os.getenv("BATCH_JOB_TTL", "3600"))
+BATCH_AI_GROUP_SIZE = int(os.getenv("BATCH_AI_GROUP_SIZE", "5"))
+BATCH_AI_GROUP_MAX_CHARS = int(os.getenv("BATCH_AI_GROUP_MAX_CHARS", "4000"))
+BATCH_AI_GROUP_WAIT = float(os.getenv("BATCH_AI_GROUP_WAIT", "0.5"))
+# Blank line sent on idle result streams so proxies don't cut them off
+BATCH_STREAM_KEEPALIVE = float(os.getenv("BATCH_STREAM_KEEPALIVE", "15"))
+
+SUPPORTED_TYPES = {"application/pdf", "image/jpeg", "image/png", "image/jpg"}
+
+
+class BatchTooLarge(Exception):
+    """
+    Raised when a batch (after unpacking ZIPs) exceeds BATCH_MAX_FILES or
+    BATCH_MAX_TOTAL_MB.
+    """
+
+
+class GroupedExtractor:
+    """
+    Collects short OCR texts for up to `wait` seconds and extracts them with
+    one LLM call per group. Longer texts are extracted individually.
+
+    Args:
+        extract_one: async (text) -> fields
+        extract_many: async (texts) -> list of fields, same order as texts
+    """
+
+    def __init__(
+        self,
+        extract_one: Callable[[str], Awaitable[dict]],
+        extract_many: Callable[[List[str]], Awaitable[List[dict]]],
+        group_size: int = BATCH_AI_GROUP_SIZE,
+        max_chars: int = BATCH_AI_GROUP_MAX_CHARS,
+        wait: float = BATCH_AI_GROUP_WAIT,
+    ):
+        self.extract_one = extract_one
+        self.extract_many = extract_many
+        self.group_size = group_size
+        self.max_chars = max_chars
+        self.wait = wait
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # The loop only holds weak references to tasks; keep running groups alive
+        self._groups: Set[asyncio.Task] = set()
+
+    async def extract(self, text: str) -> dict:
+        if len(text) > self.max_chars or self.group_size <= 1:
+            return await self.extract_one(text)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.group_size:
+            self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.wait)
+        self._flush_task = None
+        self._flush()
+
+    def _flush(self):
+        group, self._pending = self._pending, []
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if group:
+            task = asyncio.create_task(self._run_group(group))
+            self._groups.add(task)
+            task.add_done_callback(self._groups.discard)
+
+    async def _run_group(self, group: List[Tuple[str, asyncio.Future]]):
+        texts = [text for text, _ in group]
+        try:
+            results = await self.extract_many(texts) if len(texts) > 1 else [await self.extract_one(texts[0])]
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(group, results):
+            if not future.done():
+                future.set_result(result)
+
+
+class BatchJob:
+    """
+    State of one batch: per-file status and results.
+    """
+
+    def __init__(self, job_id: str, directory: str, tenant: str = ANONYMOUS):
+        self.id = job_id
+        self.directory = directory
+        self.tenant = tenant
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.files: List[dict] = []
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return all(f["status"] in ("done", "error") for f in self.files)
+
+    def summary(self, include_results: bool = True) -> dict:
+        completed = sum(1 for f in self.files if f["status"] in ("done", "error"))
+        files = self.files if include_results else [
+            {k: v for k, v in f.items() if k != "result"} for f in self.files
+        ]
+        return {
+            "job_id": self.id,
+            "status": "completed" if self.done else "processing",
+            "total": len(self.files),
+            "completed": completed,
+            "failed": sum(1 for f in self.files if f["status"] == "error"),
+            "progress": round(completed / len(self.files), 3) if self.files else 1.0,
+            "files": files,
+        }
+
+    def notify(self):
+        # Wake every waiter, then start a fresh event for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class BatchManager:
+    """
+    Owns the work queue, the worker tasks and the in-memory job registry.
+
+    Args:
+        process: async (upload, tenant) -> result dict; raises on failure
+        workers: Number of concurrent worker tasks
+    """
+
+    def __init__(self, process: Callable[[Upload, str], Awaitable[dict]], workers: int = BATCH_WORKERS):
+        self.process = process
+        self.workers = workers
+        self.jobs: Dict[str, BatchJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at and now - job.finished_at > BATCH_JOB_TTL:
+                del self.jobs[job_id]
+
+    async def submit(self, uploads: List[Upload], tenant: str = ANONYMOUS) -> BatchJob:
+        """
+        Create a job from uploaded files and enqueue it for `tenant`.
+        ZIP archives are expanded into their supported members.
+
+        Raises:
+            BatchTooLarge: If the batch has more than BATCH_MAX_FILES files, or
+                they add up to more than BATCH_MAX_TOTAL_MB
+            UploadTooLarge: If a file or ZIP member is larger than BATCH_MAX_FILE_MB
+        """
+        self._ensure_workers()
+        self._prune()
+
+        job_id = uuid.uuid4().hex
+        job = BatchJob(job_id, tempfile.mkdtemp(prefix=f"batch-{job_id}-"), tenant)
+        try:
+            entries = await asyncio.to_thread(self._spool, job, uploads)
+        except Exception:
+            shutil.rmtree(job.directory, ignore_errors=True)
+            raise
+
+        self.jobs[job_id] = job
+        for entry in entries:
+            self._queue.put_nowait((job, entry))
+        if not entries:
+            job.finished_at = time.time()
+        return job
+
+    def _spool(self, job: BatchJob, uploads: List[Upload]) -> List[dict]:
+        # Stream every file to disk so queued work doesn't pin upload bytes in memory
+        entries = []
+        max_bytes = BATCH_MAX_FILE_MB * 1024 * 1024
+        max_total = BATCH_MAX_TOTAL_MB * 1024 * 1024
+        total = 0
+
+        def add(filename: str, content_type: str, source: BinaryIO):
+            nonlocal total
+            if len(job.files) >= BATCH_MAX_FILES:
+                raise BatchTooLarge(f"Batch exceeds {BATCH_MAX_FILES} files")
+            index = len(job.files)
+            path = os.path.join(job.directory, str(index))
+            # Bytes are counted as they are written: a ZIP member's declared
+            # size can't be trusted
+            size = 0
+            with open(path, "wb") as f:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    total += len(chunk)
+                    if size > max_bytes:
+                        raise UploadTooLarge(size, max_bytes)
+                    if total > max_total:
+                        raise BatchTooLarge(f"Batch exceeds {BATCH_MAX_TOTAL_MB} MB")
+                    f.write(chunk)
+            job.files.append({"index": index, "filename": filename, "status": "queued", "result": None, "error": None})
+            entries.append({"index": index, "path": path, "filename": filename, "content_type": content_type})
+
+        for upload in uploads:
+            if upload.content_type in ("application/zip", "application/x-zip-compressed") or upload.filename.lower().endswith(".zip"):
+                upload.file.seek(0)
+                with zipfile.ZipFile(upload.file) as archive:
+                    for member in archive.infolist():
+                        if member.is_dir():
+                            continue
+                        member_type = mimetypes.guess_type(member.filename)[0] or ""
+                        if member_type in SUPPORTED_TYPES:
+                            if member.file_size > max_bytes:
+                                raise UploadTooLarge(member.file_size, max_bytes)
+                            with archive.open(member) as source:
+                                add(member.filename, member_type, source)
+            else:
+                upload.check_size(max_bytes)
+                upload.file.seek(0)
+                add(upload.filename, upload.content_type, upload.file)
+        return entries
+
+    async def _worker(self):
+        # shutdown() drops self._queue while workers may still be unwinding
+        queue = self._queue
+        while True:
+            job, entry = await queue.get()
+            try:
+                await self._run_entry(job, entry)
+            finally:
+                queue.task_done()
+
+    async def _run_entry(self, job: BatchJob, entry: dict):
+        file_state = job.files[entry["index"]]
+        file_state["status"] = "processing"
+        try:
+            with Upload.open_path(entry["path"], entry["content_type"], entry["filename"]) as upload:
+                while True:
+                    try:
+                        file_state["result"] = await self.process(upload, job.tenant)
+                        break
+                    except OCREngineBusy as e:
+                        # Batch work waits its turn instead of failing
+                        await asyncio.sleep(e.retry_after)
+            file_state["status"] = "done"
+        except Exception as e:
+            file_state["status"] = "error"
+            file_state["error"] = getattr(e, "detail", None) or str(e)
+        finally:
+            try:
+                os.unlink(entry["path"])
+            except OSError:
+                pass
+
+        if job.done:
+            job.finished_at = time.time()
+            shutil.rmtree(job.directory, ignore_errors=True)
+        job.notify()
+
+    async def stream(self, job: BatchJob):
+        """
+        Yield NDJSON lines: one per file as it finishes, then a final summary.
+        Idle streams get a blank line every BATCH_STREAM_KEEPALIVE seconds.
+        """
+        sent = set()
+        while True:
+            finished = job.done
+            for f in job.files:
+                if f["index"] not in sent and f["status"] in ("done", "error"):
+                    sent.add(f["index"])
+                    yield json.dumps({"type": "file", **f}) + "\n"
+            if finished:
+                yield json.dumps({"type": "summary", **job.summary(include_results=False)}) + "\n"
+                return
+            # Files that finished while this generator was suspended at a
+            # yield are picked up on the next pass rather than waited for
+            completed = self._completed(job)
+            if completed > len(sent):
+                continue
+            await job.wait_for_change(BATCH_STREAM_KEEPALIVE)
+            if self._completed(job) == completed:
+                yield "\n"
+
+    @staticmethod
+    def _completed(job: BatchJob) -> int:
+        return sum(1 for f in job.files if f["status"] in ("done", "error"))
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queue = None
+
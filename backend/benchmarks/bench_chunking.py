@@ -0,0 +1,139 @@
+"""
+Benchmark for relevance-scored chunking of long OCR texts.
+
+Builds multi-page invoice texts (header and dates on page 1, pages of line
+items with per-page subtotals, the totals block on the last page), runs
+chunking.excerpt over them and reports:
+- characters sent to the model against the full text
+- coverage: share of ground-truth field values present in the excerpt
+- field accuracy of the regex extractor on the excerpt vs the full text, as
+  a stand-in for what the model can recover from it
+- chunking time per document
+
+Usage (from backend/):
+    python benchmarks/bench_chunking.py --docs 100 --pages 1,5,20,60
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import chunking  # noqa: E402
+import regex_engine  # noqa: E402
+from bench_load import field_accuracy, percentile  # noqa: E402
+from corpus import ITEMS, invoice_fields  # noqa: E402
+
+_MARKERS = re.compile(r"^\[(page \d+|\.\.\.)\]\n*", re.M)
+
+
+def make_document(rng: random.Random, pages: int) -> tuple:
+    """
+    OCR-like text of a `pages`-page invoice (pages joined by join_pages)
+    and its ground-truth fields.
+    """
+    fields = invoice_fields(rng)
+    _, month, day = fields["invoice_date"].split("-")
+    _, due_month, due_day = fields["due_date"].split("-")
+    header = [
+        fields["vendor_name"],
+        "123 Market Street, Springfield",
+        "",
+        f"Invoice #: {fields['invoice_no']}",
+        f"Invoice Date: {month}/{day}/2025",
+        f"Due Date: {due_month}/{due_day}/2025",
+        "",
+        "Description Qty Unit price Line total",
+    ]
+    page_texts = []
+    for page in range(1, pages + 1):
+        lines = header if page == 1 else [f"Continued - page {page} of {pages}", ""]
+        subtotal = 0
+        for block in range(4):
+            for _ in range(10):
+                qty, price = rng.randint(1, 20), rng.randint(5, 400)
+                subtotal += qty * price
+                lines.append(f"{rng.choice(ITEMS)} {qty} x {price}.00 {qty * price}.00")
+            lines.append("")
+        lines.append(f"Page subtotal {subtotal:,}.00")
+        if page == pages:
+            lines += ["", f"Total Amount: ${fields['amount']:,.2f}", "Thank you for your business"]
+        page_texts.append("\n".join(lines))
+    return chunking.join_pages(page_texts), fields
+
+
+def coverage(text: str, fields: dict) -> float:
+    _, month, day = fields["invoice_date"].split("-")
+    _, due_month, due_day = fields["due_date"].split("-")
+    needles = [
+        fields["vendor_name"],
+        fields["invoice_no"],
+        f"{fields['amount']:,.2f}",
+        f"{month}/{day}/2025",
+        f"{due_month}/{due_day}/2025",
+    ]
+    return sum(needle in text for needle in needles) / len(needles)
+
+
+def run(docs: int, pages: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    full_chars, sent_chars, cover, acc_full, acc_excerpt, timings = [], [], [], [], [], []
+    for _ in range(docs):
+        text, fields = make_document(rng, pages)
+        started = time.perf_counter()
+        if len(text) > chunking.LLM_CHUNK_CHARS:
+            prompt = chunking.excerpt(chunking.segments(text))
+        else:
+            prompt = text
+        timings.append(time.perf_counter() - started)
+
+        full_chars.append(len(text))
+        sent_chars.append(len(prompt))
+        cover.append(coverage(prompt, fields))
+        acc_full.append(field_accuracy(fields, regex_engine.extract(text)))
+        # The regex extractor reads the first line as the vendor; drop the markers
+        acc_excerpt.append(field_accuracy(fields, regex_engine.extract(_MARKERS.sub("", prompt))))
+
+    return {
+        "pages": pages,
+        "full_chars": round(sum(full_chars) / docs),
+        "sent_chars": round(sum(sent_chars) / docs),
+        "sent_ratio": round(sum(sent_chars) / sum(full_chars), 3),
+        "coverage": round(sum(cover) / docs, 3),
+        "field_accuracy_full": round(sum(acc_full) / docs, 3),
+        "field_accuracy_excerpt": round(sum(acc_excerpt) / docs, 3),
+        "chunking_ms": {
+            "p50": round(percentile(timings, 50) * 1000, 2),
+            "p95": round(percentile(timings, 95) * 1000, 2),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--pages", default="1,5,20,60", help="comma-separated page counts")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "chunking",
+        "docs": args.docs,
+        "budget_chars": chunking.LLM_CHUNK_CHARS,
+        "runs": [run(args.docs, int(pages), args.seed) for pages in args.pages.split(",")],
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Bulk export throughput and memory.
+
+Starts the Supabase stub (stubs.py) with --invoices synthetic rows, all
+belonging to one company, launches the backend against it and downloads
+GET /invoices/export once per format as a staff user of that company.
+Reports wall time, rows per second, response size and the backend's peak
+RSS. Exports run in constant memory, so peak RSS should stay roughly flat as
+--invoices grows; run with two sizes to check. Results are written as JSON
+for compare.py.
+
+Parquet is skipped when pyarrow is not installed.
+
+Usage (from backend/):
+    python benchmarks/bench_export.py --invoices 500000
+    python benchmarks/bench_export.py --invoices 50000 --formats csv
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import httpx  # noqa: E402
+
+from bench_load import RSSSampler, _process_tree_rss, git_revision, start_backend, wait_until_up  # noqa: E402
+from stubs import StubServer, create_stub_app, make_invoices, stub_token  # noqa: E402
+
+# The export is scoped to the caller's company, so every row goes to it
+COMPANY_ID = "bench-company"
+STAFF = {"id": "bench-staff", "email": "staff@example.com", "full_name": "Bench Staff", "role": "company", "company_id": COMPANY_ID}
+
+
+def count_rows(fmt: str, body: bytes) -> int:
+    if fmt == "csv":
+        return gzip.decompress(body).count(b"\n") - 1
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(io.BytesIO(body)).metadata.num_rows
+
+
+def export(url: str, fmt: str, pid: int) -> dict:
+    body = io.BytesIO()
+    started = time.perf_counter()
+    with RSSSampler(pid) as sampler:
+        headers = {"Authorization": f"Bearer {stub_token(STAFF['id'])}"}
+        with httpx.stream("GET", f"{url}/invoices/export", params={"format": fmt}, headers=headers, timeout=None) as response:
+            response.raise_for_status()
+            first_byte = None
+            for chunk in response.iter_raw():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                body.write(chunk)
+    elapsed = time.perf_counter() - started
+    rows = count_rows(fmt, body.getvalue())
+    return {
+        "rows": rows,
+        "seconds": round(elapsed, 2),
+        "first_byte_ms": round((first_byte or 0) * 1000, 1),
+        "rows_per_sec": round(rows / elapsed),
+        "mb": round(body.tell() / 1e6, 2),
+        "peak_rss_mb": round(sampler.peak / 1e6, 1) if sampler.peak else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=200000, help="rows in the stub invoices table")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--formats", default="csv,parquet")
+    parser.add_argument("--port", type=int, default=8785, help="backend port (the stub uses port + 1)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the backend, repeatable")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    formats = args.formats.split(",")
+    if "parquet" in formats:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("pyarrow is not installed, skipping parquet")
+            formats.remove("parquet")
+
+    invoices = make_invoices(args.invoices, args.users, args.seed)
+    for row in invoices:
+        row["company_id"] = COMPANY_ID
+    stub = StubServer(create_stub_app(invoices, profiles=[STAFF]), args.port + 1)
+    stub.start()
+
+    url = f"http://127.0.0.1:{args.port}"
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-cache-") as cache_dir:
+        backend = start_backend(args.port, stub.url, cache_dir, extra_env)
+        try:
+            wait_until_up(url, backend)
+            idle_rss = _process_tree_rss(backend.pid)
+            for fmt in formats:
+                results[fmt] = export(url, fmt, backend.pid)
+        finally:
+            backend.terminate()
+            try:
+                backend.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+            stub.stop()
+
+    report = {
+        "benchmark": "export",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "params": {"invoices": args.invoices, "env": extra_env},
+        "idle_rss_mb": round(idle_rss / 1e6, 1) if idle_rss else None,
+        "formats": results,
+        "stub_calls": dict(stub.app.state.calls),
+    }
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
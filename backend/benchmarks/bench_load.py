@@ -0,0 +1,315 @@
+"""
+End-to-end load driver for /extract_invoice and /chat.
+
+Starts the local OpenAI/Supabase stubs (stubs.py), launches the backend with
+uvicorn in a subprocess pointed at them, and fires requests at a fixed
+concurrency. Reports p50/p95/p99 latency, throughput, status counts, field
+accuracy against the corpus ground truth, and peak RSS of the server process
+tree (OCR workers included). Results are written as JSON so runs can be
+compared with compare.py.
+
+Uploads are made unique per request (a trailing comment/padding the parsers
+ignore) so the extraction cache does not turn the run into a cache benchmark;
+pass --repeat to measure cache hits instead.
+
+Usage (from backend/):
+    python benchmarks/bench_load.py --scenario extract --requests 200 --concurrency 16
+    python benchmarks/bench_load.py --scenario chat --requests 500 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import httpx  # noqa: E402
+
+from corpus import FORMATS, corpus_files, make_corpus  # noqa: E402
+from stubs import StubServer, create_stub_app, make_invoices  # noqa: E402
+
+CHAT_QUESTIONS = [
+    "Which invoices are overdue?",
+    "How much do I owe Acme Corp?",
+    "What is the total of unpaid invoices?",
+    "Show invoices due in 2025-03",
+    "Did Globex Industries get paid?",
+]
+FIELDS = ["vendor_name", "invoice_no", "amount", "invoice_date", "due_date"]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    # Nearest-rank percentile
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def _process_tree_rss(pid: int) -> Optional[int]:
+    """
+    Resident bytes of a process and all its descendants.
+    """
+    try:
+        import psutil
+        try:
+            root = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in [root] + root.children(recursive=True))
+        except psutil.Error:
+            return None
+    except ImportError:
+        pass
+
+    if not os.path.isdir("/proc"):
+        return None
+    parents: Dict[int, int] = {}
+    rss: Dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{entry}/statm") as f:
+                pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        parents[int(entry)] = int(stat.rsplit(")", 1)[1].split()[1])
+        rss[int(entry)] = pages * os.sysconf("SC_PAGE_SIZE")
+    if pid not in rss:
+        return None
+    tree, frontier = {pid}, [pid]
+    while frontier:
+        parent = frontier.pop()
+        for child, ppid in parents.items():
+            if ppid == parent and child not in tree:
+                tree.add(child)
+                frontier.append(child)
+    return sum(rss[p] for p in tree)
+
+
+class RSSSampler:
+    """
+    Samples the server's process-tree RSS in a thread and keeps the peak.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = _process_tree_rss(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def start_backend(port: int, stub_url: str, cache_dir: str, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "SUPABASE_URL": stub_url,
+        # supabase-py only checks that the key looks like a JWT
+        "SUPABASE_SERVICE_KEY": "stub.stub.stub",
+        "EXTRACTION_CACHE_DIR": cache_dir,
+    })
+    env.update(extra_env)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60.0, path: str = "/health/ready", interval: float = 0.2):
+    # Readiness by default, so OCR workers are warm before anything is measured
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"backend exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{url}{path}", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(interval)
+    raise RuntimeError(f"backend did not answer {path}")
+
+
+def field_accuracy(expected: dict, actual: dict) -> float:
+    correct = 0
+    for field in FIELDS:
+        want, got = expected.get(field), actual.get(field)
+        if field == "amount":
+            try:
+                correct += abs(float(got) - float(want)) < 0.01
+            except (TypeError, ValueError):
+                pass
+        else:
+            correct += str(got) == str(want)
+    return correct / len(FIELDS)
+
+
+def unique_upload(entry: dict, n: int) -> bytes:
+    # Trailing bytes after %%EOF / IEND are ignored by the parsers
+    if entry["content_type"] == "application/pdf":
+        return entry["content"] + f"\n% load-{n}\n".encode()
+    return entry["content"] + f"load-{n}".encode()
+
+
+async def drive(url: str, scenario: str, requests: int, concurrency: int, files: List[dict], users: int, repeat: bool) -> dict:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    accuracy: List[float] = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(client: httpx.AsyncClient, n: int):
+        kind = scenario if scenario != "mixed" else ("chat" if n % 4 == 0 else "extract")
+        async with limit:
+            started = time.perf_counter()
+            try:
+                if kind == "extract":
+                    entry = files[n % len(files)]
+                    content = entry["content"] if repeat else unique_upload(entry, n)
+                    response = await client.post(f"{url}/extract_invoice", files={"file": (entry["name"], content, entry["content_type"])})
+                else:
+                    response = await client.post(f"{url}/chat", json={
+                        "query": CHAT_QUESTIONS[n % len(CHAT_QUESTIONS)],
+                        "user_id": f"user-{n % users:04d}",
+                        "role": "user",
+                    })
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status, response = type(e).__name__, None
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] += 1
+            if kind == "extract" and status == 200:
+                accuracy.append(field_accuracy(entry["expected"], response.json().get("data") or {}))
+
+    async with httpx.AsyncClient(timeout=300, limits=httpx.Limits(max_connections=concurrency)) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, n) for n in range(requests)))
+        wall = time.perf_counter() - started
+
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(requests / wall, 2),
+        "ok_rps": round(ok / wall, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(max(latencies) * 1000, 1),
+        },
+        "status": dict(statuses),
+        "field_accuracy": round(sum(accuracy) / len(accuracy), 3) if accuracy else None,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["extract", "chat", "mixed"], default="extract")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10, help="requests sent before measuring")
+    parser.add_argument("--corpus", type=int, default=30, help="distinct invoice files")
+    parser.add_argument("--formats", default=",".join(FORMATS), help=f"comma-separated subset of {FORMATS}")
+    parser.add_argument("--invoices", type=int, default=5000, help="rows in the stub invoices table")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="simulated OpenAI latency")
+    parser.add_argument("--repeat", action="store_true", help="re-send identical files (measures cache hits)")
+    parser.add_argument("--port", type=int, default=8765, help="backend port (the stub uses port + 1)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the backend, repeatable")
+    parser.add_argument("--json", help="results file (default: benchmarks/results/load-<scenario>-<time>.json)")
+    args = parser.parse_args()
+
+    files = corpus_files(make_corpus(args.corpus, args.seed), args.formats.split(","))
+    stub = StubServer(create_stub_app(make_invoices(args.invoices, args.users, args.seed), args.llm_latency_ms), args.port + 1)
+    stub.start()
+
+    url = f"http://127.0.0.1:{args.port}"
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    with tempfile.TemporaryDirectory(prefix="bench-cache-") as cache_dir:
+        backend = start_backend(args.port, stub.url, cache_dir, extra_env)
+        try:
+            wait_until_up(url, backend)
+            if args.warmup:
+                asyncio.run(drive(url, args.scenario, args.warmup, args.concurrency, files, args.users, args.repeat))
+            with RSSSampler(backend.pid) as sampler:
+                results = asyncio.run(drive(url, args.scenario, args.requests, args.concurrency, files, args.users, args.repeat))
+        finally:
+            backend.terminate()
+            try:
+                backend.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+            stub.stop()
+
+    report = {
+        "benchmark": "load",
+        "scenario": args.scenario,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "corpus": args.corpus,
+            "formats": args.formats,
+            "invoices": args.invoices,
+            "users": args.users,
+            "llm_latency_ms": args.llm_latency_ms,
+            "repeat": args.repeat,
+            "env": extra_env,
+        },
+        **results,
+        "peak_rss_mb": round(sampler.peak / 1e6, 1) if sampler.peak else None,
+        "stub_calls": dict(stub.app.state.calls),
+    }
+    print(json.dumps(report, indent=2))
+
+    path = args.json or os.path.join(BENCH_DIR, "results", f"load-{args.scenario}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark for OCR per page through the OCR engine.
+
+Sends the synthetic corpus (see corpus.py) through OCREngine, the same
+process pool /extract_invoice uses, and reports per-page latency percentiles,
+pages/sec and field accuracy of the regex extractor on the OCR output
+against the ground truth. Needs Tesseract; without it the run reports
+"skipped".
+
+Usage (from backend/):
+    python benchmarks/bench_ocr.py --pages 40 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import regex_engine  # noqa: E402
+from bench_load import field_accuracy, percentile  # noqa: E402
+from corpus import make_corpus  # noqa: E402
+from ocr_engine import OCR_BACKEND, OCREngine  # noqa: E402
+
+
+async def run(pages: int, workers: int, seed: int, backend: str) -> dict:
+    samples = make_corpus(pages, seed)
+    engine = OCREngine(workers=workers, queue_depth=pages, backend=backend)
+    try:
+        active = await engine.start()
+        if active is None:
+            return {"skipped": "Tesseract is not available"}
+
+        latencies = []
+
+        async def one(sample):
+            started = time.perf_counter()
+            text = (await engine.ocr_pages([sample.image]))[0]
+            latencies.append(time.perf_counter() - started)
+            return field_accuracy(sample.fields, regex_engine.extract(text))
+
+        started = time.perf_counter()
+        accuracy = await asyncio.gather(*(one(sample) for sample in samples))
+        wall = time.perf_counter() - started
+    finally:
+        engine.shutdown()
+
+    return {
+        "backend": active,
+        "pages_per_sec": round(pages / wall, 2),
+        "page_latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+        },
+        "field_accuracy": round(sum(accuracy) / len(accuracy), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--backend", default=OCR_BACKEND, help="auto, tesserocr or pytesseract")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "ocr",
+        "pages": args.pages,
+        "workers": args.workers,
+        **asyncio.run(run(args.pages, args.workers, args.seed, args.backend)),
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
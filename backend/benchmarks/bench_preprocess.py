@@ -0,0 +1,113 @@
+"""
+Benchmark for OCR preprocessing.
+
+Runs a synthetic invoice corpus (see corpus.py) through the original fixed
+pipeline (RGB, contrast x2, sharpen at full resolution) and through
+preprocess.prepare_for_ocr, and reports per-page preprocessing time and the
+number of pixels handed to Tesseract, per variant. When Tesseract is
+installed, each page is also OCR'd and scored against its ground truth
+(difflib similarity ratio), with OCR time per page.
+
+Usage (from backend/):
+    python benchmarks/bench_preprocess.py --pages 20
+"""
+import argparse
+import difflib
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytesseract  # noqa: E402
+from PIL import Image, ImageEnhance, ImageFilter  # noqa: E402
+
+from corpus import VARIANTS, make_corpus  # noqa: E402
+from ocr_engine import TESSERACT_CONFIG  # noqa: E402
+from preprocess import prepare_for_ocr  # noqa: E402
+
+
+def legacy_preprocess(image: Image.Image) -> Image.Image:
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image = ImageEnhance.Contrast(image).enhance(2)
+    return image.filter(ImageFilter.SHARPEN)
+
+
+def adaptive_preprocess(image: Image.Image) -> Image.Image:
+    return prepare_for_ocr(image)[0]
+
+
+def similarity(expected: str, actual: str) -> float:
+    return difflib.SequenceMatcher(None, " ".join(expected.split()), " ".join(actual.split())).ratio()
+
+
+def tesseract_available() -> bool:
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def run(pipeline, samples, with_ocr: bool) -> dict:
+    per_variant = {variant: {"preprocess_ms": [], "megapixels": [], "ocr_ms": [], "accuracy": []} for variant in VARIANTS}
+    for sample in samples:
+        stats = per_variant[sample.variant]
+        started = time.perf_counter()
+        image = pipeline(sample.image)
+        stats["preprocess_ms"].append((time.perf_counter() - started) * 1000)
+        stats["megapixels"].append(image.width * image.height / 1e6)
+        if with_ocr:
+            started = time.perf_counter()
+            text = pytesseract.image_to_string(image, config=TESSERACT_CONFIG)
+            stats["ocr_ms"].append((time.perf_counter() - started) * 1000)
+            stats["accuracy"].append(similarity(sample.text, text))
+
+    report = {}
+    for variant, stats in per_variant.items():
+        report[variant] = {key: round(statistics.mean(values), 3) for key, values in stats.items() if values}
+    everything = {key: [v for stats in per_variant.values() for v in stats[key]] for key in ("preprocess_ms", "megapixels", "ocr_ms", "accuracy")}
+    report["all"] = {key: round(statistics.mean(values), 3) for key, values in everything.items() if values}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20, help="pages in the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--no-ocr", action="store_true", help="skip Tesseract even if installed")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    samples = make_corpus(args.pages, args.seed)
+    with_ocr = not args.no_ocr and tesseract_available()
+
+    legacy = run(legacy_preprocess, samples, with_ocr)
+    adaptive = run(adaptive_preprocess, samples, with_ocr)
+
+    results = {
+        "benchmark": "preprocess",
+        "pages": args.pages,
+        "ocr": with_ocr,
+        "legacy": legacy,
+        "adaptive": adaptive,
+        "preprocess_speedup": round(legacy["all"]["preprocess_ms"] / adaptive["all"]["preprocess_ms"], 2),
+        "pixel_reduction": round(legacy["all"]["megapixels"] / adaptive["all"]["megapixels"], 2),
+    }
+    if with_ocr:
+        results["end_to_end_speedup"] = round(
+            (legacy["all"]["preprocess_ms"] + legacy["all"]["ocr_ms"]) / (adaptive["all"]["preprocess_ms"] + adaptive["all"]["ocr_ms"]), 2
+        )
+    print(json.dumps(results, indent=2))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
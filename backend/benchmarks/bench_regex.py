@@ -0,0 +1,207 @@
+"""
+Benchmark for the regex fallback extractor.
+
+Generates synthetic OCR texts (optionally many pages long), runs them through
+the original per-pattern implementation and through regex_engine, checks that
+both return identical fields, and reports docs/sec for each.
+
+Usage (from backend/):
+    python benchmarks/bench_regex.py --docs 200 --pages 20
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import regex_engine  # noqa: E402
+
+
+VENDORS = ["Acme Corp", "Globex Industries", "Initech LLC", "Umbrella Supplies", "Stark Logistics"]
+FILLER = [
+    "Item description qty unit price",
+    "Widget assembly 4 x 12.50 50.00",
+    "Shipping and handling",
+    "Thank you for your business",
+    "Please remit payment to the address above",
+    "Terms net 30 days",
+    "PO reference 88213 line 4",
+    "Ref: 4471-22 dept 9 cost center",
+]
+
+
+def make_document(rng: random.Random, pages: int) -> str:
+    """
+    Build one synthetic OCR text with a header, filler pages and a totals block.
+    """
+    month, day = rng.randint(1, 12), rng.randint(1, 28)
+    lines = [
+        rng.choice(VENDORS),
+        "123 Market Street, Springfield",
+        f"Invoice #: INV-{rng.randint(1000, 99999)}",
+        f"Invoice Date: {month:02d}/{day:02d}/2025",
+        f"Due Date: {(month % 12) + 1:02d}/{day:02d}/2025",
+    ]
+    for _ in range(pages):
+        lines.extend(rng.choice(FILLER) for _ in range(60))
+    lines.append(f"Subtotal: ${rng.randint(100, 9000)}.00")
+    lines.append(f"Total Amount: ${rng.randint(100, 9000):,}.{rng.randint(0, 99):02d}")
+    return "\n".join(lines)
+
+
+def time_extractor(fn, docs) -> float:
+    started = time.perf_counter()
+    for doc in docs:
+        fn(doc)
+    return time.perf_counter() - started
+
+
+def legacy_extract_with_regex(text: str) -> dict:
+    """
+    The original extract_with_regex, kept verbatim as the baseline.
+    """
+    from datetime import datetime
+    
+    result = {
+        "vendor_name": None,
+        "invoice_no": None,
+        "amount": None,
+        "due_date": None,
+        "invoice_date": None
+    }
+    
+    # Extract vendor name (first line often contains vendor)
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    if lines:
+        # Try to get vendor from first few non-empty lines
+        for line in lines[:5]:
+            if len(line) > 3 and not any(keyword in line.lower() for keyword in ['invoice', 'date', 'total', 'amount', 'due']):
+                result["vendor_name"] = line
+                break
+    
+    # Extract invoice number (improved patterns)
+    invoice_patterns = [
+        r'invoice\s*#\s*:?\s*([A-Z0-9-]+)',
+        r'invoice\s*no\.?\s*:?\s*([A-Z0-9-]+)',
+        r'inv\.?\s*#?\s*:?\s*([A-Z0-9-]+)',
+        r'bill\s*#\s*:?\s*([A-Z0-9-]+)',
+        r'#\s*([A-Z0-9-]{5,})'
+    ]
+    for pattern in invoice_patterns:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            result["invoice_no"] = match.group(1)
+            break
+    
+    # Extract amount (improved patterns)
+    amount_patterns = [
+        r'total\s*amount\s*:?\s*\$?\s*([\d,]+\.?\d{0,2})',
+        r'amount\s*due\s*:?\s*\$?\s*([\d,]+\.?\d{0,2})',
+        r'total\s*:?\s*\$?\s*([\d,]+\.?\d{0,2})',
+        r'balance\s*:?\s*\$?\s*([\d,]+\.?\d{0,2})',
+        r'grand\s*total\s*:?\s*\$?\s*([\d,]+\.?\d{0,2})',
+        r'\$\s*([\d,]+\.?\d{0,2})\s*(?:usd|total)?'
+    ]
+    for pattern in amount_patterns:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            amount_str = match.group(1).replace(',', '')
+            try:
+                result["amount"] = float(amount_str)
+                break
+            except:
+                continue
+    
+    # Extract dates (improved patterns)
+    date_patterns = [
+        r'due\s*date\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
+        r'payment\s*due\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
+        r'invoice\s*date\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
+        r'date\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})'
+    ]
+    
+    for pattern in date_patterns:
+        matches = re.findall(pattern, text, re.IGNORECASE)
+        for date_str in matches:
+            try:
+                # Try to parse date
+                for fmt in ['%m/%d/%Y', '%d/%m/%Y', '%m-%d-%Y', '%d-%m-%Y', '%m/%d/%y', '%d/%m/%y']:
+                    try:
+                        parsed = datetime.strptime(date_str, fmt)
+                        formatted = parsed.strftime('%Y-%m-%d')
+                        if 'due' in pattern.lower() or 'payment' in pattern.lower():
+                            result["due_date"] = formatted
+                        elif 'invoice' in pattern.lower() or result["invoice_date"] is None:
+                            result["invoice_date"] = formatted
+                        break
+                    except:
+                        continue
+            except:
+                continue
+    
+    # If no dates found with labels, get all dates
+    if not result["invoice_date"] and not result["due_date"]:
+        generic_dates = re.findall(r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}', text)
+        if generic_dates:
+            for date_str in generic_dates[:2]:  # Take first 2 dates
+                try:
+                    for fmt in ['%m/%d/%Y', '%d/%m/%Y', '%m-%d-%Y', '%d-%m-%Y', '%m/%d/%y', '%d/%m/%y']:
+                        try:
+                            parsed = datetime.strptime(date_str, fmt)
+                            formatted = parsed.strftime('%Y-%m-%d')
+                            if not result["invoice_date"]:
+                                result["invoice_date"] = formatted
+                            elif not result["due_date"]:
+                                result["due_date"] = formatted
+                            break
+                        except:
+                            continue
+                except:
+                    continue
+    
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=20, help="filler pages per document")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    docs = [make_document(rng, args.pages) for _ in range(args.docs)]
+    total_mb = sum(len(d) for d in docs) / 1e6
+
+    mismatches = sum(1 for d in docs if legacy_extract_with_regex(d) != regex_engine.extract(d))
+
+    legacy_s = time_extractor(legacy_extract_with_regex, docs)
+    engine_s = time_extractor(regex_engine.extract, docs)
+
+    results = {
+        "benchmark": "regex",
+        "docs": args.docs,
+        "pages_per_doc": args.pages,
+        "corpus_mb": round(total_mb, 2),
+        "legacy_docs_per_sec": round(args.docs / legacy_s, 1),
+        "engine_docs_per_sec": round(args.docs / engine_s, 1),
+        "speedup": round(legacy_s / engine_s, 2),
+        "mismatches": mismatches,
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Startup benchmark and import-time budget.
+
+Measures, in fresh interpreters:
+- import: wall time of `import main`, and the slowest top-level imports as
+  reported by `python -X importtime`
+- deferred modules: SDKs that must stay off the import path (openai,
+  pytesseract, pdf2image) and are only loaded on warm-up or first use
+- cold start: with the OpenAI/Supabase stubs running, time from launching
+  uvicorn until /health answers (live) and until /health/ready answers 200
+  (OCR workers started, OpenAI client built)
+
+Exits 1 when the median import time exceeds --budget-ms or a deferred module
+was imported, so cold-start regressions fail CI. Results are written as JSON
+for compare.py.
+
+Usage (from backend/):
+    python benchmarks/bench_startup.py --runs 5 --budget-ms 1500
+    python benchmarks/bench_startup.py --runs 5 --no-server
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_load import percentile, start_backend, wait_until_up  # noqa: E402
+from stubs import StubServer, create_stub_app  # noqa: E402
+
+DEFERRED_MODULES = ["openai", "pytesseract", "pdf2image", "tesserocr"]
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (DEFERRED_MODULES,)
+
+
+def measure_import() -> dict:
+    """
+    Import main in a fresh interpreter; wall time, deferred modules that got
+    loaded anyway, and cumulative microseconds per top-level import.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # "import time: self [us] | cumulative | imported package"; nesting is two spaces per level
+    top_level: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            top_level[name.strip()] = int(cumulative)
+    probe["modules"] = top_level
+    return probe
+
+
+def cold_start(stub_url: str, port: int) -> dict:
+    url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory(prefix="bench-cache-") as cache_dir:
+        started = time.perf_counter()
+        backend = start_backend(port, stub_url, cache_dir, {})
+        try:
+            wait_until_up(url, backend, path="/health", interval=0.02)
+            live = time.perf_counter() - started
+            wait_until_up(url, backend, path="/health/ready", interval=0.02)
+            ready = time.perf_counter() - started
+        finally:
+            backend.terminate()
+            try:
+                backend.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+    return {"live": live, "ready": ready}
+
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "max_ms": round(max(values) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500, help="max median import time of main")
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to report")
+    parser.add_argument("--no-server", action="store_true", help="skip the uvicorn cold-start runs")
+    parser.add_argument("--port", type=int, default=8775, help="backend port (the stub uses port + 1)")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    module_us: Dict[str, List[int]] = defaultdict(list)
+    for run in imports:
+        for name, cumulative in run["modules"].items():
+            module_us[name].append(cumulative)
+    slowest = sorted(module_us.items(), key=lambda item: -percentile(item[1], 50))[:args.top]
+    loaded = sorted({name for run in imports for name in run["loaded"]})
+
+    results = {
+        "benchmark": "startup",
+        "runs": args.runs,
+        "budget_ms": args.budget_ms,
+        "import": summarize([run["seconds"] for run in imports]),
+        "slowest_imports_ms": {name: round(percentile(us, 50) / 1000, 1) for name, us in slowest},
+        "deferred_modules_loaded": loaded,
+    }
+
+    if not args.no_server:
+        stub = StubServer(create_stub_app([]), args.port + 1)
+        stub.start()
+        try:
+            starts = [cold_start(stub.url, args.port) for _ in range(args.runs)]
+        finally:
+            stub.stop()
+        results["cold_start"] = {
+            "live": summarize([run["live"] for run in starts]),
+            "ready": summarize([run["ready"] for run in starts]),
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if results["import"]["p50_ms"] > args.budget_ms:
+        failures.append(f"import main took {results['import']['p50_ms']} ms, budget {args.budget_ms} ms")
+    if loaded:
+        failures.append(f"deferred modules imported by main: {', '.join(loaded)}")
+    if failures:
+        print("\n".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
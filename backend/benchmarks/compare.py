@@ -0,0 +1,62 @@
+"""
+Compare two benchmark result files.
+
+Prints every numeric value that appears in both files with the relative
+change, e.g. to check a branch against a baseline run:
+
+    python benchmarks/compare.py results/load-extract-main.json results/load-extract-branch.json
+
+With --fail-over PCT, exits 1 if any latency value (keys ending in "_ms" or
+"seconds") got worse by more than PCT percent.
+"""
+import argparse
+import json
+import sys
+from typing import Dict
+
+
+def flatten(value, prefix: str = "") -> Dict[str, float]:
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    return {}
+
+
+def is_latency(key: str) -> bool:
+    if key.startswith("params."):
+        return False
+    return any(part.endswith("_ms") or part.endswith("seconds") for part in key.split("."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--fail-over", type=float, help="max allowed latency regression in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = flatten(json.load(f))
+    with open(args.candidate) as f:
+        candidate = flatten(json.load(f))
+
+    regressions = []
+    width = max((len(key) for key in baseline), default=10)
+    for key in sorted(baseline.keys() & candidate.keys()):
+        before, after = baseline[key], candidate[key]
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{key:<{width}}  {before:>12.2f}  {after:>12.2f}  {change:+7.1f}%")
+        if args.fail_over is not None and is_latency(key) and change > args.fail_over:
+            regressions.append(key)
+
+    if regressions:
+        print(f"Latency regressions over {args.fail_over}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
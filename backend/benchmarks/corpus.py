@@ -0,0 +1,219 @@
+"""
+Synthetic invoice corpus for benchmarks.
+
+Each sample is a rendered invoice page plus the ground truth behind it: the
+text that was drawn and the fields an extractor should return. Variants
+imitate what arrives in production: clean digital renders, high-resolution
+scans, faded low-contrast copies, blurred phone photos and small pages on a
+large margin.
+
+Samples can be written out as files (`write_corpus`):
+- PNG images
+- scanned PDFs (the page image wrapped in a PDF, no text layer)
+- digital PDFs with a real text layer, for the pdftotext fast path
+
+Usage (from backend/):
+    python benchmarks/corpus.py --count 50 --out benchmarks/corpus
+"""
+import argparse
+import io
+import json
+import os
+import random
+from typing import Dict, List, NamedTuple
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter, ImageFont
+
+
+VENDORS = ["Acme Corp", "Globex Industries", "Initech LLC", "Umbrella Supplies", "Stark Logistics"]
+ITEMS = ["Widget assembly", "Shipping and handling", "Consulting hours", "Replacement parts", "Annual support"]
+VARIANTS = ["clean", "scan600", "faded", "blurred", "margin"]
+FORMATS = ["png", "scanned_pdf", "text_pdf"]
+
+
+class Sample(NamedTuple):
+    name: str
+    variant: str
+    image: Image.Image
+    dpi: int
+    text: str
+    fields: Dict[str, object]
+
+
+def invoice_fields(rng: random.Random) -> dict:
+    month, day = rng.randint(1, 12), rng.randint(1, 28)
+    items = []
+    for _ in range(rng.randint(3, 8)):
+        qty, price = rng.randint(1, 20), rng.randint(5, 400)
+        items.append((rng.choice(ITEMS), qty, price))
+    return {
+        "vendor_name": rng.choice(VENDORS),
+        "invoice_no": f"INV-{rng.randint(1000, 99999)}",
+        "amount": float(sum(qty * price for _, qty, price in items)),
+        "invoice_date": f"2025-{month:02d}-{day:02d}",
+        "due_date": f"2025-{(month % 12) + 1:02d}-{day:02d}",
+        "items": items,
+    }
+
+
+def invoice_lines(fields: dict) -> List[str]:
+    _, month, day = fields["invoice_date"].split("-")
+    _, due_month, due_day = fields["due_date"].split("-")
+    lines = [
+        fields["vendor_name"],
+        "123 Market Street, Springfield",
+        f"Invoice #: {fields['invoice_no']}",
+        f"Invoice Date: {month}/{day}/2025",
+        f"Due Date: {due_month}/{due_day}/2025",
+        "",
+    ]
+    for item, qty, price in fields["items"]:
+        lines.append(f"{item} {qty} x {price}.00 {qty * price}.00")
+    lines.append("")
+    lines.append(f"Total Amount: ${fields['amount']:,.2f}")
+    return lines
+
+
+def render_page(lines: List[str], dpi: int, margin_in: float = 0.75) -> Image.Image:
+    """
+    Draw lines of text on a Letter-size grayscale page at the given DPI.
+    """
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    page = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    font = ImageFont.load_default(size=max(8, dpi // 6))  # ~12pt
+    x = y = int(margin_in * dpi)
+    for line in lines:
+        draw.text((x, y), line, fill=0, font=font)
+        y += int(font.size * 1.6)
+    page.info["dpi"] = (dpi, dpi)
+    return page
+
+
+def make_sample(rng: random.Random, index: int, variant: str) -> Sample:
+    fields = invoice_fields(rng)
+    lines = invoice_lines(fields)
+    dpi = 600 if variant == "scan600" else 300
+    image = render_page(lines, dpi, margin_in=2.5 if variant == "margin" else 0.75)
+
+    if variant == "faded":
+        image = ImageEnhance.Contrast(image).enhance(0.25)
+    elif variant == "blurred":
+        image = image.filter(ImageFilter.GaussianBlur(1.5)).convert("RGB")
+    image.info["dpi"] = (dpi, dpi)
+
+    expected = {k: v for k, v in fields.items() if k != "items"}
+    return Sample(f"{variant}-{index}", variant, image, dpi, "\n".join(line for line in lines if line), expected)
+
+
+def make_corpus(count: int, seed: int = 7) -> List[Sample]:
+    """
+    Build `count` samples cycling through every variant.
+    """
+    rng = random.Random(seed)
+    return [make_sample(rng, i, VARIANTS[i % len(VARIANTS)]) for i in range(count)]
+
+
+def to_png(sample: Sample) -> bytes:
+    buffer = io.BytesIO()
+    sample.image.save(buffer, "PNG", dpi=(sample.dpi, sample.dpi))
+    return buffer.getvalue()
+
+
+def to_scanned_pdf(sample: Sample) -> bytes:
+    buffer = io.BytesIO()
+    sample.image.save(buffer, "PDF", resolution=sample.dpi)
+    return buffer.getvalue()
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def to_text_pdf(sample: Sample) -> bytes:
+    """
+    A one-page Letter PDF that draws the sample text in Helvetica, so the
+    page has a real text layer.
+    """
+    content = ["BT", "/F1 12 Tf", "14 TL", "54 738 Td"]
+    for line in sample.text.split("\n"):
+        content.append(f"({_pdf_escape(line)}) Tj T*")
+    content.append("ET")
+    stream = "\n".join(content).encode("latin-1")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+ENCODERS = {
+    "png": (to_png, "image/png", ".png"),
+    "scanned_pdf": (to_scanned_pdf, "application/pdf", ".pdf"),
+    "text_pdf": (to_text_pdf, "application/pdf", ".pdf"),
+}
+
+
+def corpus_files(samples: List[Sample], formats: List[str] = FORMATS) -> List[dict]:
+    """
+    Encode samples as upload files, cycling through `formats`.
+
+    Returns:
+        dicts with name, content_type, content and the expected fields
+    """
+    files = []
+    for i, sample in enumerate(samples):
+        encode, content_type, extension = ENCODERS[formats[i % len(formats)]]
+        files.append({
+            "name": sample.name + extension,
+            "format": formats[i % len(formats)],
+            "content_type": content_type,
+            "content": encode(sample),
+            "expected": sample.fields,
+        })
+    return files
+
+
+def write_corpus(directory: str, count: int, seed: int = 7, formats: List[str] = FORMATS) -> str:
+    """
+    Write the corpus files plus ground_truth.json to `directory`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    truth = {}
+    for entry in corpus_files(make_corpus(count, seed), formats):
+        with open(os.path.join(directory, entry["name"]), "wb") as f:
+            f.write(entry["content"])
+        truth[entry["name"]] = entry["expected"]
+    path = os.path.join(directory, "ground_truth.json")
+    with open(path, "w") as f:
+        json.dump(truth, f, indent=2)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--formats", default=",".join(FORMATS), help=f"comma-separated subset of {FORMATS}")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus"))
+    args = parser.parse_args()
+    print(write_corpus(args.out, args.count, args.seed, args.formats.split(",")))
+
+
+if __name__ == "__main__":
+    main()
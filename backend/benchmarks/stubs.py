@@ -0,0 +1,216 @@
+"""
+Local stand-ins for OpenAI and Supabase, used by the load driver.
+
+One ASGI app serves both:
+- POST /v1/chat/completions: answers extraction prompts by running the
+  regex engine over the invoice text in the prompt, vision prompts with fixed
+  fields and chat prompts with a canned answer, after an optional simulated
+  latency
+- /rest/v1/invoices: a PostgREST subset (select, eq, gt, gte, lte, in,
+  order, limit, the single-object Accept header, PATCH) over a synthetic
+  invoices table, and /rest/v1/profiles over the given profiles
+- GET /auth/v1/user: Supabase Auth; the access token of a user is
+  stub_token(user id)
+
+Point the backend at it with OPENAI_BASE_URL=http://host:port/v1 and
+SUPABASE_URL=http://host:port.
+"""
+import asyncio
+import bisect
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from typing import List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+import regex_engine
+from corpus import invoice_fields
+
+STATUSES = ["pending", "approved", "paid", "rejected"]
+
+_OCR_TEXT = re.compile(r"Invoice OCR text[^\n]*:\n(.*?)\n\nExtract these fields", re.S)
+_CHUNK_MARKERS = re.compile(r"^\[(page \d+|\.\.\.)\]\n*", re.M)
+_BATCH_TEXT = re.compile(r"=== INVOICE \d+ ===\n(.*?)(?=\n\n=== INVOICE |\n\nFor every invoice)", re.S)
+
+
+def make_invoices(count: int, users: int, seed: int = 7) -> List[dict]:
+    """
+    Synthetic rows for the invoices table, with the owner's profile joined.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        fields = invoice_fields(rng)
+        user = f"user-{i % users:04d}"
+        rows.append({
+            "id": f"{i:012d}",
+            "user_id": user,
+            "company_id": f"company-{i % users % 10:02d}",
+            "vendor_name": fields["vendor_name"],
+            "invoice_number": fields["invoice_no"],
+            "amount": fields["amount"],
+            "status": rng.choice(STATUSES),
+            "due_date": fields["due_date"],
+            "invoice_date": fields["invoice_date"],
+            "updated_at": "2025-01-01T00:00:00+00:00",
+            "notification_sent": False,
+            "profiles": {"email": f"{user}@example.com", "full_name": user},
+        })
+    return rows
+
+
+def stub_token(user_id: str) -> str:
+    return f"stub-token:{user_id}"
+
+
+def _completion(content: str, model: str) -> dict:
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _matches(row: dict, column: str, condition: str) -> bool:
+    op, _, value = condition.partition(".")
+    current = row.get(column)
+    if op == "eq":
+        return str(current).lower() == value.lower() if isinstance(current, bool) else str(current) == value
+    if op == "gt":
+        return current is not None and str(current) > value
+    if op == "gte":
+        return current is not None and str(current) >= value
+    if op == "lte":
+        return current is not None and str(current) <= value
+    if op == "in":
+        return str(current) in value.strip("()").split(",")
+    return True
+
+
+def create_stub_app(invoices: List[dict], llm_latency_ms: float = 0.0, profiles: Optional[List[dict]] = None) -> FastAPI:
+    app = FastAPI()
+    profiles = profiles or []
+    app.state.calls = {"openai": 0, "supabase": 0}
+    by_id = sorted(invoices, key=lambda row: row["id"])
+    ids = [row["id"] for row in by_id]
+
+    async def latency():
+        if llm_latency_ms:
+            # +-25% jitter around the configured latency
+            await asyncio.sleep(llm_latency_ms / 1000 * random.uniform(0.75, 1.25))
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.calls["openai"] += 1
+        body = await request.json()
+        await latency()
+
+        messages = body.get("messages", [])
+        last = messages[-1]["content"] if messages else ""
+        if isinstance(last, list):
+            fields = {"vendor_name": "Vision Vendor", "invoice_no": "INV-VISION", "amount": 100.0, "due_date": "2025-12-31", "invoice_date": "2025-11-30"}
+            return _completion(json.dumps(fields), body.get("model", ""))
+
+        system = messages[0]["content"] if messages else ""
+        if "invoice assistant" in system.lower():
+            return _completion("You have several unpaid invoices; the largest is due soonest.", body.get("model", ""))
+
+        batch = _BATCH_TEXT.findall(last)
+        if batch:
+            return _completion(json.dumps([regex_engine.extract(text) for text in batch]), body.get("model", ""))
+
+        match = _OCR_TEXT.search(last)
+        text = _CHUNK_MARKERS.sub("", match.group(1)) if match else last
+        return _completion(json.dumps(regex_engine.extract(text)), body.get("model", ""))
+
+    @app.get("/rest/v1/invoices")
+    async def select_invoices(request: Request):
+        app.state.calls["supabase"] += 1
+        params = request.query_params
+        if "or" in params:
+            # Incremental sync: nothing changed since the full load
+            return []
+
+        order = params.get("order")
+        filters = [(column, condition) for column, condition in params.multi_items() if column not in ("select", "order", "limit", "offset")]
+        if order == "id":
+            # Keyset scans (large exports): start after the last id, stop at the limit
+            after = next((condition[3:] for column, condition in filters if column == "id" and condition.startswith("gt.")), None)
+            rows = by_id[bisect.bisect_right(ids, after):] if after is not None else by_id
+            rows = (row for row in rows if all(_matches(row, column, condition) for column, condition in filters))
+            rows = list(itertools.islice(rows, int(params["limit"]) if params.get("limit") else None))
+        else:
+            rows = invoices
+            for column, condition in filters:
+                rows = [row for row in rows if _matches(row, column, condition)]
+            if order:
+                column, _, direction = order.partition(".")
+                rows = sorted(rows, key=lambda row: str(row.get(column)), reverse=direction.startswith("desc"))
+            if params.get("limit"):
+                rows = rows[:int(params["limit"])]
+
+        if "vnd.pgrst.object" in request.headers.get("accept", ""):
+            if len(rows) != 1:
+                return JSONResponse(status_code=406, content={"message": "JSON object requested, multiple (or no) rows returned"})
+            return rows[0]
+        # Serialized directly: FastAPI's encoder dominates on export-sized pages
+        return Response(json.dumps(rows), media_type="application/json")
+
+    @app.patch("/rest/v1/invoices")
+    async def update_invoices():
+        app.state.calls["supabase"] += 1
+        return []
+
+    @app.get("/rest/v1/profiles")
+    async def select_profiles(request: Request):
+        app.state.calls["supabase"] += 1
+        rows = profiles
+        for column, condition in request.query_params.multi_items():
+            if column not in ("select", "order", "limit", "offset"):
+                rows = [row for row in rows if _matches(row, column, condition)]
+        return rows
+
+    @app.get("/auth/v1/user")
+    async def auth_user(request: Request):
+        token = request.headers.get("authorization", "").partition(" ")[2]
+        user_id = token[len(stub_token("")):] if token.startswith(stub_token("")) else ""
+        if not any(row["id"] == user_id for row in profiles):
+            return JSONResponse(status_code=401, content={"message": "invalid JWT"})
+        return {"id": user_id, "aud": "authenticated"}
+
+    return app
+
+
+class StubServer:
+    """
+    Runs the stub app with uvicorn in a background thread.
+    """
+
+    def __init__(self, app: FastAPI, port: int, host: str = "127.0.0.1"):
+        self.app = app
+        self.url = f"http://{host}:{port}"
+        self._server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, timeout: float = 10.0):
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("stub server did not start")
+            time.sleep(0.05)
+
+    def stop(self):
+        self._server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
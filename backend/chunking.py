@@ -0,0 +1,200 @@
+"""
+Relevance-scored chunking of long OCR texts for LLM field extraction.
+
+A long invoice is mostly line items; the fields we extract live in a few
+places: the header (vendor, invoice number) at the top of the first page,
+the dates block, and the totals block, usually on the last page. Instead of
+sending every page to the model, the text is split into segments (blocks
+between blank lines, one page at a time, long blocks cut into windows) and
+each segment is scored for header, date and totals content from its
+keywords, values and position in the document.
+
+- excerpt() packs the best segment for each kind, then the rest by score,
+  into a character budget, in document order with page markers and "[...]"
+  for what was left out. Most long invoices need this single call.
+- windows() cuts the document into budget-sized runs of segments and picks
+  the highest-scoring ones; they are extracted concurrently and merged when
+  the excerpt leaves fields missing.
+
+Either way the prompt size and number of calls are bounded by LLM_CHUNK_CHARS
+and LLM_MAX_CHUNKS, not by the length of the document.
+"""
+import os
+import re
+from typing import List, NamedTuple
+
+LLM_CHUNK_CHARS = int(os.getenv("LLM_CHUNK_CHARS", "6000"))
+LLM_MAX_CHUNKS = int(os.getenv("LLM_MAX_CHUNKS", "4"))
+LLM_SEGMENT_CHARS = int(os.getenv("LLM_SEGMENT_CHARS", "800"))
+
+# Separator between page texts, the form feed pdftotext uses
+PAGE_BREAK = "\n\f\n"
+
+KINDS = ("header", "dates", "totals")
+
+# Segments below this add nothing a keyword would point at (plain line items)
+MIN_FILL_SCORE = 1.5
+# Room for the "[...]" and "[page N]" markers around a segment
+_MARKER_CHARS = 20
+
+# Matched against lower-cased text
+_BLANK = re.compile(r"\n\s*\n")
+_HEADER = re.compile(r"\b(invoice|bill\s+(from|to)|from|vendor|supplier|remit\s+to|sold\s+by|tax\s+id|vat|gst|abn)\b")
+_INVOICE_NO = re.compile(r"\b(invoice|inv)\s*(#|no\b|number|num\b)|#\s*[a-z]*-?\d")
+_COMPANY = re.compile(r"\b(inc|llc|ltd|limited|corp|corporation|gmbh|plc|co)\b\.?")
+_DATE_WORD = re.compile(r"\b(due|dated?|issued|terms|net\s*\d+|pay\s+by)\b")
+_DATE_VALUE = re.compile(
+    r"\b\d{4}-\d{1,2}-\d{1,2}\b|\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b"
+    r"|\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2}\b"
+)
+_TOTAL_WORD = re.compile(r"\b(total|amount\s+due|balance(\s+due)?|amount\s+payable|to\s+pay|grand\s+total)\b")
+_SUBTOTAL = re.compile(r"\b(sub\s*-?\s*total|tax|vat|shipping|discount)\b")
+_MONEY = re.compile(r"[$€£₹]\s*\d|\b\d[\d,]*\.\d{2}\b")
+
+
+class Segment(NamedTuple):
+    page: int  # 1-based
+    index: int  # position in the document
+    text: str
+    scores: dict  # kind -> relevance
+
+    @property
+    def score(self) -> float:
+        return max(self.scores.values())
+
+
+def _windows_of(block: str, max_chars: int) -> List[str]:
+    # Cut an oversized block at line boundaries
+    if len(block) <= max_chars:
+        return [block]
+    parts, current, size = [], [], 0
+    for line in block.split("\n"):
+        if current and size + len(line) + 1 > max_chars:
+            parts.append("\n".join(current))
+            current, size = [], 0
+        current.append(line[:max_chars])
+        size += len(line) + 1
+    if current:
+        parts.append("\n".join(current))
+    return parts
+
+
+def _score(text: str) -> dict:
+    # Patterns are lower-case; cheaper than re.I on every scan
+    text = text.lower()
+    return {
+        "header": (
+            2.0 * bool(_INVOICE_NO.search(text))
+            + min(len(_HEADER.findall(text)), 3) * 0.5
+            + 0.5 * bool(_COMPANY.search(text))
+        ),
+        "dates": min(len(_DATE_WORD.findall(text)), 3) * 0.7 + min(len(_DATE_VALUE.findall(text)), 3) * 0.5,
+        "totals": (
+            min(len(_TOTAL_WORD.findall(text)), 3) * 1.0
+            + min(len(_SUBTOTAL.findall(text)), 2) * 0.3
+            # Line items are full of amounts too; only a few count
+            + min(len(_MONEY.findall(text)), 3) * 0.2
+        ),
+    }
+
+
+def join_pages(pages: List[str]) -> str:
+    """
+    One text from page texts, separated by PAGE_BREAK. Form feeds inside a
+    page are dropped (Tesseract's CLI ends every page with one), so the only
+    form feeds left are the page breaks segments() counts.
+    """
+    return PAGE_BREAK.join(page.replace("\f", "") for page in pages) + "\n"
+
+
+def segments(text: str, max_chars: int = LLM_SEGMENT_CHARS) -> List[Segment]:
+    """
+    Split OCR text (pages joined by join_pages) into scored segments.
+    """
+    result: List[Segment] = []
+    for page_no, page in enumerate(text.split("\f"), 1):
+        for block in _BLANK.split(page):
+            block = block.strip()
+            if not block:
+                continue
+            for part in _windows_of(block, max_chars):
+                result.append(Segment(page_no, len(result), part, _score(part)))
+
+    if result:
+        # Layout priors: the vendor block opens the document, the totals close it
+        result[0].scores["header"] += 1.5
+        for segment in result[-2:]:
+            segment.scores["totals"] += 1.0
+    return result
+
+
+def _render(chosen: List[Segment], total: int) -> str:
+    lines, page, last = [], None, -1
+    for segment in sorted(chosen, key=lambda s: s.index):
+        if segment.index != last + 1:
+            lines.append("[...]")
+        if segment.page != page:
+            lines.append(f"[page {segment.page}]")
+            page = segment.page
+        lines.append(segment.text)
+        last = segment.index
+    if last != total - 1:
+        lines.append("[...]")
+    return "\n\n".join(lines)
+
+
+def excerpt(parts: List[Segment], budget: int = LLM_CHUNK_CHARS) -> str:
+    """
+    The most relevant segments that fit in `budget` characters: the best
+    one for each kind first (header from the top, totals from the bottom on
+    ties), then any other segment scoring at least MIN_FILL_SCORE.
+    """
+    chosen: List[Segment] = []
+    taken = set()
+    used = 0
+
+    def take(segment: Segment):
+        nonlocal used
+        size = len(segment.text) + _MARKER_CHARS
+        if segment.index in taken or used + size > budget:
+            return
+        chosen.append(segment)
+        taken.add(segment.index)
+        used += size
+
+    for kind in KINDS:
+        if kind == "totals":
+            ranked = sorted(parts, key=lambda s: (-s.scores[kind], -s.index))
+        else:
+            ranked = sorted(parts, key=lambda s: (-s.scores[kind], s.index))
+        if ranked and ranked[0].scores[kind] > 0:
+            take(ranked[0])
+
+    for segment in sorted(parts, key=lambda s: (-s.score, s.index)):
+        if segment.score < MIN_FILL_SCORE:
+            break
+        take(segment)
+    return _render(chosen, len(parts))
+
+
+def windows(parts: List[Segment], budget: int = LLM_CHUNK_CHARS, limit: int = LLM_MAX_CHUNKS) -> List[str]:
+    """
+    Up to `limit` runs of consecutive segments, each at most `budget`
+    characters, with the highest relevance; returned in document order.
+    """
+    runs: List[List[Segment]] = [[]]
+    size = 0
+    for segment in parts:
+        if runs[-1] and size + len(segment.text) + _MARKER_CHARS > budget:
+            runs.append([])
+            size = 0
+        runs[-1].append(segment)
+        size += len(segment.text) + _MARKER_CHARS
+
+    # Relevance of a run: its best segment per kind
+    def relevance(run: List[Segment]) -> float:
+        return sum(max(s.scores[kind] for s in run) for kind in KINDS)
+
+    best = sorted((run for run in runs if run), key=relevance, reverse=True)[:limit]
+    best.sort(key=lambda run: run[0].index)
+    return [_render(run, len(parts)) for run in best]
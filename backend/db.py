@@ -0,0 +1,516 @@
+"""
+Data access for the invoices and profiles tables.
+
+Every query the backend makes is a method here with its column list pinned
+to what the caller uses, instead of select("*") plus joins on every call.
+Requests go through one async PostgREST client over a tuned, shared httpx
+connection pool, so handlers await the database without tying up a thread
+and without a TCP/TLS handshake per query.
+
+Single-row reads (an invoice for a notification, a user's profile, the user
+an access token belongs to) go through a short-TTL read-through cache. Writes
+made through the store invalidate the rows they touch; writes made elsewhere
+(the frontend) are picked up once the entry expires after SUPABASE_CACHE_TTL
+seconds.
+
+Two implementations share the interface: PostgrestStore talks to Supabase or
+any local PostgREST, MemoryStore keeps rows in process for tests and
+benchmarks.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import httpx
+
+if TYPE_CHECKING:
+    from postgrest import AsyncPostgrestClient
+
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "20"))
+SUPABASE_POOL_KEEPALIVE = int(os.getenv("SUPABASE_POOL_KEEPALIVE", "10"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_CACHE_TTL = float(os.getenv("SUPABASE_CACHE_TTL", "5"))
+SUPABASE_CACHE_SIZE = int(os.getenv("SUPABASE_CACHE_SIZE", "10000"))
+# ids per `in.(...)` filter: 50 UUIDs keep the query string under 2 KB, well
+# inside what PostgREST and the proxies in front of it accept
+SUPABASE_MAX_IN_IDS = int(os.getenv("SUPABASE_MAX_IN_IDS", "50"))
+
+# Column projections, one per use case
+NOTIFY_COLUMNS = "id, invoice_number, amount, profiles:user_id(email, full_name)"
+INDEX_COLUMNS = "id, user_id, vendor_name, invoice_number, amount, status, due_date, invoice_date, updated_at"
+PROFILE_COLUMNS = "id, email, full_name, role, company_id"
+DUPLICATE_COLUMNS = "id, user_id, company_id, vendor_name, invoice_number, amount, status, page_hash, updated_at"
+EXPORT_COLUMNS = (
+    "id, invoice_number, vendor_name, amount, currency, status, invoice_date, due_date, company_id, user_id, "
+    "created_at, updated_at, invoice_approvals(action, created_at), invoice_disputes(dispute_type, status, created_at)"
+)
+
+Watermark = Tuple[str, str]  # (updated_at, id)
+
+
+class ExportFilter(NamedTuple):
+    """
+    Which invoices an export covers; None (or an empty statuses) means no
+    restriction. Dates are inclusive ISO dates compared with invoice_date.
+    """
+
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    statuses: Tuple[str, ...] = ()
+    company_id: Optional[str] = None
+    user_id: Optional[str] = None
+
+
+class TTLCache:
+    """
+    Read-through cache with per-entry expiry, bounded by entry count (LRU).
+
+    Concurrent misses for the same key share one load.
+    """
+
+    def __init__(self, ttl: float = SUPABASE_CACHE_TTL, max_entries: int = SUPABASE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        pending = self._loading.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await load()
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieve it so waiter-less failures are not logged as unhandled
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            # An invalidation during the load means the value may be stale
+            if self._loading.get(key) is future and self.ttl > 0:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+        self._loading.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._loading.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl}
+
+
+class Store:
+    """
+    The queries the backend runs. Subclasses implement the uncached `_fetch_*`
+    reads and the other methods; caching and invalidation live here.
+    """
+
+    def __init__(self, cache: Optional[TTLCache] = None):
+        self.cache = cache or TTLCache()
+
+    async def invoice_for_notification(self, invoice_id: str) -> Optional[dict]:
+        """
+        An invoice with its owner's email and name (NOTIFY_COLUMNS), or None.
+        """
+        return await self.cache.get(("invoice", invoice_id), lambda: self._fetch_invoice(invoice_id))
+
+    async def profile(self, user_id: str) -> Optional[dict]:
+        """
+        A user's profile (PROFILE_COLUMNS), or None.
+        """
+        return await self.cache.get(("profile", user_id), lambda: self._fetch_profile(user_id))
+
+    def invalidate_invoice(self, invoice_id: str):
+        self.cache.invalidate(("invoice", invoice_id))
+
+    def invalidate_profile(self, user_id: str):
+        self.cache.invalidate(("profile", user_id))
+
+    async def mark_notified(self, invoice_ids: List[str]):
+        """
+        Set notification_sent on invoices that do not have it yet.
+        """
+        await self._mark_notified(invoice_ids, datetime.now(timezone.utc).isoformat())
+        for invoice_id in invoice_ids:
+            self.invalidate_invoice(invoice_id)
+
+    async def notification_candidates(self, after_id: Optional[str], limit: int) -> List[dict]:
+        """
+        Paid, un-notified invoices (NOTIFY_COLUMNS) ordered by id, after after_id.
+        """
+        raise NotImplementedError
+
+    async def index_page(self, user_id: Optional[str], after_id: Optional[str], limit: int) -> List[dict]:
+        """
+        Invoices for the chat index (INDEX_COLUMNS) ordered by id, after
+        after_id; all users' when user_id is None.
+        """
+        raise NotImplementedError
+
+    async def index_changes(self, user_id: Optional[str], watermark: Watermark, limit: int) -> List[dict]:
+        """
+        Invoices (INDEX_COLUMNS) updated after the (updated_at, id) watermark,
+        in that order.
+        """
+        raise NotImplementedError
+
+    async def duplicate_page(self, after_id: Optional[str], limit: int) -> List[dict]:
+        """
+        All invoices for the duplicate index (DUPLICATE_COLUMNS) ordered by id,
+        after after_id.
+        """
+        raise NotImplementedError
+
+    async def duplicate_changes(self, watermark: Watermark, limit: int) -> List[dict]:
+        """
+        Invoices (DUPLICATE_COLUMNS) updated after the (updated_at, id)
+        watermark, in that order.
+        """
+        raise NotImplementedError
+
+    async def export_page(self, filters: ExportFilter, after_id: Optional[str], limit: int) -> List[dict]:
+        """
+        Invoices matching filters with their approvals and disputes
+        (EXPORT_COLUMNS) ordered by id, after after_id.
+        """
+        raise NotImplementedError
+
+    async def user_for_token(self, access_token: str) -> Optional[str]:
+        """
+        Id of the user a Supabase Auth access token belongs to, or None when
+        the token is invalid or expired.
+        """
+        return await self.cache.get(("token", access_token), lambda: self._fetch_user_for_token(access_token))
+
+    async def close(self):
+        pass
+
+    async def _fetch_invoice(self, invoice_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def _fetch_profile(self, user_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def _mark_notified(self, invoice_ids: List[str], sent_at: str):
+        raise NotImplementedError
+
+    async def _fetch_user_for_token(self, access_token: str) -> Optional[str]:
+        raise NotImplementedError
+
+
+def _pooled_client(base_url: str, limits: httpx.Limits, **kwargs) -> "AsyncPostgrestClient":
+    """
+    AsyncPostgrestClient with explicit pool limits; HTTP/2 only when h2 is installed.
+    postgrest is imported here, when the first store is created, rather than
+    with this module.
+    """
+    from postgrest import AsyncPostgrestClient
+
+    class PooledPostgrestClient(AsyncPostgrestClient):
+        def create_session(self, base_url, headers, timeout, verify=True, proxy=None) -> httpx.AsyncClient:
+            try:
+                import h2  # noqa: F401
+                http2 = True
+            except ImportError:
+                http2 = False
+            return httpx.AsyncClient(
+                base_url=base_url,
+                headers=headers,
+                timeout=timeout,
+                verify=verify,
+                proxy=proxy,
+                limits=limits,
+                follow_redirects=True,
+                http2=http2,
+            )
+
+    return PooledPostgrestClient(base_url, **kwargs)
+
+
+class PostgrestStore(Store):
+    """
+    Store backed by PostgREST (Supabase's REST endpoint or a local instance).
+
+    Args:
+        url: Project URL (SUPABASE_URL); the REST API is at {url}/rest/v1,
+            Supabase Auth at {url}/auth/v1
+        key: API key sent as apikey and bearer token
+        cache: Read cache, a TTLCache with the default settings if omitted
+    """
+
+    def __init__(self, url: str, key: str, cache: Optional[TTLCache] = None):
+        super().__init__(cache)
+        self.auth_url = f"{url.rstrip('/')}/auth/v1"
+        self.client = _pooled_client(
+            f"{url.rstrip('/')}/rest/v1",
+            limits=httpx.Limits(
+                max_connections=SUPABASE_POOL_SIZE,
+                max_keepalive_connections=SUPABASE_POOL_KEEPALIVE,
+                keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+            ),
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=5.0),
+        )
+
+    async def _one(self, table: str, columns: str, column: str, value: str) -> Optional[dict]:
+        # limit(1) instead of single(): a missing row is None, not a 406
+        response = await self.client.from_(table).select(columns).eq(column, value).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    async def _fetch_invoice(self, invoice_id: str) -> Optional[dict]:
+        return await self._one("invoices", NOTIFY_COLUMNS, "id", invoice_id)
+
+    async def _fetch_profile(self, user_id: str) -> Optional[dict]:
+        return await self._one("profiles", PROFILE_COLUMNS, "id", user_id)
+
+    async def _mark_notified(self, invoice_ids: List[str], sent_at: str):
+        # notification_sent = FALSE in the filter keeps the update idempotent.
+        # The ids go in the URL, so a page of them is split over several
+        # PATCHes, sent concurrently over the pool.
+        chunks = [invoice_ids[i:i + SUPABASE_MAX_IN_IDS] for i in range(0, len(invoice_ids), SUPABASE_MAX_IN_IDS)]
+        await asyncio.gather(*(
+            self.client.from_("invoices")
+            .update({"notification_sent": True, "notification_sent_at": sent_at})
+            .in_("id", chunk)
+            .eq("notification_sent", False)
+            .execute()
+            for chunk in chunks
+        ))
+
+    async def notification_candidates(self, after_id: Optional[str], limit: int) -> List[dict]:
+        query = (
+            self.client.from_("invoices")
+            .select(NOTIFY_COLUMNS)
+            .eq("status", "paid")
+            .eq("notification_sent", False)
+            .order("id")
+            .limit(limit)
+        )
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        return (await query.execute()).data or []
+
+    def _scan(self, columns: str, user_id: Optional[str]):
+        query = self.client.from_("invoices").select(columns)
+        if user_id:
+            query = query.eq("user_id", user_id)
+        return query
+
+    async def _page(self, columns: str, user_id: Optional[str], after_id: Optional[str], limit: int) -> List[dict]:
+        query = self._scan(columns, user_id).order("id").limit(limit)
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        return (await query.execute()).data or []
+
+    async def _changes(self, columns: str, user_id: Optional[str], watermark: Watermark, limit: int) -> List[dict]:
+        updated_at, last_id = watermark
+        response = await (
+            self._scan(columns, user_id)
+            .or_(f'updated_at.gt."{updated_at}",and(updated_at.eq."{updated_at}",id.gt.{last_id})')
+            .order("updated_at")
+            .order("id")
+            .limit(limit)
+            .execute()
+        )
+        return response.data or []
+
+    async def index_page(self, user_id: Optional[str], after_id: Optional[str], limit: int) -> List[dict]:
+        return await self._page(INDEX_COLUMNS, user_id, after_id, limit)
+
+    async def index_changes(self, user_id: Optional[str], watermark: Watermark, limit: int) -> List[dict]:
+        return await self._changes(INDEX_COLUMNS, user_id, watermark, limit)
+
+    async def duplicate_page(self, after_id: Optional[str], limit: int) -> List[dict]:
+        return await self._page(DUPLICATE_COLUMNS, None, after_id, limit)
+
+    async def duplicate_changes(self, watermark: Watermark, limit: int) -> List[dict]:
+        return await self._changes(DUPLICATE_COLUMNS, None, watermark, limit)
+
+    async def export_page(self, filters: ExportFilter, after_id: Optional[str], limit: int) -> List[dict]:
+        query = self._scan(EXPORT_COLUMNS, filters.user_id).order("id").limit(limit)
+        if filters.date_from:
+            query = query.gte("invoice_date", filters.date_from)
+        if filters.date_to:
+            query = query.lte("invoice_date", filters.date_to)
+        if filters.statuses:
+            query = query.in_("status", list(filters.statuses))
+        if filters.company_id:
+            query = query.eq("company_id", filters.company_id)
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        return (await query.execute()).data or []
+
+    async def _fetch_user_for_token(self, access_token: str) -> Optional[str]:
+        # Supabase Auth checks the token; the apikey header comes with the pool
+        response = await self.client.session.get(f"{self.auth_url}/user", headers={"Authorization": f"Bearer {access_token}"})
+        if 400 <= response.status_code < 500:
+            return None
+        response.raise_for_status()
+        return response.json().get("id")
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def _split_columns(columns: str) -> List[str]:
+    # Top-level commas only: "a, p:user_id(x, y)" -> ["a", "p:user_id(x, y)"]
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(columns):
+        depth += ch == "("
+        depth -= ch == ")"
+        if ch == "," and depth == 0:
+            parts.append(columns[start:i].strip())
+            start = i + 1
+    parts.append(columns[start:].strip())
+    return [part for part in parts if part]
+
+
+def _project(row: dict, columns: str, profiles: Dict[str, dict]) -> dict:
+    projected = {}
+    for column in _split_columns(columns):
+        if "(" not in column:
+            projected[column] = row.get(column)
+            continue
+        # Embedded profile: alias:foreign_key(columns)
+        head, _, inner = column.partition("(")
+        alias, _, fk = head.partition(":")
+        inner = inner[:-1]
+        if isinstance(row.get(alias), list):
+            # One-to-many embed (approvals, disputes): child rows kept on the row
+            projected[alias] = [_project(child, inner, profiles) for child in row[alias]]
+            continue
+        profile = profiles.get(row.get(fk or alias)) or row.get(alias)
+        projected[alias] = _project(profile, inner, profiles) if profile else None
+    return projected
+
+
+class MemoryStore(Store):
+    """
+    In-process store over lists of rows, with the same semantics as
+    PostgrestStore. For tests and benchmarks.
+
+    Args:
+        invoices: Invoice rows; may carry an embedded "profiles" dict and
+            "invoice_approvals" / "invoice_disputes" lists
+        profiles: Profile rows, joined to invoices on user_id
+        sessions: Access token -> user id, for user_for_token
+    """
+
+    def __init__(self, invoices: Optional[List[dict]] = None, profiles: Optional[List[dict]] = None, cache: Optional[TTLCache] = None, sessions: Optional[Dict[str, str]] = None):
+        super().__init__(cache)
+        self.invoices: Dict[str, dict] = {row["id"]: dict(row) for row in invoices or []}
+        self.profiles: Dict[str, dict] = {row["id"]: dict(row) for row in profiles or []}
+        self.sessions: Dict[str, str] = dict(sessions or {})
+        self.queries = 0
+
+    def _select(self, columns: str, rows) -> List[dict]:
+        self.queries += 1
+        return [_project(row, columns, self.profiles) for row in rows]
+
+    async def _fetch_invoice(self, invoice_id: str) -> Optional[dict]:
+        row = self.invoices.get(invoice_id)
+        return self._select(NOTIFY_COLUMNS, [row])[0] if row else None
+
+    async def _fetch_profile(self, user_id: str) -> Optional[dict]:
+        row = self.profiles.get(user_id)
+        return self._select(PROFILE_COLUMNS, [row])[0] if row else None
+
+    async def _mark_notified(self, invoice_ids: List[str], sent_at: str):
+        self.queries += 1
+        for invoice_id in invoice_ids:
+            row = self.invoices.get(invoice_id)
+            if row is not None and not row.get("notification_sent"):
+                row.update(notification_sent=True, notification_sent_at=sent_at)
+
+    async def _fetch_user_for_token(self, access_token: str) -> Optional[str]:
+        return self.sessions.get(access_token)
+
+    async def notification_candidates(self, after_id: Optional[str], limit: int) -> List[dict]:
+        rows = sorted(
+            (row for row in self.invoices.values()
+             if row.get("status") == "paid" and not row.get("notification_sent")
+             and (after_id is None or row["id"] > after_id)),
+            key=lambda row: row["id"],
+        )
+        return self._select(NOTIFY_COLUMNS, rows[:limit])
+
+    def _scan(self, user_id: Optional[str]):
+        return (row for row in self.invoices.values() if not user_id or row.get("user_id") == user_id)
+
+    def _page(self, columns: str, user_id: Optional[str], after_id: Optional[str], limit: int) -> List[dict]:
+        rows = sorted(
+            (row for row in self._scan(user_id) if after_id is None or row["id"] > after_id),
+            key=lambda row: row["id"],
+        )
+        return self._select(columns, rows[:limit])
+
+    def _changes(self, columns: str, user_id: Optional[str], watermark: Watermark, limit: int) -> List[dict]:
+        rows = sorted(
+            (row for row in self._scan(user_id)
+             if row.get("updated_at") and (str(row["updated_at"]), row["id"]) > tuple(watermark)),
+            key=lambda row: (str(row["updated_at"]), row["id"]),
+        )
+        return self._select(columns, rows[:limit])
+
+    async def index_page(self, user_id: Optional[str], after_id: Optional[str], limit: int) -> List[dict]:
+        return self._page(INDEX_COLUMNS, user_id, after_id, limit)
+
+    async def index_changes(self, user_id: Optional[str], watermark: Watermark, limit: int) -> List[dict]:
+        return self._changes(INDEX_COLUMNS, user_id, watermark, limit)
+
+    async def duplicate_page(self, after_id: Optional[str], limit: int) -> List[dict]:
+        return self._page(DUPLICATE_COLUMNS, None, after_id, limit)
+
+    async def duplicate_changes(self, watermark: Watermark, limit: int) -> List[dict]:
+        return self._changes(DUPLICATE_COLUMNS, None, watermark, limit)
+
+    async def export_page(self, filters: ExportFilter, after_id: Optional[str], limit: int) -> List[dict]:
+        rows = sorted(
+            (row for row in self._scan(filters.user_id)
+             if (after_id is None or row["id"] > after_id)
+             and (not filters.date_from or str(row.get("invoice_date") or "") >= filters.date_from)
+             and (not filters.date_to or (row.get("invoice_date") and str(row["invoice_date"]) <= filters.date_to))
+             and (not filters.statuses or row.get("status") in filters.statuses)
+             and (not filters.company_id or row.get("company_id") == filters.company_id)),
+            key=lambda row: row["id"],
+        )
+        return self._select(EXPORT_COLUMNS, rows[:limit])
+
+
+def create_store() -> Store:
+    """
+    PostgrestStore for SUPABASE_URL / SUPABASE_SERVICE_KEY.
+    """
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_KEY")
+    if not url or not key:
+        raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set")
+    return PostgrestStore(url, key)
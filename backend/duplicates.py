@@ -0,0 +1,410 @@
+"""
+Duplicate and near-duplicate invoice detection at extraction time.
+
+Every invoice row is held in memory under a few normalized keys, per tenant
+that can see it (see scheduler.resolve_tenant): the vendor who uploaded it
+("user:<id>") and the company it was sent to ("company:<id>"). Lookups only
+touch the caller's tenant, which main.py takes from the verified access
+token, so other vendors' and companies' invoices never come back as matches.
+A match only carries the invoice's number, vendor, amount and status when the
+tenant owns the row; anything else would come back as its id and score. The
+keys are:
+- the invoice number (upper-case alphanumerics, without an "INV"/"NO" prefix
+  or leading zeros), so "INV-00123" and "123" meet
+- the vendor name (lower-case alphanumerics without legal suffixes such as
+  Inc/LLC/Ltd) together with the amount in cents
+- the 256-bit difference hash (dHash) of the first page, cropped to its
+  ink so margins and scan borders do not dominate, split into sixteen
+  16-bit bands; two hashes within 15 bits of each other share at least one
+  band (DUPLICATE_HASH_DISTANCE is capped there), and candidates are scored
+  on the full Hamming distance
+
+so checking an upload is a handful of dict lookups, with no query per upload.
+The index is loaded once with keyset pagination and then kept in sync in the
+background, fetching only rows whose updated_at moved past the last sync; a
+periodic full rebuild picks up deletions. Page hashes are persisted in
+invoices.page_hash (scripts/18-invoice-page-hash.sql), which the frontend
+fills in from the /extract_invoice response.
+"""
+import asyncio
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from PIL import Image, ImageOps
+
+from db import Store
+from metrics import span
+from rasterizer import render_pages
+from scheduler import ANONYMOUS
+from uploads import Upload
+
+DUPLICATE_SYNC_INTERVAL = float(os.getenv("DUPLICATE_SYNC_INTERVAL", "15"))
+DUPLICATE_FULL_REFRESH = float(os.getenv("DUPLICATE_FULL_REFRESH", "600"))
+DUPLICATE_PAGE_SIZE = int(os.getenv("DUPLICATE_PAGE_SIZE", "1000"))
+DUPLICATE_MIN_SCORE = float(os.getenv("DUPLICATE_MIN_SCORE", "0.55"))
+DUPLICATE_MAX_MATCHES = int(os.getenv("DUPLICATE_MAX_MATCHES", "5"))
+DUPLICATE_HASH_DPI = int(os.getenv("DUPLICATE_HASH_DPI", "36"))
+
+HASH_SIZE = 16  # 16x16 bits
+HASH_BANDS = 16
+# Hashes that differ in fewer bits than there are bands must share a band, so
+# anything up to HASH_BANDS - 1 bits apart is guaranteed to be retrieved
+DUPLICATE_HASH_DISTANCE = min(int(os.getenv("DUPLICATE_HASH_DISTANCE", str(HASH_BANDS - 1))), HASH_BANDS - 1)
+# Bands shared by this many rows (blank margins hash to zeros) carry no signal
+_BAND_MAX_ROWS = 64
+
+_VENDOR_SUFFIXES = {
+    "inc", "incorporated", "llc", "llp", "ltd", "limited", "corp", "corporation",
+    "co", "company", "gmbh", "plc", "pvt", "private", "pty", "sa", "ag", "bv", "the",
+}
+_WORD = re.compile(r"[a-z0-9]+")
+_INVOICE_PREFIX = re.compile(r"^(INVOICE|INV|NO|NUM|NR)+")
+
+
+def normalize_vendor(name) -> Optional[str]:
+    if not name:
+        return None
+    text = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode().lower()
+    words = [w for w in _WORD.findall(text.replace("&", " and ")) if w not in _VENDOR_SUFFIXES]
+    return "".join(words) or None
+
+
+def normalize_invoice_no(number) -> Optional[str]:
+    if not number:
+        return None
+    key = re.sub(r"[^A-Z0-9]", "", str(number).upper())
+    key = _INVOICE_PREFIX.sub("", key).lstrip("0")
+    return key or None
+
+
+def amount_cents(amount) -> Optional[int]:
+    try:
+        return int(round(float(amount) * 100))
+    except (TypeError, ValueError):
+        return None
+
+
+def dhash(image: Image.Image, size: int = HASH_SIZE) -> int:
+    """
+    Difference hash of the page content: one bit per horizontally adjacent
+    pixel pair of a (size + 1) x size grayscale thumbnail of the ink bbox.
+    """
+    gray = ImageOps.grayscale(image)
+    gray.thumbnail((512, 512), Image.BILINEAR)
+    gray = ImageOps.autocontrast(gray, cutoff=1)
+    box = gray.point(lambda p: 255 if p < 128 else 0).getbbox()
+    if box:
+        gray = gray.crop(box)
+
+    pixels = gray.resize((size + 1, size), Image.BILINEAR, reducing_gap=2.0).tobytes()
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            i = row * (size + 1) + col
+            value = (value << 1) | (pixels[i] > pixels[i + 1])
+    return value
+
+
+def parse_hash(value) -> Optional[int]:
+    try:
+        return int(value, 16) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _bands(value: int) -> List[Tuple[int, int]]:
+    return [(band, (value >> (16 * band)) & 0xFFFF) for band in range(HASH_BANDS)]
+
+
+def owns(tenant: str, row: dict) -> bool:
+    """
+    Whether `tenant` may see the row's fields: it uploaded the invoice or
+    the invoice was sent to it.
+    """
+    return tenant in row_tenants(row)
+
+
+def row_tenants(row: dict) -> List[str]:
+    """
+    Tenants allowed to see an invoice: its uploader and its company.
+    """
+    tenants = []
+    if row.get("user_id"):
+        tenants.append(f"user:{row['user_id']}")
+    if row.get("company_id"):
+        tenants.append(f"company:{row['company_id']}")
+    return tenants
+
+
+class DuplicateIndex:
+    """
+    Invoice rows keyed by tenant plus normalized invoice number, vendor +
+    amount and page-hash bands.
+    """
+
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}
+        self._keys: Dict[str, list] = {}  # id -> its bucket keys, to undo upsert
+        self._buckets: Dict[tuple, Set[str]] = {}
+        self.watermark: Optional[tuple] = None  # (updated_at, id) of the newest synced row
+        self.last_sync = 0.0
+        self.last_full_sync = 0.0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _row_keys(self, row: dict) -> list:
+        keys = []
+        tenants = row_tenants(row)
+        if not tenants:
+            return keys
+        number = normalize_invoice_no(row.get("invoice_number"))
+        if number:
+            keys.append(("no", number))
+        vendor, cents = normalize_vendor(row.get("vendor_name")), amount_cents(row.get("amount"))
+        if vendor and cents is not None:
+            keys.append(("vendor_amount", vendor, cents))
+        page_hash = parse_hash(row.get("page_hash"))
+        if page_hash is not None:
+            keys.extend(("band",) + band for band in _bands(page_hash))
+        return [(tenant,) + key for tenant in tenants for key in keys]
+
+    def upsert(self, row: dict):
+        invoice_id = row["id"]
+        if invoice_id in self.rows:
+            self.remove(invoice_id)
+        keys = self._row_keys(row)
+        self.rows[invoice_id] = row
+        self._keys[invoice_id] = keys
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(invoice_id)
+
+    def remove(self, invoice_id: str):
+        if self.rows.pop(invoice_id, None) is None:
+            return
+        for key in self._keys.pop(invoice_id, ()):
+            ids = self._buckets.get(key)
+            if ids is not None:
+                ids.discard(invoice_id)
+                if not ids:
+                    del self._buckets[key]
+
+    def find(self, tenant: str, fields: dict, page_hash: Optional[str] = None,
+             min_score: float = DUPLICATE_MIN_SCORE, limit: int = DUPLICATE_MAX_MATCHES) -> List[dict]:
+        """
+        Rows of `tenant` that look like the same invoice as the extracted
+        fields (and first-page hash), best first, with a 0..1 score and the
+        reasons.
+        """
+        number = normalize_invoice_no(fields.get("invoice_no"))
+        vendor = normalize_vendor(fields.get("vendor_name"))
+        cents = amount_cents(fields.get("amount"))
+        hash_value = parse_hash(page_hash)
+
+        candidates: Set[str] = set()
+        if number:
+            candidates.update(self._buckets.get((tenant, "no", number), ()))
+        if vendor and cents is not None:
+            candidates.update(self._buckets.get((tenant, "vendor_amount", vendor, cents), ()))
+        if hash_value is not None:
+            for band in _bands(hash_value):
+                ids = self._buckets.get((tenant, "band") + band, ())
+                if len(ids) <= _BAND_MAX_ROWS:
+                    candidates.update(ids)
+
+        matches = []
+        for invoice_id in candidates:
+            row = self.rows[invoice_id]
+            reasons, score = [], 0.0
+            if number and normalize_invoice_no(row.get("invoice_number")) == number:
+                reasons.append("invoice_no")
+                score += 0.5
+            if vendor and normalize_vendor(row.get("vendor_name")) == vendor:
+                reasons.append("vendor")
+                score += 0.3
+            if cents is not None and amount_cents(row.get("amount")) == cents:
+                reasons.append("amount")
+                score += 0.2
+
+            distance = None
+            row_hash = parse_hash(row.get("page_hash"))
+            if hash_value is not None and row_hash is not None:
+                distance = bin(hash_value ^ row_hash).count("1")
+                if distance <= DUPLICATE_HASH_DISTANCE:
+                    reasons.append("page_image")
+                    # A near-identical page is strong evidence on its own: 0.9
+                    # for the same page down to 0.6 at the distance limit
+                    score = max(score, 0.9 - 0.3 * distance / max(DUPLICATE_HASH_DISTANCE, 1)) + 0.1 * (score > 0)
+
+            score = round(min(score, 1.0), 3)
+            if score < min_score:
+                continue
+            match = {"invoice_id": invoice_id, "score": score}
+            if owns(tenant, row):
+                match.update(
+                    invoice_number=row.get("invoice_number"),
+                    vendor_name=row.get("vendor_name"),
+                    amount=row.get("amount"),
+                    status=row.get("status"),
+                    reasons=reasons,
+                    hash_distance=distance,
+                )
+            matches.append(match)
+
+        matches.sort(key=lambda m: -m["score"])
+        return matches[:limit]
+
+
+class DuplicateIndexSync:
+    """
+    Keeps a DuplicateIndex current from the invoices table in the background.
+
+    Args:
+        store: Data access (db.Store) used to read the invoices table
+    """
+
+    def __init__(self, store: Store):
+        self.store = store
+        self.index: Optional[DuplicateIndex] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.index is not None
+
+    def find(self, tenant: str, fields: dict, page_hash: Optional[str] = None) -> Optional[List[dict]]:
+        """
+        Likely duplicates of an extracted invoice among the invoices `tenant`
+        can see, or None until the first load has finished. Callers without
+        a tenant get no matches.
+        """
+        if self.index is None:
+            return None
+        if tenant == ANONYMOUS:
+            return []
+        return self.index.find(tenant, fields, page_hash)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def sync(self):
+        """
+        Bring the index up to date: a full load when there is none or it is
+        older than DUPLICATE_FULL_REFRESH, otherwise only the changed rows.
+        """
+        now = time.monotonic()
+        index = self.index
+        if index is None or now - index.last_full_sync > DUPLICATE_FULL_REFRESH:
+            fresh = DuplicateIndex()
+            with span("supabase.duplicate_index_load"):
+                await self._full_load(fresh)
+            fresh.last_sync = fresh.last_full_sync = now
+            # Swapped in whole so lookups never see a half-built index
+            self.index = fresh
+        else:
+            with span("supabase.duplicate_index_sync"):
+                await self._incremental_load(index)
+            index.last_sync = now
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Duplicate index sync failed: {e}")
+            await asyncio.sleep(DUPLICATE_SYNC_INTERVAL)
+
+    def _advance_watermark(self, index: DuplicateIndex, row: dict):
+        if row.get("updated_at"):
+            key = (row["updated_at"], row["id"])
+            if index.watermark is None or key > index.watermark:
+                index.watermark = key
+
+    async def _full_load(self, index: DuplicateIndex):
+        last_id = None
+        while True:
+            rows = await self.store.duplicate_page(last_id, DUPLICATE_PAGE_SIZE)
+            for row in rows:
+                index.upsert(row)
+                self._advance_watermark(index, row)
+            if len(rows) < DUPLICATE_PAGE_SIZE:
+                return
+            last_id = rows[-1]["id"]
+
+    async def _incremental_load(self, index: DuplicateIndex):
+        while index.watermark is not None:
+            rows = await self.store.duplicate_changes(index.watermark, DUPLICATE_PAGE_SIZE)
+            for row in rows:
+                index.upsert(row)
+                self._advance_watermark(index, row)
+            if len(rows) < DUPLICATE_PAGE_SIZE:
+                return
+
+
+class PageHashes:
+    """
+    First-page dHash of uploads, remembered by content hash so re-uploads
+    and retries are not decoded or rendered again.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, upload: Upload) -> Optional[str]:
+        """
+        Hex page hash of the upload, or None if it cannot be decoded.
+        Blocking; run in a thread.
+        """
+        key = upload.digest()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        value = page_hash(upload)
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+def page_hash(upload: Upload) -> Optional[str]:
+    """
+    dHash of the first page as 64 hex digits. PDFs are rendered at
+    DUPLICATE_HASH_DPI; JPEGs are decoded at reduced size.
+    """
+    try:
+        if "pdf" in upload.content_type:
+            with upload.as_path(".pdf") as pdf_path:
+                images = render_pages(pdf_path, 1, 1, DUPLICATE_HASH_DPI)
+            if not images:
+                return None
+            return f"{dhash(images[0]):064x}"
+
+        upload.file.seek(0)
+        with Image.open(upload.file) as image:
+            image.draft("L", (512, 512))
+            return f"{dhash(image):064x}"
+    except Exception as e:
+        print(f"Page hash failed for {upload.filename or 'upload'}: {e}")
+        return None
@@ -0,0 +1,229 @@
+"""
+Bulk invoice export for reconciliation.
+
+GET /invoices/export walks the invoices table (with each invoice's approvals
+and disputes) in keyset pages ordered by id and writes every page to the
+response as soon as it is encoded, as gzip-compressed CSV or as Parquet with
+one row group per page. The next page is fetched while the current one is
+encoded, and only those two pages are ever held in memory, so the size of
+the export doesn't change the server's footprint.
+
+Parquet needs the optional pyarrow package (pip install pyarrow).
+"""
+import asyncio
+import csv
+import io
+import os
+import zlib
+from datetime import date, datetime
+from typing import AsyncIterator, List, Optional
+
+from db import ExportFilter, Store
+from metrics import EXPORT_ROWS, span
+
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "5000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+
+OPEN_DISPUTE_STATUSES = ("open", "under_review")
+
+# Output columns: the invoice, then its approval and dispute history folded
+# into a few columns so every invoice is one row
+INVOICE_FIELDS = (
+    "id", "invoice_number", "vendor_name", "amount", "currency", "status", "invoice_date", "due_date",
+    "company_id", "user_id", "created_at", "updated_at",
+)
+EXPORT_FIELDS = INVOICE_FIELDS + (
+    "approval_count", "last_approval_action", "last_approval_at",
+    "dispute_count", "open_dispute_count", "last_dispute_type",
+)
+DATE_FIELDS = ("invoice_date", "due_date")
+TIMESTAMP_FIELDS = ("created_at", "updated_at", "last_approval_at")
+COUNT_FIELDS = ("approval_count", "dispute_count", "open_dispute_count")
+
+
+def _created_at(child: dict) -> str:
+    return child.get("created_at") or ""
+
+
+def flatten(row: dict) -> tuple:
+    """
+    One export row, values in EXPORT_FIELDS order, from an invoice with
+    embedded invoice_approvals and invoice_disputes.
+    """
+    # Tuples rather than dicts: this runs once per exported row
+    invoice = tuple(map(row.get, INVOICE_FIELDS))
+    approvals = row.get("invoice_approvals")
+    disputes = row.get("invoice_disputes")
+    if approvals:
+        last = max(approvals, key=_created_at)
+        approval = (len(approvals), last.get("action"), last.get("created_at"))
+    else:
+        approval = (0, None, None)
+    if disputes:
+        last = max(disputes, key=_created_at)
+        open_count = sum(d.get("status") in OPEN_DISPUTE_STATUSES for d in disputes)
+        dispute = (len(disputes), open_count, last.get("dispute_type"))
+    else:
+        dispute = (0, 0, None)
+    return invoice + approval + dispute
+
+
+class CSVEncoder:
+    """
+    Gzip-compressed CSV; the header goes out with the first page.
+    """
+
+    media_type = "application/gzip"
+    extension = "csv.gz"
+    format = "csv"
+
+    def __init__(self, level: int = EXPORT_GZIP_LEVEL):
+        # wbits 31: gzip container rather than a bare zlib stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._writer.writerow(EXPORT_FIELDS)
+
+    def encode(self, rows: List[dict]) -> bytes:
+        self._writer.writerows(map(flatten, rows))
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return self._compressor.compress(text.encode("utf-8"))
+
+    def close(self) -> bytes:
+        return self._compressor.compress(self._buffer.getvalue().encode("utf-8")) + self._compressor.flush()
+
+
+class _Drain(io.RawIOBase):
+    """
+    Write-only file that hands written bytes back to the caller, so the
+    Parquet writer's output can be streamed instead of collected.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parse_date(value) -> Optional[date]:
+    try:
+        return date.fromisoformat(str(value)[:10]) if value else None
+    except ValueError:
+        return None
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(str(value)) if value else None
+    except ValueError:
+        return None
+
+
+class ParquetEncoder:
+    """
+    Parquet, one row group per page.
+
+    Raises:
+        RuntimeError: pyarrow is not installed
+    """
+
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+    format = "parquet"
+
+    def __init__(self, compression: str = EXPORT_PARQUET_COMPRESSION):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs the 'pyarrow' package (pip install pyarrow)")
+
+        types = {field: pa.string() for field in EXPORT_FIELDS}
+        types["amount"] = pa.float64()
+        types.update({field: pa.date32() for field in DATE_FIELDS})
+        types.update({field: pa.timestamp("us", tz="UTC") for field in TIMESTAMP_FIELDS})
+        types.update({field: pa.int32() for field in COUNT_FIELDS})
+        self._pa = pa
+        self._schema = pa.schema([(field, types[field]) for field in EXPORT_FIELDS])
+        self._sink = _Drain()
+        self._writer = pq.ParquetWriter(self._sink, self._schema, compression=compression)
+
+    def encode(self, rows: List[dict]) -> bytes:
+        columns = {}
+        for field, values in zip(EXPORT_FIELDS, zip(*map(flatten, rows))):
+            if field in DATE_FIELDS:
+                values = [_parse_date(value) for value in values]
+            elif field in TIMESTAMP_FIELDS:
+                values = [_parse_timestamp(value) for value in values]
+            elif field == "amount":
+                values = [float(value) if value is not None else None for value in values]
+            elif field not in COUNT_FIELDS:
+                values = [str(value) if value is not None else None for value in values]
+            columns[field] = list(values)
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+        return self._sink.take()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._sink.take()
+
+
+ENCODERS = {"csv": CSVEncoder, "parquet": ParquetEncoder}
+
+
+async def iter_pages(store: Store, filters: ExportFilter, page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[List[dict]]:
+    """
+    Yield pages of matching invoices, fetching the next page while the
+    caller works on the current one.
+    """
+
+    async def fetch(after_id: Optional[str]) -> List[dict]:
+        with span("supabase.export_page"):
+            return await store.export_page(filters, after_id, page_size)
+
+    pending = asyncio.ensure_future(fetch(None))
+    try:
+        while True:
+            rows = await pending
+            # Only an empty page ends the scan: PostgREST's max-rows setting
+            # (1000 on Supabase by default) may return short pages before that
+            if not rows:
+                return
+            pending = asyncio.ensure_future(fetch(rows[-1]["id"]))
+            yield rows
+    finally:
+        # The client went away mid-export
+        if not pending.done():
+            pending.cancel()
+
+
+async def stream_export(store: Store, filters: ExportFilter, encoder) -> AsyncIterator[bytes]:
+    """
+    The encoded export, one chunk per page.
+    """
+    async for rows in iter_pages(store, filters):
+        # Encoding and compression run off the event loop
+        chunk = await asyncio.to_thread(encoder.encode, rows)
+        EXPORT_ROWS.inc(len(rows), format=encoder.format)
+        if chunk:
+            yield chunk
+    yield await asyncio.to_thread(encoder.close)
@@ -0,0 +1,277 @@
+"""
+Content-addressed cache for /extract_invoice results.
+
+Entries are keyed by a hash of the uploaded bytes plus the pipeline version
+and configuration, so a re-upload of the same file returns the stored OCR
+text and extracted fields instead of rerunning OCR and the LLM. Any change to
+the pipeline (DPI, Tesseract flags, model...) produces a new key.
+
+There are two tiers:
+- DiskCacheTier: local JSON files with TTL and size-based LRU eviction
+- an optional shared tier (anything implementing CacheTier, e.g. RedisCacheTier)
+
+PageCheckpoints keeps the OCR text of finished pages under the same key while
+a document is still being processed, so a retried extraction resumes after
+the last finished page instead of starting over.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", os.path.join(".cache", "extractions"))
+EXTRACTION_CACHE_MAX_MB = int(os.getenv("EXTRACTION_CACHE_MAX_MB", "512"))
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", str(7 * 24 * 3600)))
+EXTRACTION_CACHE_REDIS_URL = os.getenv("EXTRACTION_CACHE_REDIS_URL")
+EXTRACTION_CHECKPOINT_TTL = int(os.getenv("EXTRACTION_CHECKPOINT_TTL", str(24 * 3600)))
+
+
+def cache_key(content_hash: str, pipeline_version: str, config: dict) -> str:
+    """
+    Build a cache key from the sha256 of the file, pipeline version and config.
+    """
+    digest = hashlib.sha256(content_hash.encode("ascii"))
+    digest.update(b"\0" + pipeline_version.encode("utf-8"))
+    digest.update(b"\0" + json.dumps(config, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CacheTier:
+    """
+    Interface for a cache tier. Values are JSON-serializable dicts.
+    """
+
+    def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: dict):
+        raise NotImplementedError
+
+
+class DiskCacheTier(CacheTier):
+    """
+    Local on-disk tier: one JSON file per entry.
+
+    Entries older than `ttl` seconds are treated as misses and removed. When
+    the total size exceeds `max_bytes`, the least recently used entries are
+    evicted. Recency is tracked in memory and seeded from file mtimes.
+    """
+
+    def __init__(self, directory: str = EXTRACTION_CACHE_DIR, max_bytes: int = EXTRACTION_CACHE_MAX_MB * 1024 * 1024, ttl: int = EXTRACTION_CACHE_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, oldest first
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name[:-5], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def _remove(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self._remove(key)
+                return None
+
+            if time.time() - entry.get("created_at", 0) > self.ttl:
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return entry.get("value")
+
+    def set(self, key: str, value: dict):
+        data = json.dumps({"created_at": time.time(), "value": value}).encode("utf-8")
+        with self._lock:
+            path = self._path(key)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+
+class RedisCacheTier(CacheTier):
+    """
+    Shared tier backed by Redis, so all API replicas see each other's results.
+    Requires the optional `redis` package.
+    """
+
+    def __init__(self, url: str, ttl: int = EXTRACTION_CACHE_TTL, prefix: str = "extraction:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("EXTRACTION_CACHE_REDIS_URL is set but the 'redis' package is not installed")
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[dict]:
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, value: dict):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+
+class ExtractionCache:
+    """
+    Two-tier read-through cache with hit/miss counters.
+
+    Lookups try the local tier first, then the shared tier (a shared hit is
+    copied into the local tier). Writes go to both. Errors in the shared tier
+    are counted and otherwise ignored so an outage only costs cache hits.
+    """
+
+    def __init__(self, local: CacheTier, shared: Optional[CacheTier] = None):
+        self.local = local
+        self.shared = shared
+        self.stats = {"local_hits": 0, "shared_hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self.local.get(key)
+        if value is not None:
+            self.stats["local_hits"] += 1
+            return value
+
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Shared cache error: {e}")
+                value = None
+            if value is not None:
+                self.stats["shared_hits"] += 1
+                self.local.set(key, value)
+                return value
+
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: dict):
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Shared cache error: {e}")
+        self.stats["writes"] += 1
+
+
+class PageCheckpoints:
+    """
+    Per-page OCR text of documents whose extraction has not finished yet.
+
+    Each document is one JSON-lines file named after its cache key, with one
+    {"page", "text"} record appended per finished page. A torn last line
+    (crash mid-write) is ignored. Files untouched for `ttl` seconds are
+    abandoned and removed; finished documents are dropped by the caller once
+    the full result is in the extraction cache.
+    """
+
+    def __init__(self, directory: str = os.path.join(EXTRACTION_CACHE_DIR, "checkpoints"), ttl: int = EXTRACTION_CHECKPOINT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.prune()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.jsonl")
+
+    def prune(self):
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+    def load(self, key: str) -> Dict[int, str]:
+        """
+        Page number -> OCR text for every checkpointed page of `key`.
+        """
+        pages: Dict[int, str] = {}
+        path = self._path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.ttl:
+                self.discard(key)
+                return pages
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    pages[record["page"]] = record["text"]
+        except OSError:
+            pass
+        return pages
+
+    def add(self, key: str, pages: Dict[int, str]):
+        lines = "".join(json.dumps({"page": page, "text": text}) + "\n" for page, text in pages.items())
+        with self._lock:
+            with open(self._path(key), "a", encoding="utf-8") as f:
+                f.write(lines)
+
+    def discard(self, key: str):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+
+def create_extraction_cache() -> ExtractionCache:
+    """
+    Build the cache from environment configuration.
+    """
+    shared = RedisCacheTier(EXTRACTION_CACHE_REDIS_URL) if EXTRACTION_CACHE_REDIS_URL else None
+    return ExtractionCache(DiskCacheTier(), shared)
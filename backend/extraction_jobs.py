@@ -0,0 +1,234 @@
+"""
+Asynchronous single-document extraction jobs.
+
+POST /extract_invoice/jobs spools the upload to disk and returns a job id at
+once; a fixed pool of workers runs the normal extraction pipeline in the
+background. While a job runs, the pipeline reports progress through
+report_progress() (page count, pages rasterized, pages OCR'd, AI extraction
+done), and clients follow it as server-sent events, so no HTTP request is
+held open for the whole OCR and LLM run.
+
+A failed job keeps its spooled file until it expires; retrying it re-runs the
+pipeline, which picks up the pages already OCR'd from the page checkpoints
+(see extraction_cache.PageCheckpoints) instead of starting over.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from ocr_engine import OCREngineBusy
+from scheduler import ANONYMOUS
+from uploads import CHUNK_SIZE, Upload
+
+
+EXTRACTION_JOB_WORKERS = int(os.getenv("EXTRACTION_JOB_WORKERS", "2"))
+EXTRACTION_JOB_TTL = int(os.getenv("EXTRACTION_JOB_TTL", "3600"))
+# Comment line sent on idle event streams so proxies don't cut them off
+EXTRACTION_JOB_KEEPALIVE = float(os.getenv("EXTRACTION_JOB_KEEPALIVE", "15"))
+
+_current_job: contextvars.ContextVar[Optional["ExtractionJob"]] = contextvars.ContextVar("extraction_job", default=None)
+
+
+def report_progress(event: str, **data):
+    """
+    Record a progress event on the job running in this context, if any.
+    A no-op for synchronous /extract_invoice requests.
+    """
+    job = _current_job.get()
+    if job is not None:
+        job.emit(event, data)
+
+
+class ExtractionJob:
+    """
+    State of one extraction job: status, event log and final result.
+    """
+
+    def __init__(self, job_id: str, path: str, content_type: str, filename: str, tenant: str = ANONYMOUS):
+        self.id = job_id
+        self.path = path
+        self.content_type = content_type
+        self.filename = filename
+        self.tenant = tenant
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.status = "queued"
+        self.attempts = 0
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.events: List[dict] = []
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error")
+
+    def emit(self, event: str, data: dict):
+        self.events.append({"id": len(self.events), "event": event, "data": data})
+        # Wake every waiter, then start a fresh event for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "attempts": self.attempts,
+            "progress": self.events[-1] if self.events else None,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class ExtractionJobManager:
+    """
+    Owns the work queue, the worker tasks and the in-memory job registry.
+
+    Args:
+        process: async (upload, tenant) -> result dict; raises on failure
+        workers: Number of concurrent worker tasks
+    """
+
+    def __init__(self, process: Callable[[Upload, str], Awaitable[dict]], workers: int = EXTRACTION_JOB_WORKERS):
+        self.process = process
+        self.workers = workers
+        self.jobs: Dict[str, ExtractionJob] = {}
+        self.directory: Optional[str] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="extraction-jobs-")
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at and now - job.finished_at > EXTRACTION_JOB_TTL:
+                del self.jobs[job_id]
+                self._remove_file(job)
+
+    @staticmethod
+    def _remove_file(job: ExtractionJob):
+        try:
+            os.unlink(job.path)
+        except OSError:
+            pass
+
+    async def submit(self, upload: Upload, tenant: str = ANONYMOUS) -> ExtractionJob:
+        """
+        Spool the upload to disk and enqueue it for `tenant`. The caller
+        checks its size.
+        """
+        self._ensure_workers()
+        self._prune()
+
+        job_id = uuid.uuid4().hex
+        job = ExtractionJob(job_id, os.path.join(self.directory, job_id), upload.content_type, upload.filename, tenant)
+        await asyncio.to_thread(self._spool, job, upload)
+        self.jobs[job_id] = job
+        job.emit("queued", {"position": self._queue.qsize() + 1})
+        self._queue.put_nowait(job)
+        return job
+
+    @staticmethod
+    def _spool(job: ExtractionJob, upload: Upload):
+        upload.file.seek(0)
+        with open(job.path, "wb") as f:
+            shutil.copyfileobj(upload.file, f, CHUNK_SIZE)
+
+    def retry(self, job: ExtractionJob) -> bool:
+        """
+        Re-enqueue a failed job. Returns False unless the job failed and
+        its spooled file is still there.
+        """
+        if job.status != "error" or not os.path.exists(job.path):
+            return False
+        self._ensure_workers()
+        job.status = "queued"
+        job.error = None
+        job.finished_at = None
+        job.emit("queued", {"position": self._queue.qsize() + 1, "retry": True})
+        self._queue.put_nowait(job)
+        return True
+
+    async def _worker(self):
+        # shutdown() drops self._queue while workers may still be unwinding
+        queue = self._queue
+        while True:
+            job = await queue.get()
+            try:
+                await self._run_job(job)
+            finally:
+                queue.task_done()
+
+    async def _run_job(self, job: ExtractionJob):
+        job.status = "processing"
+        job.attempts += 1
+        job.emit("started", {"attempt": job.attempts})
+        _current_job.set(job)
+        try:
+            with Upload.open_path(job.path, job.content_type, job.filename) as upload:
+                while True:
+                    try:
+                        job.result = await self.process(upload, job.tenant)
+                        break
+                    except OCREngineBusy as e:
+                        # Background work waits its turn instead of failing
+                        job.emit("waiting", {"retry_after": e.retry_after})
+                        await asyncio.sleep(e.retry_after)
+            job.status = "done"
+            self._remove_file(job)
+            job.emit("done", job.result)
+        except Exception as e:
+            # Keep the spooled file so the job can be retried
+            job.status = "error"
+            job.error = getattr(e, "detail", None) or str(e)
+            job.emit("failed", {"detail": job.error})
+        finally:
+            _current_job.set(None)
+            job.finished_at = time.time()
+
+    async def stream(self, job: ExtractionJob, last_event_id: int = -1):
+        """
+        Yield the job's events as server-sent events, starting after
+        `last_event_id` (EventSource sends it back when it reconnects), until
+        the job finishes.
+        """
+        sent = last_event_id + 1
+        while True:
+            finished = job.finished
+            for event in job.events[sent:]:
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+            sent = len(job.events)
+            if finished:
+                return
+            before = sent
+            await job.wait_for_change(EXTRACTION_JOB_KEEPALIVE)
+            if len(job.events) == before and not job.finished:
+                yield ": keep-alive\n\n"
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queue = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
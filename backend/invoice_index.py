@@ -0,0 +1,290 @@
+"""
+In-memory retrieval index over invoices for the chat endpoint.
+
+Instead of pasting every invoice into the prompt, /chat asks the tenant's
+index for the top-k rows relevant to the question plus a few precomputed
+aggregates (totals by status, overdue count), so prompt size stays bounded
+no matter how many invoices exist.
+
+Each tenant (the admin view, or one user's invoices) gets its own index. It
+is built once with keyset pagination and then kept current incrementally by
+fetching only rows whose updated_at moved past the last sync; a periodic full
+rebuild, run in the background while the old index keeps answering, picks up
+deletions. Only the CHAT_INDEX_MAX_TENANTS most recently used indexes are
+kept.
+"""
+import asyncio
+import bisect
+import heapq
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List, Optional, Set
+
+from db import Store
+from metrics import span
+
+CHAT_INDEX_TOP_K = int(os.getenv("CHAT_INDEX_TOP_K", "20"))
+CHAT_INDEX_SYNC_INTERVAL = float(os.getenv("CHAT_INDEX_SYNC_INTERVAL", "30"))
+CHAT_INDEX_FULL_REFRESH = float(os.getenv("CHAT_INDEX_FULL_REFRESH", "600"))
+CHAT_INDEX_PAGE_SIZE = int(os.getenv("CHAT_INDEX_PAGE_SIZE", "1000"))
+CHAT_INDEX_MAX_TENANTS = int(os.getenv("CHAT_INDEX_MAX_TENANTS", "256"))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Words in a question that point at a subset of invoices rather than a token
+UNPAID_WORDS = {"unpaid", "outstanding", "open", "owe", "owed", "pending"}
+OVERDUE_WORDS = {"overdue", "late", "past", "missed"}
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(str(text).lower())
+
+
+def _row_tokens(row: dict) -> Set[str]:
+    tokens = set()
+    for field in ("vendor_name", "invoice_number", "status"):
+        if row.get(field):
+            tokens.update(tokenize(row[field]))
+    if row.get("invoice_number"):
+        tokens.add(str(row["invoice_number"]).lower())
+    if row.get("amount") is not None:
+        tokens.add(str(int(float(row["amount"]))))
+    for field in ("due_date", "invoice_date"):
+        value = row.get(field)
+        if value:
+            # "2025-03-14" is searchable as 2025, 03, 14 and the month "2025-03"
+            tokens.update(tokenize(value))
+            tokens.add(str(value)[:7])
+    return tokens
+
+
+class InvoiceIndex:
+    """
+    Inverted index plus incrementally maintained aggregates for one tenant.
+    """
+
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._tokens: Dict[str, Set[str]] = {}
+        self._status_totals: Dict[str, List[float]] = {}  # status -> [count, amount]
+        self._unpaid_by_due: List[tuple] = []  # sorted (due_date, id) of unpaid rows
+        self.watermark: Optional[tuple] = None  # (updated_at, id) of the newest synced row
+        self.last_sync = 0.0
+        self.last_full_sync = 0.0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def upsert(self, row: dict):
+        invoice_id = row["id"]
+        if invoice_id in self.rows:
+            self.remove(invoice_id)
+
+        self.rows[invoice_id] = row
+        tokens = _row_tokens(row)
+        self._tokens[invoice_id] = tokens
+        for token in tokens:
+            self._postings.setdefault(token, set()).add(invoice_id)
+
+        totals = self._status_totals.setdefault(row.get("status") or "unknown", [0, 0.0])
+        totals[0] += 1
+        totals[1] += float(row.get("amount") or 0)
+
+        if row.get("status") != "paid" and row.get("due_date"):
+            bisect.insort(self._unpaid_by_due, (str(row["due_date"]), invoice_id))
+
+    def remove(self, invoice_id: str):
+        row = self.rows.pop(invoice_id, None)
+        if row is None:
+            return
+
+        for token in self._tokens.pop(invoice_id, ()):
+            ids = self._postings.get(token)
+            if ids is not None:
+                ids.discard(invoice_id)
+                if not ids:
+                    del self._postings[token]
+
+        totals = self._status_totals.get(row.get("status") or "unknown")
+        if totals:
+            totals[0] -= 1
+            totals[1] -= float(row.get("amount") or 0)
+
+        if row.get("status") != "paid" and row.get("due_date"):
+            key = (str(row["due_date"]), invoice_id)
+            i = bisect.bisect_left(self._unpaid_by_due, key)
+            if i < len(self._unpaid_by_due) and self._unpaid_by_due[i] == key:
+                del self._unpaid_by_due[i]
+
+    def _overdue_ids(self, today: str) -> List[str]:
+        end = bisect.bisect_left(self._unpaid_by_due, (today,))
+        return [invoice_id for _, invoice_id in self._unpaid_by_due[:end]]
+
+    def search(self, query: str, k: int = CHAT_INDEX_TOP_K, today: Optional[str] = None) -> List[dict]:
+        """
+        Return up to k rows ranked by relevance to the query.
+
+        Rows score the IDF of every query token they contain. Questions about
+        unpaid or overdue invoices also boost those rows. With no match at
+        all, the unpaid invoices due soonest are returned.
+        """
+        today = today or date.today().isoformat()
+        words = set(tokenize(query))
+        total = max(len(self.rows), 1)
+        scores: Dict[str, float] = {}
+
+        for word in words:
+            ids = self._postings.get(word)
+            if not ids:
+                continue
+            idf = math.log(1 + total / len(ids))
+            for invoice_id in ids:
+                scores[invoice_id] = scores.get(invoice_id, 0.0) + idf
+
+        if words & OVERDUE_WORDS:
+            for invoice_id in self._overdue_ids(today):
+                scores[invoice_id] = scores.get(invoice_id, 0.0) + 2.0
+        if words & UNPAID_WORDS:
+            for _, invoice_id in self._unpaid_by_due:
+                scores[invoice_id] = scores.get(invoice_id, 0.0) + 1.0
+
+        if not scores:
+            ranked = [invoice_id for _, invoice_id in self._unpaid_by_due[:k]]
+        else:
+            ranked = heapq.nsmallest(k, scores, key=lambda i: (-scores[i], str(self.rows[i].get("due_date") or "")))
+        return [self.rows[invoice_id] for invoice_id in ranked]
+
+    def aggregates(self, today: Optional[str] = None) -> dict:
+        today = today or date.today().isoformat()
+        overdue = self._overdue_ids(today)
+        return {
+            "invoice_count": len(self.rows),
+            "total_amount": round(sum(t[1] for t in self._status_totals.values()), 2),
+            "by_status": {
+                status: {"count": int(t[0]), "amount": round(t[1], 2)}
+                for status, t in self._status_totals.items() if t[0]
+            },
+            "overdue_count": len(overdue),
+            "overdue_amount": round(sum(float(self.rows[i].get("amount") or 0) for i in overdue), 2),
+        }
+
+
+class InvoiceIndexRegistry:
+    """
+    Builds, caches and syncs one InvoiceIndex per tenant.
+
+    Args:
+        store: Data access (db.Store) used to read the invoices table
+        max_tenants: Indexes kept before the least recently used is dropped
+    """
+
+    def __init__(self, store: Store, max_tenants: int = CHAT_INDEX_MAX_TENANTS):
+        self.store = store
+        self.max_tenants = max_tenants
+        self._indexes: "OrderedDict[str, InvoiceIndex]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._rebuilds: Dict[str, asyncio.Task] = {}
+
+    async def get(self, user_id: Optional[str]) -> InvoiceIndex:
+        """
+        Return the index for a user's invoices, or for all invoices when
+        user_id is None (admin), syncing it first if it is stale.
+
+        Only a tenant's first request waits for a full load. Once the index
+        is older than CHAT_INDEX_FULL_REFRESH it is rebuilt in the background
+        and swapped in when done; until then it is synced incrementally.
+        """
+        tenant = user_id or "*"
+        lock = self._locks.setdefault(tenant, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(tenant)
+            now = time.monotonic()
+            if index is None:
+                index = await self._build(user_id)
+                self._store(tenant, index)
+                return index
+
+            self._indexes.move_to_end(tenant)
+            if now - index.last_full_sync > CHAT_INDEX_FULL_REFRESH and tenant not in self._rebuilds:
+                task = asyncio.create_task(self._rebuild(tenant, user_id))
+                self._rebuilds[tenant] = task
+                task.add_done_callback(lambda _: self._rebuilds.pop(tenant, None))
+            if now - index.last_sync > CHAT_INDEX_SYNC_INTERVAL:
+                with span("supabase.chat_index_sync"):
+                    await self._incremental_load(index, user_id)
+                index.last_sync = now
+            return index
+
+    async def close(self):
+        """Cancel background rebuilds still running."""
+        tasks = list(self._rebuilds.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _build(self, user_id: Optional[str]) -> InvoiceIndex:
+        now = time.monotonic()
+        fresh = InvoiceIndex()
+        with span("supabase.chat_index_load"):
+            await self._full_load(fresh, user_id)
+        fresh.last_sync = fresh.last_full_sync = now
+        return fresh
+
+    async def _rebuild(self, tenant: str, user_id: Optional[str]):
+        try:
+            fresh = await self._build(user_id)
+        except Exception as e:
+            print(f"Chat index rebuild failed for {tenant}: {e}")
+            return
+        async with self._locks.setdefault(tenant, asyncio.Lock()):
+            # Evicted while rebuilding: the next request loads it anew
+            if tenant not in self._indexes:
+                return
+            # Catch up on rows changed during the load, then swap it in whole
+            # so searches never see a half-built index
+            with span("supabase.chat_index_sync"):
+                await self._incremental_load(fresh, user_id)
+            fresh.last_sync = time.monotonic()
+            self._indexes[tenant] = fresh
+
+    def _store(self, tenant: str, index: InvoiceIndex):
+        self._indexes[tenant] = index
+        self._indexes.move_to_end(tenant)
+        while len(self._indexes) > self.max_tenants:
+            evicted, _ = self._indexes.popitem(last=False)
+            lock = self._locks.get(evicted)
+            if lock is not None and not lock.locked():
+                del self._locks[evicted]
+
+    def _advance_watermark(self, index: InvoiceIndex, row: dict):
+        if row.get("updated_at"):
+            key = (row["updated_at"], row["id"])
+            if index.watermark is None or key > index.watermark:
+                index.watermark = key
+
+    async def _full_load(self, index: InvoiceIndex, user_id: Optional[str]):
+        # Keyset pagination on id; PostgREST caps un-paginated selects anyway
+        last_id = None
+        while True:
+            rows = await self.store.index_page(user_id, last_id, CHAT_INDEX_PAGE_SIZE)
+            for row in rows:
+                index.upsert(row)
+                self._advance_watermark(index, row)
+            if len(rows) < CHAT_INDEX_PAGE_SIZE:
+                return
+            last_id = rows[-1]["id"]
+
+    async def _incremental_load(self, index: InvoiceIndex, user_id: Optional[str]):
+        # Keyset pagination on (updated_at, id) starting after the watermark
+        while index.watermark is not None:
+            rows = await self.store.index_changes(user_id, index.watermark, CHAT_INDEX_PAGE_SIZE)
+            for row in rows:
+                index.upsert(row)
+                self._advance_watermark(index, row)
+            if len(rows) < CHAT_INDEX_PAGE_SIZE:
+                return
@@ -0,0 +1,267 @@
+"""
+Shared async LLM client.
+
+All OpenAI calls go through one AsyncOpenAI instance with a pooled HTTP
+client, so requests never block the event loop. On top of that:
+- a global and a per-endpoint concurrency limit
+- a timeout per request
+- jittered exponential retries, limited by a retry budget so retries cannot
+  multiply load during an outage
+- a circuit breaker that fails fast while the upstream is erroring or slow,
+  letting callers drop straight to their fallback (e.g. extract_with_regex)
+
+Set OPENAI_BASE_URL to point the client at a local stub server.
+
+The openai SDK is the slowest import in the backend, so it is only imported
+when the client is first built (warm() does that in a thread at startup).
+"""
+import asyncio
+import os
+import random
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+import httpx
+
+from metrics import span
+
+if TYPE_CHECKING:
+    import openai
+
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_ENDPOINT_CONCURRENCY = int(os.getenv("LLM_ENDPOINT_CONCURRENCY", "8"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BUDGET_RATIO = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+LLM_SLOW_CALL_SECONDS = float(os.getenv("LLM_SLOW_CALL_SECONDS", "15"))
+
+
+def _openai():
+    import openai
+
+    return openai
+
+
+def retryable_errors() -> tuple:
+    openai = _openai()
+    return (
+        asyncio.TimeoutError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised without calling upstream while the circuit breaker is open.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM circuit open, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class RetryBudget:
+    """
+    Token bucket that allows retries only up to a fraction of recent requests.
+
+    Every request deposits `ratio` tokens (capped at `max_tokens`); every
+    retry withdraws one. When the upstream is down, retries stop as soon as
+    the budget is spent instead of tripling traffic.
+    """
+
+    def __init__(self, ratio: float = LLM_RETRY_BUDGET_RATIO, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed or slow calls and stays open
+    for `cooldown` seconds. After the cooldown a single trial call is let
+    through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            raise CircuitOpenError(max(remaining, 1))
+        if state == "half_open":
+            self._trial_in_flight = True
+
+    def release_trial(self):
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._consecutive_failures += 1
+        self._trial_in_flight = False
+        if self._opened_at is not None or self._consecutive_failures >= self.failures:
+            self._opened_at = time.monotonic()
+
+
+class LLMClient:
+    """
+    Async chat-completions client shared by every endpoint.
+
+    Args:
+        max_concurrency: Upper bound on in-flight requests across endpoints
+        endpoint_concurrency: Upper bound on in-flight requests per endpoint
+        timeout: Seconds before a single attempt is abandoned
+        max_retries: Retries per call (subject to the retry budget)
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        endpoint_concurrency: int = LLM_ENDPOINT_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+        base_url: Optional[str] = OPENAI_BASE_URL,
+    ):
+        self.max_concurrency = max_concurrency
+        self.endpoint_concurrency = endpoint_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_url = base_url
+        self.retry_budget = RetryBudget()
+        self.breaker = CircuitBreaker()
+        self._client: Optional["openai.AsyncOpenAI"] = None
+        self._global_limit: Optional[asyncio.Semaphore] = None
+        self._endpoint_limits: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self._client is not None
+
+    async def warm(self):
+        """
+        Import the SDK off the event loop and build the client, so the first
+        request doesn't pay for it.
+        """
+        await asyncio.to_thread(_openai)
+        self._get_client()
+
+    def _get_client(self) -> "openai.AsyncOpenAI":
+        if self._client is None:
+            openai = _openai()
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                timeout=self.timeout,
+            )
+            self._client = openai.AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=0,  # retries are handled here, under the budget
+            )
+            self._global_limit = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _endpoint_limit(self, endpoint: str) -> asyncio.Semaphore:
+        if endpoint not in self._endpoint_limits:
+            self._endpoint_limits[endpoint] = asyncio.Semaphore(self.endpoint_concurrency)
+        return self._endpoint_limits[endpoint]
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+
+    async def chat_completion(self, endpoint: str, **kwargs):
+        """
+        Run a chat completion for `endpoint` ("extract", "vision", "chat"...).
+
+        Raises:
+            CircuitOpenError: If the breaker is open; nothing is sent upstream
+            openai.OpenAIError / asyncio.TimeoutError: When all attempts fail
+        """
+        with span(f"openai.{endpoint}"):
+            return await self._chat_completion(endpoint, **kwargs)
+
+    async def _chat_completion(self, endpoint: str, **kwargs):
+        client = self._get_client()
+        openai = _openai()
+        retryable = retryable_errors()
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                async with self._endpoint_limit(endpoint), self._global_limit:
+                    started = time.monotonic()
+                    response = await asyncio.wait_for(
+                        client.chat.completions.create(**kwargs),
+                        timeout=self.timeout,
+                    )
+                    elapsed = time.monotonic() - started
+            except asyncio.CancelledError:
+                # Caller went away; don't leave a half-open trial dangling
+                self.breaker.release_trial()
+                raise
+            except retryable:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries or not self.retry_budget.withdraw():
+                    raise
+                attempt += 1
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            except openai.APIStatusError:
+                # 4xx: the upstream answered, the request itself was bad
+                self.breaker.record_success()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                raise
+
+            # A successful but slow call still counts against the upstream
+            if elapsed > LLM_SLOW_CALL_SECONDS:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return response
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
@@ -1,22 +1,125 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Header, Query, Request, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import pytesseract
-from pdf2image import convert_from_bytes
-from PIL import Image
-import io
-import os
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import asyncio
+import json
 import re
-from typing import Optional
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import List, Optional
 from dotenv import load_dotenv
-import openai
-from supabase import create_client, Client
+
+from batch_jobs import BATCH_MAX_FILE_MB, BATCH_MAX_TOTAL_MB, BatchManager, BatchTooLarge, GroupedExtractor
+import chunking
+from db import ExportFilter, Store, create_store
+from duplicates import DuplicateIndexSync, PageHashes
+from extraction_cache import ExtractionCache, PageCheckpoints, cache_key, create_extraction_cache
+from extraction_jobs import ExtractionJobManager, report_progress
+from exports import ENCODERS, stream_export
+from invoice_index import CHAT_INDEX_TOP_K, InvoiceIndexRegistry
+from llm_client import CircuitOpenError, LLMClient
+import metrics
+from metrics import BYTES_PROCESSED, PAGES_PROCESSED, TEMPLATE_MATCHES, Gauge, SlowRequestProfiler, span
+from notifications import NOTIFY_REQUEST_TIMEOUT, NotificationPipeline, create_sender
+from ocr_engine import TESSERACT_CONFIG, OCREngine, OCREngineBusy
+import regex_engine
+from scheduler import ANONYMOUS, BATCH, FairScheduler, RateLimited, SchedulerBusy, Work, resolve_tenant
+from preprocess import PREPROCESS_CLEAN_DPI, PREPROCESS_MIN_SCAN_DPI, PREPROCESS_TARGET_DPI, page_render_dpis
+from rasterizer import PDF_PAGE_WINDOW, PDFTooLarge, count_pages, iter_page_windows
+from text_layer import PDF_TEXT_MIN_CHARS, PDF_TEXT_MIN_QUALITY, extract_text_layer, is_usable, page_words
+from templates import TemplateStore
+import tools
+from uploads import MULTIPART_OVERHEAD, UPLOAD_MAX_BYTES, Upload, UploadLimit, UploadTooLarge
+from vision import VISION_MAX_PAGES, VISION_MAX_SIDE, describe_pages, merge_fields, pack, upload_payloads
 
 # Load environment variables
 load_dotenv()
 
+# Created once in lifespan(), so importing this module stays cheap and
+# touches no network, disk cache or worker processes.
+
+# Database access: async PostgREST over a shared pool, projected columns, read cache
+db: Optional[Store] = None
+# Per-tenant retrieval index used by /chat
+invoice_indexes: Optional[InvoiceIndexRegistry] = None
+# Likely-duplicate lookup for extracted invoices, synced in the background
+duplicate_index: Optional[DuplicateIndexSync] = None
+# Payment notifications: paged, concurrent delivery, bulk updates
+notification_pipeline: Optional[NotificationPipeline] = None
+# Extraction results keyed by file hash + pipeline version/config
+extraction_cache: Optional[ExtractionCache] = None
+# OCR text of finished pages while a document is in flight, for resuming retries
+page_checkpoints: Optional[PageCheckpoints] = None
+# Per-vendor layout templates learned from confirmed extractions
+template_store: Optional[TemplateStore] = None
+
+page_hashes = PageHashes()
+bulk_notification_task: Optional[asyncio.Task] = None
+
+# Initialize OpenAI (async, pooled, shared by all endpoints); the SDK is imported on warm-up
+llm_client = LLMClient()
+
+# Process pool that runs Tesseract off the event loop; the binary is found per platform
+ocr_engine = OCREngine()
+
+# Per-tenant rate limits, fair queuing and priority lanes for uncached extractions
+scheduler = FairScheduler()
+
+# Readiness: set once the background warm-up has finished
+startup = {"ready": False, "started_at": None, "ready_after": None}
+
+
+async def warm_up():
+    # Slow, optional start-up work; runs while the server is already live
+    try:
+        # Spawn the OCR workers and probe Tesseract once instead of on every request
+        backend = await ocr_engine.start()
+        print(f"OCR backend: {backend or 'unavailable (AI Vision fallback only)'}")
+        await llm_client.warm()
+    except Exception as e:
+        print(f"Warm-up error: {e}")
+    startup["ready"] = True
+    startup["ready_after"] = round(time.monotonic() - startup["started_at"], 3)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db, invoice_indexes, duplicate_index, notification_pipeline, extraction_cache, page_checkpoints, template_store
+    startup["started_at"] = time.monotonic()
+    db = create_store()
+    invoice_indexes = InvoiceIndexRegistry(db)
+    duplicate_index = DuplicateIndexSync(db)
+    notification_pipeline = NotificationPipeline(db, create_sender())
+    extraction_cache = create_extraction_cache()
+    page_checkpoints = PageCheckpoints()
+    template_store = TemplateStore()
+    await asyncio.to_thread(template_store.load)
+
+    duplicate_index.start()
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+
+    warm_up_task.cancel()
+    ocr_engine.shutdown()
+    await duplicate_index.stop()
+    await invoice_indexes.close()
+    await batch_manager.shutdown()
+    await extraction_jobs.shutdown()
+    await llm_client.close()
+    await db.close()
+
+
 # Initialize FastAPI
-app = FastAPI(title="Smart Invoice Assistant API", version="1.0.0")
+app = FastAPI(title="Smart Invoice Assistant API", version="1.0.0", lifespan=lifespan)
+
+# Oversized uploads are cut off while they stream in rather than after they
+# have been spooled; added first so the 413 still passes through CORS
+app.add_middleware(UploadLimit, limits={
+    "/extract_invoice": UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD,
+    "/extract_invoice/jobs": UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD,
+    "/extract_invoices/batch": max(BATCH_MAX_TOTAL_MB, BATCH_MAX_FILE_MB) * 1024 * 1024 + MULTIPART_OVERHEAD,
+})
 
 # CORS configuration
 app.add_middleware(
@@ -27,17 +130,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Supabase client
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_KEY")
-)
 
-# Initialize OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Bump whenever extraction logic changes so cached results are not reused
+PIPELINE_VERSION = "4"
+PIPELINE_CONFIG = {
+    "target_dpi": PREPROCESS_TARGET_DPI,
+    "clean_dpi": PREPROCESS_CLEAN_DPI,
+    "min_scan_dpi": PREPROCESS_MIN_SCAN_DPI,
+    "tesseract": TESSERACT_CONFIG,
+    "text_min_chars": PDF_TEXT_MIN_CHARS,
+    "text_min_quality": PDF_TEXT_MIN_QUALITY,
+    "model": "gpt-4o-mini",
+    "vision_max_side": VISION_MAX_SIDE,
+    "vision_max_pages": VISION_MAX_PAGES,
+    "llm_chunk_chars": chunking.LLM_CHUNK_CHARS,
+    "llm_max_chunks": chunking.LLM_MAX_CHUNKS,
+}
+
+# Opt-in cProfile dumps for slow requests (PROFILE_SLOW_REQUESTS_MS)
+slow_request_profiler = SlowRequestProfiler()
 
-# Configure Tesseract path (Windows)
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+Gauge("smartinvoice_ocr_pages_pending", "Pages queued or running in the OCR engine", lambda: ocr_engine.pending)
+Gauge("smartinvoice_llm_breaker_open", "1 while the OpenAI circuit breaker is open", lambda: llm_client.breaker.state == "open")
+Gauge("smartinvoice_duplicate_index_rows", "Invoices in the duplicate index", lambda: len(duplicate_index.index or ()) if duplicate_index else 0)
+Gauge("smartinvoice_scheduler_active", "Extractions holding a scheduler slot", lambda: scheduler.active)
+Gauge("smartinvoice_scheduler_queued_interactive", "Interactive extractions waiting for a slot", lambda: scheduler.queued("interactive"))
+Gauge("smartinvoice_scheduler_queued_batch", "Batch extractions waiting for a slot", lambda: scheduler.queued("batch"))
+Gauge("smartinvoice_db_cache_entries", "Rows held in the database read cache", lambda: db.cache.stats()["entries"] if db else 0)
+Gauge("smartinvoice_templates_ready", "Vendor templates confirmed enough to replace the LLM", lambda: template_store.stats()["ready"] if template_store else 0)
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    # Per-request stage trace, latency histogram and optional profile
+    trace = metrics.start_trace()
+    profile = slow_request_profiler.start()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        metrics.REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=status)
+        dump = slow_request_profiler.finish(profile, f"{request.method}{endpoint}", elapsed)
+        if dump:
+            print(f"Slow request {request.method} {endpoint} took {elapsed * 1000:.0f} ms, profile written to {dump}")
+    if trace:
+        response.headers["Server-Timing"] = metrics.server_timing(trace)
+    return response
 
 
 @app.get("/")
@@ -47,155 +190,548 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    """
+    Liveness: the process is up and serving. Answers as soon as the server
+    starts, before the warm-up has finished.
+    """
     return {"status": "healthy", "message": "API is operational"}
 
 
-@app.post("/extract_invoice")
-async def extract_invoice(file: UploadFile = File(...)):
+@app.get("/health/ready")
+async def readiness_check():
     """
-    Extract invoice data from uploaded PDF or image file using OCR and AI.
+    Readiness: 503 until the OCR workers are started and the OpenAI client is
+    built, so load balancers hold traffic during a cold start.
+    """
+    checks = {
+        "database": db is not None,
+        "ocr": ocr_engine.active_backend if ocr_engine.started else "starting",
+        "llm": llm_client.ready,
+        # Not required: duplicate checks return None until the index loads
+        "duplicate_index": bool(duplicate_index and duplicate_index.ready),
+    }
+    content = {
+        "status": "ready" if startup["ready"] else "starting",
+        "ready_after_seconds": startup["ready_after"],
+        "checks": checks,
+        "tools": tools.describe(),
+    }
+    return JSONResponse(status_code=200 if startup["ready"] else 503, content=content)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return extraction_cache.stats
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return scheduler.stats()
+
+
+@app.get("/templates/stats")
+async def template_stats():
+    return template_store.stats()
+
+
+# Saves snapshot the store under the lock, so the newest state is written last
+template_save_lock = asyncio.Lock()
+
+
+async def authenticated_user(authorization: Optional[str]) -> str:
+    """
+    Id of the user whose Supabase access token is in the Authorization header.
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise HTTPException(status_code=401, detail="Sign in required", headers={"WWW-Authenticate": "Bearer"})
+    user_id = await db.user_for_token(token.strip())
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid or expired session", headers={"WWW-Authenticate": "Bearer"})
+    return user_id
+
+
+async def caller_tenant(authorization: Optional[str]) -> str:
+    """
+    Tenant the caller's work is accounted to, from their verified access
+    token. Callers without an Authorization header all share ANONYMOUS; a
+    token that doesn't verify is refused rather than treated as anonymous.
+    """
+    if authorization is None:
+        return ANONYMOUS
+    return await resolve_tenant(db, await authenticated_user(authorization))
+
+
+@app.post("/templates/learn")
+async def learn_template(body: dict, authorization: Optional[str] = Header(None)):
+    """
+    Learn (or reinforce) the vendor template of an extracted document from
+    the fields the user confirmed. Requires the user's Supabase access token
+    (Authorization: Bearer); the template belongs to the user's tenant.
     
+    Args:
+        body: {"document_id": from the extraction response, "fields": the
+            vendor_name and whichever of invoice_no, amount, due_date,
+            invoice_date the user confirmed; null confirms a field is absent}
+        
     Returns:
-        JSON with extracted fields: vendor_name, invoice_no, amount, due_date
+        JSON with the template id, whether it is ready to replace the LLM,
+        and per field whether its rule was confirmed, learned, not found or
+        skipped
     """
+    tenant = await resolve_tenant(db, await authenticated_user(authorization))
+    document_id = body.get("document_id")
+    fields = body.get("fields")
+    if not document_id or not isinstance(fields, dict):
+        raise HTTPException(status_code=400, detail="document_id and fields are required")
+    
+    cached = await asyncio.to_thread(extraction_cache.get, document_id)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Extraction not found; it may have expired from the cache")
+    if not cached.get("layout"):
+        raise HTTPException(status_code=409, detail="No layout was recorded for this document")
+    
     try:
-        # Check if Tesseract is available
-        tesseract_available = True
-        try:
-            pytesseract.get_tesseract_version()
-        except Exception as e:
-            tesseract_available = False
-            print(f"Tesseract not available: {e}")
+        with span("templates.learn"):
+            result = template_store.learn(tenant, cached["layout"], fields, document_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async with template_save_lock:
+        await asyncio.to_thread(template_store.write, template_store.dump())
+    return JSONResponse(content=result)
+
+
+async def extract_pdf_pages(upload: Upload, key: Optional[str] = None) -> tuple:
+    """
+    Extract the text of every PDF page, using the embedded text layer where it
+    is usable and OCR only for the remaining pages.
+    
+    With a cache `key`, each OCR'd page is checkpointed as it finishes and
+    pages checkpointed by an earlier, interrupted run are not OCR'd again.
+    
+    Returns:
+        (page_texts, page_info, layout) where page_info records the source of
+        each page and layout holds the word boxes of the first page, or None
+        when there are none (a first page resumed from a checkpoint, or not
+        read at all)
+    """
+    with upload.as_path(".pdf") as pdf_path:
+        with span("pdf.text_layer"):
+            page_count = await asyncio.to_thread(count_pages, pdf_path)
+            page_texts = await asyncio.to_thread(extract_text_layer, pdf_path, page_count)
         
-        # Read file content
-        content = await file.read()
+        sources = ["text_layer" if is_usable(t) else "ocr" for t in page_texts]
+        if not ocr_engine.available:
+            sources = [source if source == "text_layer" else "skipped" for source in sources]
+        ocr_pages = [i + 1 for i, source in enumerate(sources) if source == "ocr"]
         
-        # Determine file type and extract text
-        text = ""
+        resumed = {}
+        if key and ocr_pages:
+            resumed = await asyncio.to_thread(page_checkpoints.load, key)
+            resumed = {page: text for page, text in resumed.items() if page in ocr_pages}
+            for page, page_text in resumed.items():
+                page_texts[page - 1] = page_text
+            ocr_pages = [page for page in ocr_pages if page not in resumed]
+        layout = None
+        report_progress(
+            "pages",
+            total=page_count,
+            text_layer=sources.count("text_layer"),
+            ocr=len(ocr_pages) + len(resumed),
+            resumed=len(resumed),
+        )
         
-        if file.content_type == "application/pdf":
-            # Convert PDF to images and extract text
-            try:
-                images = convert_from_bytes(content, dpi=300)  # Higher DPI for better quality
-                
-                from PIL import ImageEnhance, ImageFilter
-                
-                for img in images:
-                    # Convert to RGB
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # Enhance image
-                    enhancer = ImageEnhance.Contrast(img)
-                    img = enhancer.enhance(2)
-                    img = img.filter(ImageFilter.SHARPEN)
-                    
-                    # Extract text with better config
-                    custom_config = r'--oem 3 --psm 6'
-                    page_text = pytesseract.image_to_string(img, config=custom_config)
-                    text += page_text + "\n"
-                
-                print(f"Extracted text length: {len(text)} characters")
-                print(f"First 200 chars: {text[:200]}")
-                
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"PDF processing failed: {str(e)}")
-                
-        elif file.content_type in ["image/jpeg", "image/png", "image/jpg"]:
-            # Extract text from image with preprocessing
-            try:
-                image = Image.open(io.BytesIO(content))
-                
-                # Convert to RGB if needed
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                
-                # Enhance image for better OCR
-                from PIL import ImageEnhance, ImageFilter
-                
-                # Increase contrast
-                enhancer = ImageEnhance.Contrast(image)
-                image = enhancer.enhance(2)
-                
-                # Sharpen
-                image = image.filter(ImageFilter.SHARPEN)
-                
-                # Use better Tesseract config for invoices
-                custom_config = r'--oem 3 --psm 6'
-                text = pytesseract.image_to_string(image, config=custom_config)
-                
-                print(f"Extracted text length: {len(text)} characters")
-                print(f"First 200 chars: {text[:200]}")
-                
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Image processing failed: {str(e)}")
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type. Please upload PDF or image.")
+        dpis = {}
+        if ocr_pages:
+            # Render each page at the resolution its content needs
+            with span("pdf.dpi_probe"):
+                dpis = await asyncio.to_thread(page_render_dpis, pdf_path, ocr_pages)
+            rasterized = 0
+            ocr_done = 0
+            
+            async def windows():
+                nonlocal rasterized
+                async for images in iter_page_windows(pdf_path, ocr_pages, dpis):
+                    rasterized += len(images)
+                    report_progress("rasterized", pages=rasterized, total=len(ocr_pages))
+                    yield images
+            
+            async def finish_window(texts: List[str]):
+                nonlocal ocr_done
+                pages = dict(zip(ocr_pages[ocr_done:], texts))
+                for page, page_text in pages.items():
+                    page_texts[page - 1] = page_text
+                if key:
+                    await asyncio.to_thread(page_checkpoints.add, key, pages)
+                ocr_done += len(pages)
+                report_progress("ocr", pages=len(resumed) + ocr_done, total=len(resumed) + len(ocr_pages))
+            
+            def on_layout(words):
+                nonlocal layout
+                layout = words
+            
+            # Tesseract's word boxes are only needed for the first page
+            await ocr_engine.ocr_windows(
+                windows(), min(len(ocr_pages), PDF_PAGE_WINDOW), finish_window,
+                on_layout if ocr_pages[0] == 1 else None,
+            )
+        
+        if sources[0] == "text_layer":
+            with span("pdf.page_words"):
+                layout = await asyncio.to_thread(page_words, pdf_path, 1)
+    
+    page_info = []
+    for i, source in enumerate(sources):
+        info = {"page": i + 1, "source": source}
+        if i + 1 in resumed:
+            info["resumed"] = True
+        if i + 1 in dpis:
+            info["dpi"] = dpis[i + 1]
+        page_info.append(info)
+    return page_texts, page_info, layout
+
+
+async def run_extraction(upload: Upload, extract_fields=None, work: Work = Work()) -> dict:
+    """
+    Run the extraction pipeline for one document: cache lookup, text layer
+    and OCR, then field extraction.
+    
+    Args:
+        upload: The uploaded file, read in place
+        extract_fields: Async callable turning OCR text into fields (defaults to extract_with_ai)
+        work: Tenant and lane the OCR/LLM work is scheduled under; cache hits skip the scheduler
         
-        # If no OCR text and Tesseract not available, try AI vision API
-        if not text.strip() and not tesseract_available:
-            print("No Tesseract, using OpenAI Vision API...")
-            extracted_data = await extract_with_vision(content, file.content_type)
+    Returns:
+        dict with data, raw_text, pages, cached, document_id (the cache key,
+        for POST /templates/learn) and template
+    """
+    extract_fields = extract_fields or extract_with_ai
+    
+    # Return the stored result if this exact file was already processed
+    BYTES_PROCESSED.inc(upload.size, content_type=upload.content_type)
+    key = cache_key(await asyncio.to_thread(upload.digest), PIPELINE_VERSION, PIPELINE_CONFIG)
+    with span("cache.lookup"):
+        cached = await asyncio.to_thread(extraction_cache.get, key)
+    template = cached.get("template") if cached is not None else None
+    if template and template["used"] and cached.get("tenant") != work.tenant:
+        # Read through another tenant's template: extract again for this one
+        cached = None
+    if cached is not None:
+        report_progress("cached")
+        return {
+            "data": cached["data"],
+            "raw_text": cached["text"][:1000],
+            "pages": cached["pages"],
+            "cached": True,
+            "document_id": key,
+            "template": cached.get("template"),
+        }
+    
+    with span("scheduler.wait"):
+        await scheduler.acquire(work)
+    try:
+        return await extract_uncached(upload, key, extract_fields, work.tenant)
+    finally:
+        scheduler.release()
+
+
+async def extract_uncached(upload: Upload, key: str, extract_fields, tenant: str) -> dict:
+    """
+    OCR/text-layer extraction plus field extraction for a cache miss; the
+    result is stored under `key`. Only `tenant`'s vendor templates are tried.
+    """
+    content_type = upload.content_type
+    
+    # Determine file type and extract text
+    text = ""
+    page_info = []
+    layout = None
+    
+    if content_type == "application/pdf":
+        # Use the native text layer where possible, OCR the rest
+        try:
+            page_texts, page_info, layout = await extract_pdf_pages(upload, key)
+            text = chunking.join_pages(page_texts)
             
-            return JSONResponse(content={
-                "success": True,
+        except OCREngineBusy:
+            raise
+        except PDFTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"PDF processing failed: {str(e)}")
+            
+    elif content_type in ["image/jpeg", "image/png", "image/jpg"]:
+        # Extract text from image (preprocessing happens in the OCR worker)
+        try:
+            if ocr_engine.available:
+                image = await asyncio.to_thread(upload.open_image)
+                
+                report_progress("pages", total=1, text_layer=0, ocr=1, resumed=0)
+                page_text, layout = await ocr_engine.ocr_layout(image)
+                text = chunking.join_pages([page_text])
+                page_info = [{"page": 1, "source": "ocr"}]
+                report_progress("ocr", pages=1, total=1)
+            
+        except OCREngineBusy:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Image processing failed: {str(e)}")
+    else:
+        raise HTTPException(status_code=400, detail="Unsupported file type. Please upload PDF or image.")
+    
+    for page in page_info:
+        PAGES_PROCESSED.inc(source=page["source"])
+    
+    # If no OCR text and Tesseract not available, try AI vision API
+    if not text.strip() and not ocr_engine.available:
+        report_progress("extracting", vision=True)
+        try:
+            with span("vision"):
+                extracted_data = await extract_with_vision(upload)
+        except Exception as e:
+            print(f"Vision API error: {e}")
+            return {
+                "data": placeholder_fields(),
+                "raw_text": "Extracted using AI Vision (no OCR)",
+                "pages": page_info,
+                "cached": False,
+                "document_id": key,
+                "template": None,
+            }
+        
+        report_progress("extracted")
+        raw_text = "Extracted using AI Vision (no OCR)"
+        with span("cache.store"):
+            await asyncio.to_thread(extraction_cache.set, key, {
                 "data": extracted_data,
-                "raw_text": "Extracted using AI Vision (no OCR)"
+                "text": raw_text,
+                "pages": page_info
             })
         
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="No text could be extracted from the file. Make sure the image is clear and contains text.")
-        
-        print(f"\n=== OCR EXTRACTION ===")
-        print(f"Text extracted ({len(text)} chars):")
-        print(text[:1000])
-        print("=" * 50)
-        
+        return {
+            "data": extracted_data,
+            "raw_text": raw_text,
+            "pages": page_info,
+            "cached": False,
+            "document_id": key,
+            "template": None,
+        }
+    
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="No text could be extracted from the file. Make sure the image is clear and contains text.")
+    
+    # A known vendor layout is read off the word boxes without the LLM
+    match = None
+    if layout and tenant != ANONYMOUS:
+        with span("templates.match"):
+            match = template_store.match(tenant, layout)
+        TEMPLATE_MATCHES.inc(result=match.outcome)
+    template = match.summary() if match else None
+    
+    if match is not None and match.outcome == "hit":
+        extracted_data = match.fields
+        report_progress("extracted", template=match.template.vendor)
+    else:
         # Extract invoice data using AI (OpenAI)
-        extracted_data = await extract_with_ai(text)
+        report_progress("extracting", chars=len(text))
+        with span("extract_fields"):
+            extracted_data = await extract_fields(text)
+        report_progress("extracted")
+    
+    # A regex fallback during an OpenAI outage is not cached, and the page
+    # checkpoints stay so the retry skips OCR
+    if not isinstance(extracted_data, FallbackFields):
+        with span("cache.store"):
+            await asyncio.to_thread(extraction_cache.set, key, {
+                "data": extracted_data,
+                "text": text,
+                "pages": page_info,
+                "layout": layout,
+                "template": template,
+                "tenant": tenant,
+            })
+            await asyncio.to_thread(page_checkpoints.discard, key)
+    
+    return {
+        "data": extracted_data,
+        "raw_text": text[:1000],  # Return first 1000 chars for debugging
+        "pages": page_info,
+        "cached": False,
+        "document_id": key,
+        "template": template,
+    }
+
+
+async def find_duplicates(upload: Upload, data: dict, tenant: str) -> dict:
+    """
+    Hash the first page and look up existing invoices of `tenant` that match
+    it or the extracted fields. In-memory only; `duplicates` is None while
+    the index is still loading.
+    """
+    with span("duplicates"):
+        page_hash = await asyncio.to_thread(page_hashes.get, upload)
+        return {"page_hash": page_hash, "duplicates": duplicate_index.find(tenant, data, page_hash)}
+
+
+async def extract_and_check(upload: Upload, extract_fields=None, work: Work = Work()) -> dict:
+    result = await run_extraction(upload, extract_fields, work)
+    result.update(await find_duplicates(upload, result["data"], work.tenant))
+    return result
+
+
+@app.post("/extract_invoice")
+async def extract_invoice(file: UploadFile = File(...), authorization: Optional[str] = Header(None)):
+    """
+    Extract invoice data from uploaded PDF or image file using OCR and AI.
+    The work counts against the caller's tenant (Authorization: Bearer
+    <Supabase access token>).
+    
+    Returns:
+        JSON with extracted fields: vendor_name, invoice_no, amount, due_date,
+        plus page_hash and likely duplicates of existing invoices
+    """
+    try:
+        # Read from the spooled temp file instead of copying it into memory
+        upload = Upload(file.file, file.content_type, file.filename)
+        upload.check_size()
         
-        print(f"\n=== EXTRACTED DATA ===")
-        print(extracted_data)
-        print("=" * 50)
+        tenant = await caller_tenant(authorization)
+        result = await extract_and_check(upload, work=Work(tenant))
         
-        return JSONResponse(content={
-            "success": True,
-            "data": extracted_data,
-            "raw_text": text[:1000]  # Return first 1000 chars for debugging
-        })
+        return JSONResponse(content={"success": True, **result})
         
     except HTTPException:
         raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except RateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except OCREngineBusy as e:
+        raise HTTPException(
+            status_code=503,
+            detail="OCR engine is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
 
-async def extract_with_vision(image_content: bytes, content_type: str) -> dict:
+@app.post("/extract_invoice/jobs", status_code=202)
+async def create_extraction_job(file: UploadFile = File(...), authorization: Optional[str] = Header(None)):
     """
-    Use OpenAI Vision API to extract invoice data directly from image (no OCR needed).
+    Queue one document for background extraction and return its job id at
+    once. Follow progress on /extract_invoice/jobs/{job_id}/events; the
+    final event carries the same payload /extract_invoice returns.
     """
+    upload = Upload(file.file, file.content_type, file.filename)
     try:
-        import base64
-        
-        # Encode image to base64
-        base64_image = base64.b64encode(image_content).decode('utf-8')
-        
-        # Determine image format
-        image_format = "jpeg"
-        if "png" in content_type:
-            image_format = "png"
-        elif "pdf" in content_type:
-            # For PDF, we can't use vision API directly
-            return {
-                "vendor_name": "Unknown Vendor",
-                "invoice_no": f"INV-{int(time.time())}",
-                "amount": 0,
-                "due_date": datetime.now().strftime('%Y-%m-%d'),
-                "invoice_date": datetime.now().strftime('%Y-%m-%d')
-            }
-        
-        prompt = """
-Analyze this invoice image and extract the following information:
+        upload.check_size()
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    job = await extraction_jobs.submit(upload, await caller_tenant(authorization))
+    return JSONResponse(status_code=202, content={
+        "job_id": job.id,
+        "status": job.status,
+        "events_url": f"/extract_invoice/jobs/{job.id}/events",
+    })
+
+
+def get_extraction_job_or_404(job_id: str):
+    job = extraction_jobs.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Extraction job not found")
+    return job
+
+
+@app.get("/extract_invoice/jobs/{job_id}")
+async def get_extraction_job(job_id: str):
+    """
+    Poll an extraction job for its status, latest progress event and result.
+    """
+    return JSONResponse(content=get_extraction_job_or_404(job_id).summary())
+
+
+@app.get("/extract_invoice/jobs/{job_id}/events")
+async def stream_extraction_job(job_id: str, request: Request):
+    """
+    Stream the job's progress as server-sent events until it finishes.
+    """
+    job = get_extraction_job_or_404(job_id)
+    try:
+        last_event_id = int(request.headers.get("last-event-id", "-1"))
+    except ValueError:
+        last_event_id = -1
+    return StreamingResponse(
+        extraction_jobs.stream(job, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/extract_invoice/jobs/{job_id}/retry", status_code=202)
+async def retry_extraction_job(job_id: str):
+    """
+    Re-run a failed job; pages OCR'd by the failed attempt are not redone.
+    """
+    job = get_extraction_job_or_404(job_id)
+    if not extraction_jobs.retry(job):
+        raise HTTPException(status_code=409, detail=f"Job is {job.status} and cannot be retried")
+    return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status})
+
+
+@app.post("/extract_invoices/batch")
+async def extract_invoices_batch(files: List[UploadFile] = File(...), authorization: Optional[str] = Header(None)):
+    """
+    Queue many invoices (or ZIP archives of invoices) for extraction in the
+    batch lane, behind interactive uploads and fairly shared with other tenants.
+    
+    Returns:
+        JSON with the job id and the initial per-file status
+    """
+    tenant = await caller_tenant(authorization)
+    try:
+        uploads = [Upload(f.file, f.content_type, f.filename) for f in files]
+        job = await batch_manager.submit(uploads, tenant)
+        return JSONResponse(status_code=202, content=job.summary())
+    except (BatchTooLarge, UploadTooLarge) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Batch submission failed: {str(e)}")
+
+
+@app.get("/extract_invoices/batch/{job_id}")
+async def get_batch_job(job_id: str):
+    """
+    Poll a batch job for progress and per-file results.
+    """
+    job = batch_manager.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return JSONResponse(content=job.summary())
+
+
+@app.get("/extract_invoices/batch/{job_id}/stream")
+async def stream_batch_job(job_id: str):
+    """
+    Stream per-file results as NDJSON while the batch runs.
+    """
+    job = batch_manager.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return StreamingResponse(batch_manager.stream(job), media_type="application/x-ndjson")
+
+
+VISION_PROMPT = """
+Analyze {subject} and extract the following information:
 - vendor_name: Company/vendor name
 - invoice_no: Invoice number
 - amount: Total amount (numeric only)
@@ -203,74 +739,104 @@ Analyze this invoice image and extract the following information:
 - invoice_date: Invoice date (YYYY-MM-DD format)
 
 Return ONLY valid JSON in this exact format:
-{
+{{
     "vendor_name": "Company Name",
     "invoice_no": "INV-12345",
     "amount": 1234.56,
     "due_date": "2025-12-31",
     "invoice_date": "2025-11-13"
-}
+}}
 
 If a field is not found, use null.
 """
-        
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/{image_format};base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            temperature=0,
-            max_tokens=500
+
+
+def placeholder_fields() -> dict:
+    """
+    Default values returned when nothing could be extracted.
+    """
+    return {
+        "vendor_name": "Unknown Vendor",
+        "invoice_no": f"INV-{int(time.time())}",
+        "amount": 0,
+        "due_date": datetime.now().strftime('%Y-%m-%d'),
+        "invoice_date": datetime.now().strftime('%Y-%m-%d')
+    }
+
+
+async def extract_pages_with_vision(image_urls: List[str], pages: List[int], page_count: int) -> dict:
+    """
+    One vision request for a group of page images.
+    
+    Args:
+        image_urls: Encoded pages
+        pages: 1-based page number of each image
+        page_count: Pages in the whole document, including pages not sent
+    """
+    if page_count == 1:
+        subject = "this invoice image"
+    else:
+        subject = f"these images, pages {describe_pages(pages)} of a {page_count}-page invoice (fields may appear on any page; the total is usually on the last page)"
+    
+    content = [{"type": "text", "text": VISION_PROMPT.format(subject=subject)}]
+    content += [{"type": "image_url", "image_url": {"url": url}} for url in image_urls]
+    
+    response = await llm_client.chat_completion(
+        "vision",
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": content}],
+        temperature=0,
+        max_tokens=500
+    )
+    
+    result_text = response.choices[0].message.content.strip()
+    
+    # Remove markdown code blocks if present
+    if result_text.startswith("```"):
+        result_text = re.sub(r'```json\n?', '', result_text)
+        result_text = re.sub(r'```\n?', '', result_text)
+    
+    return json.loads(result_text)
+
+
+async def extract_with_vision(upload: Upload) -> dict:
+    """
+    Use OpenAI Vision API to extract invoice data directly from an image or
+    rendered PDF pages (no OCR needed).
+    
+    Pages are sent as downscaled grayscale JPEGs, several per request; the
+    answers of a multi-request document are merged.
+    
+    Raises:
+        Exception: If rendering or every vision request fails
+    """
+    payloads = await asyncio.to_thread(upload_payloads, upload)
+    if not payloads.urls:
+        raise ValueError("Document has no pages")
+    
+    # Page numbers travel with the images: long documents skip middle pages
+    results = await asyncio.gather(
+        *(
+            extract_pages_with_vision(group, pages, payloads.page_count)
+            for group, pages in zip(pack(payloads.urls), pack(payloads.pages))
         )
-        
-        result_text = response.choices[0].message.content.strip()
-        
-        # Remove markdown code blocks if present
-        if result_text.startswith("```"):
-            result_text = re.sub(r'```json\n?', '', result_text)
-            result_text = re.sub(r'```\n?', '', result_text)
-        
-        import json
-        import time
-        from datetime import datetime
-        extracted_data = json.loads(result_text)
-        
-        return extracted_data
-        
-    except Exception as e:
-        print(f"Vision API error: {e}")
-        # Return default values
-        import time
-        from datetime import datetime
-        return {
-            "vendor_name": "Unknown Vendor",
-            "invoice_no": f"INV-{int(time.time())}",
-            "amount": 0,
-            "due_date": datetime.now().strftime('%Y-%m-%d'),
-            "invoice_date": datetime.now().strftime('%Y-%m-%d')
-        }
+    )
+    return results[0] if len(results) == 1 else merge_fields(results)
 
 
-async def extract_with_ai(text: str) -> dict:
+async def ai_extract_fields(text: str, excerpt: bool = False) -> dict:
     """
-    Use OpenAI to extract structured invoice data from OCR text.
+    One OpenAI extraction call over `text`. Raises on any failure.
+    
+    Args:
+        text: OCR text, or an excerpt of it made by chunking.excerpt/windows
+        excerpt: Tell the model that parts of the document were left out
     """
-    try:
-        prompt = f"""
+    note = " (excerpt; [...] marks omitted parts)" if excerpt else ""
+    prompt = f"""
 Extract the following information from this invoice text. Analyze carefully and return ONLY valid JSON.
 
-Invoice OCR text:
+Invoice OCR text{note}:
 {text}
 
 Extract these fields:
@@ -298,142 +864,148 @@ Return ONLY this JSON format (no markdown, no explanations):
 If a field truly cannot be found after careful analysis, use null (not "Unknown" or empty string).
 """
 
-        response = openai.chat.completions.create(
+    response = await llm_client.chat_completion(
+        "extract",
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You are an expert invoice data extraction assistant. Analyze the OCR text carefully and extract structured data. Return only valid JSON, no markdown or explanations."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0,
+        max_tokens=500
+    )
+    
+    # Parse AI response
+    result_text = response.choices[0].message.content.strip()
+    
+    # Remove markdown code blocks if present
+    if result_text.startswith("```"):
+        result_text = re.sub(r'```json\n?', '', result_text)
+        result_text = re.sub(r'```\n?', '', result_text)
+    
+    extracted_data = json.loads(result_text)
+    
+    return extracted_data
+
+
+async def extract_long_with_ai(text: str) -> dict:
+    """
+    Extract fields from OCR text longer than LLM_CHUNK_CHARS.
+    
+    Sends the highest-scoring segments (header, dates, totals) in one call;
+    if that leaves fields empty, extracts the most relevant chunk windows
+    concurrently and fills the gaps from their merged answers.
+    """
+    with span("extract.chunk"):
+        parts = await asyncio.to_thread(chunking.segments, text)
+        focused = chunking.excerpt(parts)
+    extracted_data = await ai_extract_fields(focused, excerpt=True)
+    
+    missing = [field for field in ("vendor_name", "invoice_no", "amount", "due_date", "invoice_date") if extracted_data.get(field) is None]
+    if missing:
+        results = await asyncio.gather(
+            *(ai_extract_fields(chunk, excerpt=True) for chunk in chunking.windows(parts)),
+            return_exceptions=True,
+        )
+        merged = merge_fields([r for r in results if isinstance(r, dict)])
+        for field in missing:
+            extracted_data[field] = merged.get(field)
+    return extracted_data
+
+
+async def extract_with_ai(text: str) -> dict:
+    """
+    Use OpenAI to extract structured invoice data from OCR text.
+    Long texts are chunked so prompt size stays bounded (see chunking.py).
+    When OpenAI fails the regex result comes back as FallbackFields.
+    """
+    try:
+        if len(text) > chunking.LLM_CHUNK_CHARS:
+            return await extract_long_with_ai(text)
+        return await ai_extract_fields(text)
+        
+    except CircuitOpenError as e:
+        # Upstream is failing or slow; skip the call entirely
+        print(f"{e}. Falling back to regex extraction.")
+        return regex_fallback(text)
+    except Exception as e:
+        # Fallback to regex extraction if AI fails (openai.OpenAIError included)
+        print(f"AI extraction error ({type(e).__name__}): {e}. Falling back to regex extraction.")
+        return regex_fallback(text)
+
+
+async def extract_many_with_ai(texts: List[str]) -> List[dict]:
+    """
+    Extract several short invoices with a single OpenAI call.
+    Falls back to one extract_with_ai call per text if the batched answer
+    cannot be used.
+    """
+    try:
+        documents = "\n\n".join(
+            f"=== INVOICE {i + 1} ===\n{text}" for i, text in enumerate(texts)
+        )
+        prompt = f"""
+Extract invoice fields from each of the {len(texts)} invoice OCR texts below.
+
+{documents}
+
+For every invoice extract:
+- vendor_name, invoice_no, amount (number only), due_date (YYYY-MM-DD), invoice_date (YYYY-MM-DD)
+
+Return ONLY a JSON array with exactly {len(texts)} objects, in the same order as the invoices (no markdown, no explanations):
+[
+    {{"vendor_name": "Company Name Here", "invoice_no": "INV-12345", "amount": 1234.56, "due_date": "2025-12-31", "invoice_date": "2025-11-13"}}
+]
+
+If a field cannot be found, use null.
+"""
+        
+        response = await llm_client.chat_completion(
+            "extract",
             model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": "You are an expert invoice data extraction assistant. Analyze the OCR text carefully and extract structured data. Return only valid JSON, no markdown or explanations."},
+                {"role": "system", "content": "You are an expert invoice data extraction assistant. Return only valid JSON, no markdown or explanations."},
                 {"role": "user", "content": prompt}
             ],
             temperature=0,
-            max_tokens=500
+            max_tokens=200 * len(texts)
         )
         
-        # Parse AI response
         result_text = response.choices[0].message.content.strip()
-        
-        # Remove markdown code blocks if present
         if result_text.startswith("```"):
             result_text = re.sub(r'```json\n?', '', result_text)
             result_text = re.sub(r'```\n?', '', result_text)
         
-        import json
-        extracted_data = json.loads(result_text)
-        
-        return extracted_data
+        extracted = json.loads(result_text)
+        if isinstance(extracted, list) and len(extracted) == len(texts) and all(isinstance(e, dict) for e in extracted):
+            return extracted
+        print("Batched AI extraction returned the wrong shape, extracting one by one")
         
-    except openai.OpenAIError as e:
-        # Fallback to regex extraction if AI fails
-        print(f"OpenAI error: {e}. Falling back to regex extraction.")
-        return extract_with_regex(text)
+    except CircuitOpenError:
+        return [regex_fallback(text) for text in texts]
     except Exception as e:
-        print(f"AI extraction error: {e}. Falling back to regex extraction.")
-        return extract_with_regex(text)
+        print(f"Batched AI extraction error: {e}. Extracting one by one.")
+    
+    return list(await asyncio.gather(*(extract_with_ai(text) for text in texts)))
 
 
 def extract_with_regex(text: str) -> dict:
     """
     Fallback: Extract invoice data using regex patterns.
+    See regex_engine for the precompiled single-pass rules.
+    """
+    return regex_engine.extract(text)
+
+
+class FallbackFields(dict):
+    """
+    Regex fields standing in for an AI extraction that failed. Served, but
+    never cached: the next upload of the file should get the AI again.
     """
-    from datetime import datetime
-    
-    result = {
-        "vendor_name": None,
-        "invoice_no": None,
-        "amount": None,
-        "due_date": None,
-        "invoice_date": None
-    }
-    
-    # Extract vendor name (first line often contains vendor)
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    if lines:
-        # Try to get vendor from first few non-empty lines
-        for line in lines[:5]:
-            if len(line) > 3 and not any(keyword in line.lower() for keyword in ['invoice', 'date', 'total', 'amount', 'due']):
-                result["vendor_name"] = line
-                break
-    
-    # Extract invoice number (improved patterns)
-    invoice_patterns = [
-        r'invoice\s*#\s*:?\s*([A-Z0-9-]+)',
-        r'invoice\s*no\.?\s*:?\s*([A-Z0-9-]+)',
-        r'inv\.?\s*#?\s*:?\s*([A-Z0-9-]+)',
-        r'bill\s*#\s*:?\s*([A-Z0-9-]+)',
-        r'#\s*([A-Z0-9-]{5,})'
-    ]
-    for pattern in invoice_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            result["invoice_no"] = match.group(1)
-            break
-    
-    # Extract amount (improved patterns)
-    amount_patterns = [
-        r'total\s*amount\s*:?\s*\$?\s*([\d,]+\.?\d{0,2})',
-        r'amount\s*due\s*:?\s*\$?\s*([\d,]+\.?\d{0,2})',
-        r'total\s*:?\s*\$?\s*([\d,]+\.?\d{0,2})',
-        r'balance\s*:?\s*\$?\s*([\d,]+\.?\d{0,2})',
-        r'grand\s*total\s*:?\s*\$?\s*([\d,]+\.?\d{0,2})',
-        r'\$\s*([\d,]+\.?\d{0,2})\s*(?:usd|total)?'
-    ]
-    for pattern in amount_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            amount_str = match.group(1).replace(',', '')
-            try:
-                result["amount"] = float(amount_str)
-                break
-            except:
-                continue
-    
-    # Extract dates (improved patterns)
-    date_patterns = [
-        r'due\s*date\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-        r'payment\s*due\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-        r'invoice\s*date\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-        r'date\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})'
-    ]
-    
-    for pattern in date_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for date_str in matches:
-            try:
-                # Try to parse date
-                for fmt in ['%m/%d/%Y', '%d/%m/%Y', '%m-%d-%Y', '%d-%m-%Y', '%m/%d/%y', '%d/%m/%y']:
-                    try:
-                        parsed = datetime.strptime(date_str, fmt)
-                        formatted = parsed.strftime('%Y-%m-%d')
-                        if 'due' in pattern.lower() or 'payment' in pattern.lower():
-                            result["due_date"] = formatted
-                        elif 'invoice' in pattern.lower() or result["invoice_date"] is None:
-                            result["invoice_date"] = formatted
-                        break
-                    except:
-                        continue
-            except:
-                continue
-    
-    # If no dates found with labels, get all dates
-    if not result["invoice_date"] and not result["due_date"]:
-        generic_dates = re.findall(r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}', text)
-        if generic_dates:
-            for date_str in generic_dates[:2]:  # Take first 2 dates
-                try:
-                    for fmt in ['%m/%d/%Y', '%d/%m/%Y', '%m-%d-%Y', '%d-%m-%Y', '%m/%d/%y', '%d/%m/%y']:
-                        try:
-                            parsed = datetime.strptime(date_str, fmt)
-                            formatted = parsed.strftime('%Y-%m-%d')
-                            if not result["invoice_date"]:
-                                result["invoice_date"] = formatted
-                            elif not result["due_date"]:
-                                result["due_date"] = formatted
-                            break
-                        except:
-                            continue
-                except:
-                    continue
-    
-    return result
+
+
+def regex_fallback(text: str) -> FallbackFields:
+    return FallbackFields(extract_with_regex(text))
 
 
 @app.post("/chat")
@@ -450,26 +1022,35 @@ async def chat_query(query: dict):
         if not user_query:
             raise HTTPException(status_code=400, detail="Query is required")
         
-        # Fetch invoices based on role
+        # Look up the relevant invoices in the tenant's index instead of
+        # sending the whole table to the model
         if role == "admin":
-            response = supabase.table("invoices").select("*").execute()
+            index = await invoice_indexes.get(None)
         else:
             if not user_id:
                 raise HTTPException(status_code=400, detail="user_id required for user role")
-            response = supabase.table("invoices").select("*").eq("user_id", user_id).execute()
+            index = await invoice_indexes.get(user_id)
         
-        invoices = response.data
+        with span("chat.retrieve"):
+            invoices = index.search(user_query, CHAT_INDEX_TOP_K)
+            summary = index.aggregates()
         
         # Create context for AI
-        context = f"Here are the invoices:\n"
+        context = f"Summary of all {summary['invoice_count']} invoices:\n"
+        context += f"- Total amount: ${summary['total_amount']}\n"
+        for status, totals in summary["by_status"].items():
+            context += f"- {status}: {totals['count']} invoices, ${totals['amount']}\n"
+        context += f"- Overdue (unpaid and past due): {summary['overdue_count']} invoices, ${summary['overdue_amount']}\n"
+        context += f"\nThe {len(invoices)} invoices most relevant to the question:\n"
         for inv in invoices:
             context += f"- Invoice {inv.get('invoice_number')}: {inv.get('vendor_name')}, Amount: ${inv.get('amount')}, Status: {inv.get('status')}, Due: {inv.get('due_date')}\n"
         
         # Query OpenAI
-        ai_response = openai.chat.completions.create(
+        ai_response = await llm_client.chat_completion(
+            "chat",
             model="gpt-3.5-turbo",
             messages=[
-                {"role": "system", "content": f"You are a helpful invoice assistant. Answer questions based on this data:\n{context}"},
+                {"role": "system", "content": f"You are a helpful invoice assistant. Answer questions based on this data. Use the summary for totals and counts; the list only contains the most relevant invoices:\n{context}"},
                 {"role": "user", "content": user_query}
             ],
             temperature=0.7,
@@ -481,13 +1062,61 @@ async def chat_query(query: dict):
         return JSONResponse(content={
             "success": True,
             "answer": answer,
-            "invoice_count": len(invoices)
+            "invoice_count": len(index)
         })
         
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="AI assistant is temporarily unavailable",
+            headers={"Retry-After": str(int(e.retry_after))},
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
 
+@app.get("/invoices/export")
+async def export_invoices(
+    format: str = "csv",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    status: Optional[List[str]] = Query(None),
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Stream invoices with their approvals and disputes as gzip CSV or Parquet.
+    Filters: invoice_date range (inclusive), status (repeatable). Only the
+    caller's invoices are exported: their company's for company staff,
+    their own otherwise.
+    """
+    user_id = await authenticated_user(authorization)
+    profile = await db.profile(user_id)
+    company_id = profile.get("company_id") if profile else None
+    
+    if format not in ENCODERS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(ENCODERS)}")
+    for value in (date_from, date_to):
+        if value:
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid date '{value}', expected YYYY-MM-DD")
+    try:
+        encoder = ENCODERS[format]()
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filters = ExportFilter(date_from, date_to, tuple(status or ()), company_id, None if company_id else user_id)
+    filename = f"invoices-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{encoder.extension}"
+    return StreamingResponse(
+        stream_export(db, filters, encoder),
+        media_type=encoder.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @app.post("/send_payment_notification")
 async def send_payment_notification(invoice_id: str):
     """
@@ -501,31 +1130,16 @@ async def send_payment_notification(invoice_id: str):
     """
     try:
         # Fetch invoice details
-        response = supabase.table("invoices").select("*, profiles:user_id(email, full_name)").eq("id", invoice_id).single().execute()
+        with span("supabase.invoice_fetch"):
+            invoice = await db.invoice_for_notification(invoice_id)
         
-        if not response.data:
+        if not invoice:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
-        invoice = response.data
-        user_email = invoice.get("profiles", {}).get("email", "")
-        user_name = invoice.get("profiles", {}).get("full_name", "User")
-        
-        # TODO: Implement actual email sending using:
-        # - SendGrid API
-        # - AWS SES
-        # - SMTP
-        # - Or any email service
-        
-        # For now, we'll just log and mark as sent
-        print(f"[EMAIL] Would send notification to {user_email}")
-        print(f"Subject: Payment Released - Invoice {invoice['invoice_number']}")
-        print(f"Message: Hi {user_name}, your payment of ${invoice['amount']} for invoice {invoice['invoice_number']} has been released.")
+        user_email = (invoice.get("profiles") or {}).get("email", "")
         
-        # Mark notification as sent in database
-        supabase.table("invoices").update({
-            "notification_sent": True,
-            "notification_sent_at": "now()"
-        }).eq("id", invoice_id).execute()
+        # Deliver through the configured sender (SMTP or log) and mark as sent
+        await notification_pipeline.send_one(invoice)
         
         return JSONResponse(content={
             "success": True,
@@ -544,43 +1158,57 @@ async def send_bulk_notifications():
     """
     Send notifications for all invoices that have notification_sent = FALSE and status = 'paid'.
     
+    The run continues in the background if it takes longer than
+    NOTIFY_REQUEST_TIMEOUT; poll /send_bulk_notifications/status for progress.
+    
     Returns:
         JSON with count of notifications sent
     """
+    global bulk_notification_task
     try:
-        # Fetch all paid invoices that haven't been notified
-        response = supabase.table("invoices").select("*, profiles:user_id(email, full_name)").eq("status", "paid").eq("notification_sent", False).execute()
-        
-        invoices = response.data or []
-        sent_count = 0
+        # Join a run that is already in progress instead of starting a second one
+        if bulk_notification_task is None or bulk_notification_task.done():
+            bulk_notification_task = asyncio.create_task(notification_pipeline.run())
         
-        for invoice in invoices:
-            user_email = invoice.get("profiles", {}).get("email", "")
-            user_name = invoice.get("profiles", {}).get("full_name", "User")
-            
-            # TODO: Implement actual email sending
-            print(f"[EMAIL] Would send notification to {user_email}")
-            print(f"Subject: Payment Released - Invoice {invoice['invoice_number']}")
-            print(f"Message: Hi {user_name}, your payment of ${invoice['amount']} for invoice {invoice['invoice_number']} has been released.")
-            
-            # Mark as sent
-            supabase.table("invoices").update({
-                "notification_sent": True,
-                "notification_sent_at": "now()"
-            }).eq("id", invoice['id']).execute()
-            
-            sent_count += 1
+        try:
+            stats = await asyncio.wait_for(asyncio.shield(bulk_notification_task), NOTIFY_REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            stats = notification_pipeline.stats
+            return JSONResponse(status_code=202, content={
+                "success": True,
+                "message": f"Sending in background, {stats['sent']} sent so far",
+                "count": stats["sent"],
+                "running": True
+            })
         
         return JSONResponse(content={
             "success": True,
-            "message": f"Sent {sent_count} notifications",
-            "count": sent_count
+            "message": f"Sent {stats['sent']} notifications",
+            "count": stats["sent"],
+            "failed": stats["failed"]
         })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Bulk notification error: {str(e)}")
 
 
+@app.get("/send_bulk_notifications/status")
+async def bulk_notifications_status():
+    return notification_pipeline.stats
+
+
+# Batch extraction: short OCR texts share LLM calls
+batch_extractor = GroupedExtractor(extract_with_ai, extract_many_with_ai)
+batch_manager = BatchManager(
+    lambda upload, tenant: extract_and_check(upload, batch_extractor.extract, Work(tenant, BATCH, block=True))
+)
+
+# Single-document background jobs with progress events; same lane as /extract_invoice
+extraction_jobs = ExtractionJobManager(
+    lambda upload, tenant: extract_and_check(upload, work=Work(tenant, block=True))
+)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
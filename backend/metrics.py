@@ -0,0 +1,254 @@
+"""
+Pipeline instrumentation.
+
+Stages of the extraction, chat and notification paths are wrapped in
+`span("stage")`, which records the duration in a latency histogram and in the
+current request's trace. Requests are timed by the HTTP middleware in main.py,
+which also returns the trace as a Server-Timing header. Everything is exported
+in the Prometheus text format by `render()` (served at GET /metrics).
+
+Set PROFILE_SLOW_REQUESTS_MS to profile requests with cProfile; a .prof dump
+is written to PROFILE_DIR for every request slower than the threshold that
+ran while no other request was in flight.
+"""
+import bisect
+import contextvars
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+PROFILE_SLOW_REQUESTS_MS = float(os.getenv("PROFILE_SLOW_REQUESTS_MS", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(".cache", "profiles"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Per-request list of (stage, seconds); None outside a traced request
+_trace: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("trace", default=None)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _le(bound) -> str:
+    return 'le="' + str(bound) + '"'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Gauge(Metric):
+    """
+    Gauge read from a callback at scrape time.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.read = read
+
+    def samples(self) -> Iterator[str]:
+        yield f"{self.name} {float(self.read())}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for key, state in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, _le(bound))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, _le('+Inf'))} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}"
+
+
+REGISTRY: List[Metric] = []
+
+REQUEST_SECONDS = Histogram("smartinvoice_request_seconds", "HTTP request latency", ["endpoint", "method", "status"])
+STAGE_SECONDS = Histogram("smartinvoice_stage_seconds", "Pipeline stage latency", ["stage"])
+BYTES_PROCESSED = Counter("smartinvoice_bytes_processed_total", "Uploaded bytes run through extraction", ["content_type"])
+PAGES_PROCESSED = Counter("smartinvoice_pages_processed_total", "Pages extracted, by text source", ["source"])
+NOTIFICATIONS = Counter("smartinvoice_notifications_total", "Payment notifications, by delivery result", ["result"])
+SCHEDULER_WAIT_SECONDS = Histogram("smartinvoice_scheduler_wait_seconds", "Time extraction work waited for a scheduler slot", ["lane"])
+RATE_LIMITED = Counter("smartinvoice_rate_limited_total", "Extraction requests refused by a tenant rate limit", ["lane"])
+EXPORT_ROWS = Counter("smartinvoice_export_rows_total", "Invoice rows written by bulk exports", ["format"])
+TEMPLATE_MATCHES = Counter("smartinvoice_template_matches_total", "First pages checked against vendor templates, by outcome", ["result"])
+
+
+def render() -> str:
+    return "".join(metric.render() for metric in REGISTRY)
+
+
+def observe_stage(stage: str, seconds: float):
+    """
+    Record a stage duration measured elsewhere (e.g. inside an OCR worker).
+    """
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Time the enclosed block as one pipeline stage.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def start_trace() -> List[Tuple[str, float]]:
+    trace: List[Tuple[str, float]] = []
+    _trace.set(trace)
+    return trace
+
+
+def server_timing(trace: List[Tuple[str, float]]) -> str:
+    """
+    Format a trace as a Server-Timing header value, summing repeated stages.
+    """
+    totals: Dict[str, float] = {}
+    for stage, seconds in trace:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage.replace('.', '-')};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+class SlowRequestProfiler:
+    """
+    Opt-in cProfile hook: keeps a dump of requests slower than `threshold_ms`.
+
+    cProfile records everything the event loop thread runs, not only the
+    coroutines of one request. A profile is therefore only started while no
+    other request is in flight, and thrown away if another request arrives
+    before it finishes, so every dump belongs to the request it is named
+    after. Background tasks (index syncs, job workers) still show up in it;
+    profile against an otherwise idle server, sending one request at a time.
+    """
+
+    def __init__(self, threshold_ms: float = PROFILE_SLOW_REQUESTS_MS, directory: str = PROFILE_DIR):
+        self.threshold_ms = threshold_ms
+        self.directory = directory
+        # Only touched from the event loop thread
+        self._in_flight = 0
+        self._profile: Optional[cProfile.Profile] = None
+        self._overlapped = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """
+        Called for every request; every start() must be paired with finish().
+        """
+        self._in_flight += 1
+        if not self.enabled:
+            return None
+        if self._profile is not None:
+            # The running profile now contains this request's work too
+            self._overlapped = True
+            return None
+        if self._in_flight > 1:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already active
+            return None
+        self._profile = profile
+        self._overlapped = False
+        return profile
+
+    def finish(self, profile: Optional[cProfile.Profile], name: str, elapsed: float) -> Optional[str]:
+        """
+        Stop the profile and write it if the request was slow and ran alone.
+
+        Returns:
+            Path of the dump, if one was written
+        """
+        self._in_flight -= 1
+        if profile is None:
+            return None
+        profile.disable()
+        self._profile = None
+        if self._overlapped or elapsed * 1000 < self.threshold_ms:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_")
+        path = os.path.join(self.directory, f"{int(time.time() * 1000)}-{safe_name}.prof")
+        profile.dump_stats(path)
+        return path
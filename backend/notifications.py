@@ -0,0 +1,182 @@
+"""
+Payment notification pipeline.
+
+Paid, un-notified invoices are read in pages using keyset pagination on id,
+delivered through a pluggable sender with bounded concurrency, and marked as
+sent with one bulk UPDATE per page. Rows are only marked after a successful
+delivery, and the candidate filter is notification_sent = FALSE, so an
+interrupted run is resumed simply by running again: finished rows are
+skipped, and each message carries an idempotency key (used as the email
+Message-ID) so a row that was delivered but not yet marked can be
+de-duplicated downstream.
+"""
+import asyncio
+import os
+import smtplib
+from email.message import EmailMessage
+from typing import List, Optional
+
+from db import Store
+from metrics import NOTIFICATIONS, span
+
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "500"))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "20"))
+NOTIFY_REQUEST_TIMEOUT = float(os.getenv("NOTIFY_REQUEST_TIMEOUT", "25"))
+
+
+class NotificationSender:
+    """
+    Delivers a single message. Raise to signal a failed delivery.
+    """
+
+    async def send(self, message: dict):
+        raise NotImplementedError
+
+
+class LogSender(NotificationSender):
+    """
+    Prints the email instead of sending it (default when SMTP is not configured).
+    """
+
+    async def send(self, message: dict):
+        print(f"[EMAIL] Would send notification to {message['to']}")
+        print(f"Subject: {message['subject']}")
+        print(f"Message: {message['body']}")
+
+
+class SMTPSender(NotificationSender):
+    """
+    Sends through an SMTP server; the blocking smtplib call runs in a thread.
+    """
+
+    def __init__(self, host: str, port: int = 587, username: Optional[str] = None, password: Optional[str] = None, sender: str = "no-reply@smartinvoice.local"):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+
+    def _send_sync(self, message: dict):
+        email = EmailMessage()
+        email["From"] = self.sender
+        email["To"] = message["to"]
+        email["Subject"] = message["subject"]
+        email["Message-ID"] = f"<{message['idempotency_key']}@smartinvoice>"
+        email.set_content(message["body"])
+
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.username:
+                smtp.starttls()
+                smtp.login(self.username, self.password or "")
+            smtp.send_message(email)
+
+    async def send(self, message: dict):
+        await asyncio.to_thread(self._send_sync, message)
+
+
+def create_sender() -> NotificationSender:
+    """
+    SMTPSender when SMTP_HOST is set, otherwise LogSender.
+    """
+    host = os.getenv("SMTP_HOST")
+    if not host:
+        return LogSender()
+    return SMTPSender(
+        host,
+        int(os.getenv("SMTP_PORT", "587")),
+        os.getenv("SMTP_USER"),
+        os.getenv("SMTP_PASSWORD"),
+        os.getenv("SMTP_FROM", "no-reply@smartinvoice.local"),
+    )
+
+
+def build_message(invoice: dict) -> dict:
+    """
+    Build the payment-released email for an invoice row (with its profile joined).
+    """
+    profile = invoice.get("profiles") or {}
+    user_name = profile.get("full_name") or "User"
+    return {
+        "to": profile.get("email", ""),
+        "subject": f"Payment Released - Invoice {invoice['invoice_number']}",
+        "body": f"Hi {user_name}, your payment of ${invoice['amount']} for invoice {invoice['invoice_number']} has been released.",
+        "idempotency_key": f"payment-released-{invoice['id']}",
+    }
+
+
+class NotificationPipeline:
+    """
+    Pages through paid, un-notified invoices and notifies their owners.
+
+    Args:
+        store: Data access (db.Store)
+        sender: Where messages are delivered
+        batch_size: Rows per page (and per bulk UPDATE)
+        concurrency: Deliveries in flight at once
+    """
+
+    def __init__(self, store: Store, sender: NotificationSender, batch_size: int = NOTIFY_BATCH_SIZE, concurrency: int = NOTIFY_CONCURRENCY):
+        self.store = store
+        self.sender = sender
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.stats = {"running": False, "sent": 0, "failed": 0, "batches": 0, "last_id": None}
+
+    async def _deliver(self, invoices: List[dict]) -> List[str]:
+        limit = asyncio.Semaphore(self.concurrency)
+
+        async def deliver_one(invoice: dict) -> Optional[str]:
+            async with limit:
+                try:
+                    with span("notify.send"):
+                        await self.sender.send(build_message(invoice))
+                    NOTIFICATIONS.inc(result="sent")
+                    return invoice["id"]
+                except Exception as e:
+                    NOTIFICATIONS.inc(result="failed")
+                    print(f"Notification for invoice {invoice['id']} failed: {e}")
+                    return None
+
+        results = await asyncio.gather(*(deliver_one(inv) for inv in invoices))
+        return [invoice_id for invoice_id in results if invoice_id is not None]
+
+    async def run(self, after_id: Optional[str] = None) -> dict:
+        """
+        Process every candidate after `after_id` (all of them by default).
+
+        Returns:
+            Counts of sent and failed notifications for this run
+        """
+        self.stats = {"running": True, "sent": 0, "failed": 0, "batches": 0, "last_id": after_id}
+        try:
+            while True:
+                with span("supabase.notify_fetch"):
+                    invoices = await self.store.notification_candidates(self.stats["last_id"], self.batch_size)
+                if not invoices:
+                    break
+
+                sent_ids = await self._deliver(invoices)
+                if sent_ids:
+                    with span("supabase.notify_mark"):
+                        await self.store.mark_notified(sent_ids)
+
+                self.stats["sent"] += len(sent_ids)
+                self.stats["failed"] += len(invoices) - len(sent_ids)
+                self.stats["batches"] += 1
+                self.stats["last_id"] = invoices[-1]["id"]
+
+                if len(invoices) < self.batch_size:
+                    break
+        finally:
+            self.stats["running"] = False
+        return dict(self.stats)
+
+    async def send_one(self, invoice: dict):
+        """
+        Notify a single invoice and mark it sent.
+        """
+        with span("notify.send"):
+            await self.sender.send(build_message(invoice))
+        NOTIFICATIONS.inc(result="sent")
+        with span("supabase.notify_mark"):
+            await self.store.mark_notified([invoice["id"]])
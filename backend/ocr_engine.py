@@ -0,0 +1,348 @@
+"""
+OCR engine backed by a bounded process pool.
+
+Pages of a document are fanned out across worker processes and returned in
+page order. The number of pages queued or running is capped; once the cap is
+reached new documents are rejected with OCREngineBusy so the API can answer
+503 + Retry-After instead of piling work onto the event loop.
+
+Each worker process keeps one Tesseract instance loaded for its lifetime
+through the tesserocr C-API bindings when they are installed, so pages are
+passed as in-memory images and the language model is loaded once per worker
+instead of once per page. Without tesserocr, workers fall back to
+pytesseract, which runs the tesseract CLI for every page.
+
+On request a page also comes back with its word boxes, for the layout
+templates in templates.py.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from metrics import observe_stage
+from preprocess import PageFrame, prepare_for_ocr
+from tools import tesseract_cmd as find_tesseract_cmd
+
+
+# Tesseract config tuned for invoices (single uniform block of text)
+TESSERACT_CONFIG = r'--oem 3 --psm 6'
+TESSERACT_LANG = os.getenv("TESSERACT_LANG", "eng")
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_QUEUE_DEPTH = int(os.getenv("OCR_QUEUE_DEPTH", str(OCR_WORKERS * 4)))
+OCR_RETRY_AFTER = int(os.getenv("OCR_RETRY_AFTER", "5"))
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto")  # auto | tesserocr | pytesseract
+
+# Per-process state, set up by _init_worker
+_api = None
+
+# [text, x0, y0, x1, y1, line]: a recognized word, its box as fractions of the
+# original page's width and height (before cropping), and the index of its
+# text line on the page. Text-layer words (text_layer.page_words) use the same
+# coordinates.
+Word = list
+
+
+class OCREngineBusy(Exception):
+    """
+    Raised when the OCR queue is full and a document cannot be admitted.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"OCR engine is saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _tessdata_path(tesseract_cmd: Optional[str]) -> Optional[str]:
+    if os.getenv("TESSDATA_PREFIX"):
+        return os.getenv("TESSDATA_PREFIX")
+    if tesseract_cmd:
+        # Windows installs keep tessdata next to tesseract.exe
+        candidate = os.path.join(os.path.dirname(tesseract_cmd), "tessdata")
+        if os.path.isdir(candidate):
+            return candidate
+    return None
+
+
+def _init_worker(tesseract_cmd: Optional[str], backend: str = OCR_BACKEND):
+    # Runs once in every worker process
+    global _api
+    if tesseract_cmd:
+        import pytesseract
+
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    if backend == "pytesseract":
+        return
+
+    try:
+        import tesserocr
+    except ImportError:
+        return
+
+    kwargs = {"lang": TESSERACT_LANG, "psm": tesserocr.PSM.SINGLE_BLOCK, "oem": tesserocr.OEM.DEFAULT}
+    path = _tessdata_path(tesseract_cmd)
+    if path:
+        kwargs["path"] = path
+    try:
+        _api = tesserocr.PyTessBaseAPI(**kwargs)
+    except RuntimeError as e:
+        # Missing traineddata; the CLI may still work
+        print(f"tesserocr unavailable, using the tesseract CLI: {e}")
+
+
+def _worker_backend() -> Optional[str]:
+    """
+    Report which OCR backend this worker uses, or None if neither works.
+    """
+    if _api is not None:
+        return "tesserocr"
+    try:
+        import pytesseract
+
+        pytesseract.get_tesseract_version()
+        return "pytesseract"
+    except Exception:
+        return None
+
+
+def _word(text: str, frame: PageFrame, left: int, top: int, right: int, bottom: int, line: int) -> Word:
+    x0, y0 = frame.to_page(left, top)
+    x1, y1 = frame.to_page(right, bottom)
+    return [text, x0, y0, x1, y1, line]
+
+
+def _tesserocr_words(frame: PageFrame) -> List[Word]:
+    # Walks the result of the recognition that just ran; no second pass
+    import tesserocr
+
+    words = []
+    line = -1
+    for item in tesserocr.iterate_level(_api.GetIterator(), tesserocr.RIL.WORD):
+        if item.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+            line += 1
+        text = item.GetUTF8Text(tesserocr.RIL.WORD)
+        box = item.BoundingBox(tesserocr.RIL.WORD)
+        if text and text.strip() and box:
+            words.append(_word(text.strip(), frame, *box, max(line, 0)))
+    return words
+
+
+def _tsv_words(tsv: str, frame: PageFrame) -> List[Word]:
+    # level page block par line word left top width height conf text
+    words = []
+    lines: Dict[tuple, int] = {}
+    for row in tsv.splitlines()[1:]:
+        cols = row.split("\t")
+        if len(cols) < 12 or cols[0] != "5" or not cols[11].strip():
+            continue
+        line = lines.setdefault(tuple(cols[1:5]), len(lines))
+        left, top, w, h = (int(value) for value in cols[6:10])
+        words.append(_word(cols[11].strip(), frame, left, top, left + w, top + h, line))
+    return words
+
+
+def ocr_page(image: Image.Image, with_words: bool = False) -> Tuple[str, Optional[List[Word]], float, float]:
+    """
+    Preprocess and OCR a single page. Executed inside a worker process.
+
+    Returns:
+        (text, word boxes if with_words else None, preprocessing seconds, Tesseract seconds)
+    """
+    started = time.perf_counter()
+    image, _, frame = prepare_for_ocr(image)
+    preprocessed = time.perf_counter()
+    words = None
+    if _api is not None:
+        _api.SetImage(image)
+        try:
+            text = _api.GetUTF8Text()
+            if with_words:
+                words = _tesserocr_words(frame)
+        finally:
+            _api.Clear()
+    elif with_words:
+        from pytesseract import pytesseract as cli
+
+        # One tesseract run writing both the text and the TSV with word boxes
+        with cli.save(image) as (base, input_filename):
+            cli.run_tesseract(input_filename, base, "txt", None, TESSERACT_CONFIG + " -c tessedit_create_tsv=1")
+            with open(f"{base}.txt", encoding="utf-8") as f:
+                text = f.read()
+            with open(f"{base}.tsv", encoding="utf-8") as f:
+                words = _tsv_words(f.read(), frame)
+    else:
+        import pytesseract
+
+        text = pytesseract.image_to_string(image, config=TESSERACT_CONFIG)
+    return text, words, preprocessed - started, time.perf_counter() - preprocessed
+
+
+class OCREngine:
+    """
+    Bounded process pool that OCRs the pages of a document in parallel.
+
+    Args:
+        workers: Number of worker processes
+        queue_depth: Maximum number of pages queued or running at once
+        retry_after: Seconds clients are asked to wait when the queue is full
+        tesseract_cmd: Path to the tesseract binary for the workers (found per platform if omitted)
+        backend: "tesserocr", "pytesseract" or "auto" (tesserocr when installed)
+    """
+
+    def __init__(
+        self,
+        workers: int = OCR_WORKERS,
+        queue_depth: int = OCR_QUEUE_DEPTH,
+        retry_after: int = OCR_RETRY_AFTER,
+        tesseract_cmd: Optional[str] = None,
+        backend: str = OCR_BACKEND,
+    ):
+        self.workers = max(1, workers)
+        self.queue_depth = max(1, queue_depth)
+        self.retry_after = retry_after
+        self.tesseract_cmd = tesseract_cmd
+        self.backend = backend
+        self.active_backend: Optional[str] = None
+        self._started = False
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    @property
+    def available(self) -> bool:
+        """
+        Whether OCR works at all. Only meaningful after start(); before that
+        the engine is assumed available.
+        """
+        return not self._started or self.active_backend is not None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.tesseract_cmd or find_tesseract_cmd(), self.backend),
+            )
+        return self._executor
+
+    async def start(self) -> Optional[str]:
+        """
+        Spawn every worker, load its Tesseract instance and probe which
+        backend is usable. Call once at startup so the first requests don't
+        pay for process and model start-up, and so availability is known
+        without probing per request.
+
+        Returns:
+            The backend in use, or None if Tesseract is not available
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        backends = await asyncio.gather(*(loop.run_in_executor(executor, _worker_backend) for _ in range(self.workers)))
+        self.active_backend = next((b for b in backends if b), None)
+        self._started = True
+        return self.active_backend
+
+    def _admit(self, pages: int) -> int:
+        # A document larger than the whole queue is still admitted on an idle
+        # engine, otherwise it could never run.
+        reserved = min(pages, self.queue_depth)
+        if self._pending and self._pending + reserved > self.queue_depth:
+            raise OCREngineBusy(self.retry_after)
+        self._pending += reserved
+        return reserved
+
+    async def _run(self, images: List[Image.Image], first_words: bool = False) -> Tuple[List[str], Optional[List[Word]]]:
+        # Word boxes are only collected for the first image, when asked for
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        futures = [loop.run_in_executor(executor, ocr_page, img, first_words and i == 0) for i, img in enumerate(images)]
+        texts = []
+        first_page_words = None
+        for i, (text, words, preprocess_seconds, tesseract_seconds) in enumerate(await asyncio.gather(*futures)):
+            observe_stage("ocr.preprocess", preprocess_seconds)
+            observe_stage("ocr.tesseract", tesseract_seconds)
+            texts.append(text)
+            if i == 0:
+                first_page_words = words
+        return texts, first_page_words
+
+    async def ocr_pages(self, images: List[Image.Image]) -> List[str]:
+        """
+        OCR every page in parallel and return the texts in page order.
+
+        Raises:
+            OCREngineBusy: If the queue has no room for this document
+        """
+        if not images:
+            return []
+
+        reserved = self._admit(len(images))
+        try:
+            texts, _ = await self._run(images)
+            return texts
+        finally:
+            self._pending -= reserved
+
+    async def ocr_layout(self, image: Image.Image) -> Tuple[str, List[Word]]:
+        """
+        OCR one page and also return its word boxes.
+
+        Raises:
+            OCREngineBusy: If the queue has no room for the page
+        """
+        reserved = self._admit(1)
+        try:
+            texts, words = await self._run([image], first_words=True)
+            return texts[0], words or []
+        finally:
+            self._pending -= reserved
+
+    async def ocr_windows(
+        self,
+        windows: AsyncIterator[List[Image.Image]],
+        window_size: int,
+        on_window: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+        on_layout: Optional[Callable[[List[Word]], None]] = None,
+    ) -> List[str]:
+        """
+        OCR a document that arrives as consecutive windows of pages.
+
+        Only `window_size` queue slots are reserved for the whole document,
+        and each window is released before the next one is rendered, so a
+        long PDF never holds more than one window of images in memory.
+        `on_window` is awaited with the texts of each window as it finishes;
+        `on_layout` is called with the word boxes of the document's first page.
+
+        Raises:
+            OCREngineBusy: If the queue has no room for this document
+        """
+        reserved = self._admit(window_size)
+        try:
+            texts: List[str] = []
+            async for images in windows:
+                window_texts, words = await self._run(images, first_words=on_layout is not None and not texts)
+                del images
+                if words is not None:
+                    on_layout(words)
+                texts.extend(window_texts)
+                if on_window is not None:
+                    await on_window(window_texts)
+            return texts
+        finally:
+            self._pending -= reserved
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,215 @@
+"""
+Adaptive image preprocessing for OCR.
+
+Rather than rendering every PDF page at 300 DPI and running the same
+contrast + sharpen pass over full-resolution RGB, each page is measured first:
+- render DPI follows the resolution of the scan embedded in the page
+  (clean vector pages render at PREPROCESS_CLEAN_DPI)
+- oversized images are downscaled to the equivalent of PREPROCESS_TARGET_DPI
+- images are converted to grayscale, and to black/white when the histogram
+  is clearly bimodal
+- contrast and sharpening are only applied when measurements call for them
+- the page is cropped to the bounding box of its ink; the returned
+  PageFrame maps positions in the prepared image back to the page
+"""
+import os
+import subprocess
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageFilter, ImageOps
+
+from tools import poppler_tool
+
+
+PREPROCESS_TARGET_DPI = int(os.getenv("PREPROCESS_TARGET_DPI", "300"))
+PREPROCESS_CLEAN_DPI = int(os.getenv("PREPROCESS_CLEAN_DPI", "150"))
+PREPROCESS_MIN_SCAN_DPI = int(os.getenv("PREPROCESS_MIN_SCAN_DPI", "200"))
+PREPROCESS_LOW_CONTRAST = float(os.getenv("PREPROCESS_LOW_CONTRAST", "100"))
+PREPROCESS_BLUR_THRESHOLD = float(os.getenv("PREPROCESS_BLUR_THRESHOLD", "0.3"))
+PREPROCESS_CROP_MARGIN = int(os.getenv("PREPROCESS_CROP_MARGIN", "20"))
+
+# Longest side of an A4/Letter page at the target DPI (11.7in)
+_MAX_SIDE = int(11.7 * PREPROCESS_TARGET_DPI)
+
+
+def page_render_dpis(pdf_path: str, pages: List[int]) -> Dict[int, int]:
+    """
+    Pick a render DPI for each page from the resolution of its largest
+    embedded image, as reported by poppler's `pdfimages -list`.
+
+    - no embedded image (vector page): PREPROCESS_CLEAN_DPI
+    - scan at or above PREPROCESS_MIN_SCAN_DPI: its own resolution, capped
+      at PREPROCESS_TARGET_DPI (rendering higher adds pixels, not detail)
+    - lower-resolution scan: PREPROCESS_TARGET_DPI, since upsampling small
+      glyphs helps Tesseract
+    """
+    dpis = {page: PREPROCESS_CLEAN_DPI for page in pages}
+    if not pages:
+        return dpis
+
+    try:
+        result = subprocess.run(
+            [poppler_tool("pdfimages"), "-list", "-f", str(min(pages)), "-l", str(max(pages)), pdf_path],
+            capture_output=True,
+            timeout=30,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        # Without pdfimages we can't tell scans from vector pages
+        return {page: PREPROCESS_TARGET_DPI for page in pages}
+    if result.returncode != 0:
+        return {page: PREPROCESS_TARGET_DPI for page in pages}
+
+    largest: Dict[int, Tuple[int, int]] = {}  # page -> (pixel area, ppi)
+    for line in result.stdout.decode("utf-8", errors="replace").splitlines()[2:]:
+        cols = line.split()
+        if len(cols) < 14 or cols[2] != "image":
+            continue
+        try:
+            page, width, height = int(cols[0]), int(cols[3]), int(cols[4])
+            ppi = min(int(cols[12]), int(cols[13]))
+        except ValueError:
+            continue
+        if page not in largest or width * height > largest[page][0]:
+            largest[page] = (width * height, ppi)
+
+    for page in pages:
+        if page not in largest:
+            continue
+        ppi = largest[page][1]
+        dpis[page] = min(ppi, PREPROCESS_TARGET_DPI) if ppi >= PREPROCESS_MIN_SCAN_DPI else PREPROCESS_TARGET_DPI
+    return dpis
+
+
+class PageFrame(NamedTuple):
+    """
+    Where a prepared image sits on its page, in prepared-image pixels: the
+    crop's offset and the size of the whole (downscaled) page. Dividing by
+    the page size undoes the downscale, so positions come out as fractions
+    of the original page whatever was cropped.
+    """
+
+    left: int
+    top: int
+    width: int
+    height: int
+
+    def to_page(self, x: float, y: float) -> Tuple[float, float]:
+        return (x + self.left) / self.width, (y + self.top) / self.height
+
+
+class _Levels(NamedTuple):
+    threshold: int  # Otsu threshold: ink <= threshold < paper
+    separation: float  # between-class / total variance, 0..1; ~1 for clean print
+    contrast: float  # mean paper level minus mean ink level
+    blur: float  # share of non-paper pixels in the mid-gray band between ink and paper
+
+
+def _levels(histogram: List[int]) -> _Levels:
+    """
+    Otsu's threshold for a 256-bin histogram plus the measurements derived
+    from its two classes. Whitespace dominates a page, so global mean and
+    stddev say little about the text; the ink and paper classes do.
+    """
+    total = sum(histogram)
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    mean = sum_all / total if total else 0.0
+    variance = sum(h * (i - mean) ** 2 for i, h in enumerate(histogram)) / total if total else 0.0
+    if not variance:
+        return _Levels(128, 0.0, 0.0, 0.0)
+
+    best_t, best_between = 128, 0.0
+    weight_bg = 0
+    sum_bg = 0.0
+    for t in range(256):
+        weight_bg += histogram[t]
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += t * histogram[t]
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2 / (total * total)
+        if between > best_between:
+            best_t, best_between = t, between
+
+    dark = sum(histogram[:best_t + 1])
+    ink = sum(i * histogram[i] for i in range(best_t + 1)) / dark
+    paper = (sum_all - ink * dark) / (total - dark)
+    low, high = ink + (paper - ink) * 0.25, ink + (paper - ink) * 0.75
+    solid = sum(h for i, h in enumerate(histogram) if i <= low)
+    mid = sum(h for i, h in enumerate(histogram) if low < i < high)
+    blur = mid / (solid + mid) if solid + mid else 0.0
+    return _Levels(best_t, best_between / variance, paper - ink, blur)
+
+
+def prepare_for_ocr(image: Image.Image, source_dpi: Optional[int] = None) -> Tuple[Image.Image, List[str], PageFrame]:
+    """
+    Measure an image and apply only the preprocessing it needs.
+
+    Args:
+        image: Page image in any mode
+        source_dpi: Resolution the image was rendered or scanned at, if known
+
+    Returns:
+        (image ready for OCR, list of steps applied, its frame on the page)
+    """
+    steps = []
+
+    if image.mode != "L":
+        image = ImageOps.grayscale(image)
+        steps.append("grayscale")
+
+    # Downscale anything above the target resolution, or larger than a
+    # full page at that resolution (phone photos often claim 72 DPI)
+    dpi = source_dpi or _info_dpi(image)
+    scale = min(1.0, _MAX_SIDE / max(image.size))
+    if dpi and dpi > PREPROCESS_TARGET_DPI:
+        scale = min(scale, PREPROCESS_TARGET_DPI / dpi)
+    if scale < 0.95:
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+        steps.append(f"downscale:{scale:.2f}")
+
+    frame = PageFrame(0, 0, image.width, image.height)
+
+    levels = _levels(image.histogram())
+    if 0 < levels.contrast < PREPROCESS_LOW_CONTRAST:
+        image = ImageOps.autocontrast(image, cutoff=1)
+        levels = _levels(image.histogram())
+        steps.append("autocontrast")
+
+    # Soft glyph edges leave many pixels between the ink and paper levels
+    if levels.blur > PREPROCESS_BLUR_THRESHOLD:
+        image = image.filter(ImageFilter.SHARPEN)
+        levels = _levels(image.histogram())
+        steps.append("sharpen")
+
+    threshold = levels.threshold
+    ink = image.point(lambda p: 255 if p <= threshold else 0)
+    bbox = ink.getbbox()
+    if bbox:
+        margin = PREPROCESS_CROP_MARGIN
+        left, top, right, bottom = bbox
+        crop = (max(0, left - margin), max(0, top - margin), min(image.width, right + margin), min(image.height, bottom + margin))
+        if (crop[2] - crop[0]) * (crop[3] - crop[1]) < 0.9 * image.width * image.height:
+            image = image.crop(crop)
+            frame = frame._replace(left=crop[0], top=crop[1])
+            steps.append("crop")
+
+    # Clean documents binarize well; noisy photos are left to Tesseract's own thresholding
+    if levels.separation > 0.8:
+        image = image.point(lambda p: 255 if p > threshold else 0)
+        steps.append("binarize")
+
+    return image, steps, frame
+
+
+def _info_dpi(image: Image.Image) -> Optional[int]:
+    dpi = image.info.get("dpi")
+    if not dpi:
+        return None
+    try:
+        return int(min(dpi))
+    except (TypeError, ValueError):
+        return None
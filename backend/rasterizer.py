@@ -0,0 +1,95 @@
+"""
+Streaming PDF rasterization.
+
+Instead of rendering every page of an upload at once, the PDF is rendered
+from disk a small window of pages at a time, so peak memory is bounded by the
+window size rather than by the length of the document.
+"""
+import asyncio
+import os
+from typing import AsyncIterator, Dict, List, Sequence, Union
+
+from PIL import Image
+
+from metrics import span
+from preprocess import PREPROCESS_TARGET_DPI
+from tools import poppler_path
+
+PDF_PAGE_WINDOW = int(os.getenv("PDF_PAGE_WINDOW", "4"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+
+
+class PDFTooLarge(Exception):
+    """
+    Raised when a PDF has more pages than PDF_MAX_PAGES.
+    """
+
+    def __init__(self, page_count: int, max_pages: int):
+        super().__init__(f"PDF has {page_count} pages, the maximum is {max_pages}")
+        self.page_count = page_count
+        self.max_pages = max_pages
+
+
+def count_pages(pdf_path: str, max_pages: int = PDF_MAX_PAGES) -> int:
+    """
+    Return the page count of a PDF.
+
+    Raises:
+        PDFTooLarge: If the document exceeds max_pages
+    """
+    # Imported on first use to keep it off the startup path
+    from pdf2image import pdfinfo_from_path
+
+    page_count = int(pdfinfo_from_path(pdf_path, poppler_path=poppler_path())["Pages"])
+    if max_pages and page_count > max_pages:
+        raise PDFTooLarge(page_count, max_pages)
+    return page_count
+
+
+def render_pages(pdf_path: str, first_page: int, last_page: int, dpi: int = PREPROCESS_TARGET_DPI) -> List[Image.Image]:
+    """
+    Render an inclusive, 1-based range of pages as grayscale images.
+    The render DPI is recorded in each image's info["dpi"].
+    """
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(
+        pdf_path, dpi=dpi, first_page=first_page, last_page=last_page, grayscale=True, poppler_path=poppler_path()
+    )
+    for image in images:
+        image.info["dpi"] = (dpi, dpi)
+    return images
+
+
+def _page_runs(pages: Sequence[int], dpis: Dict[int, int]) -> List[range]:
+    # Group sorted pages into contiguous runs with the same DPI; each run is one pdftoppm call
+    runs: List[range] = []
+    for page in pages:
+        if runs and runs[-1].stop == page and dpis[runs[-1].start] == dpis[page]:
+            runs[-1] = range(runs[-1].start, page + 1)
+        else:
+            runs.append(range(page, page + 1))
+    return runs
+
+
+async def iter_page_windows(
+    pdf_path: str,
+    pages: Sequence[int],
+    dpi: Union[int, Dict[int, int]] = PREPROCESS_TARGET_DPI,
+    window: int = PDF_PAGE_WINDOW,
+) -> AsyncIterator[List[Image.Image]]:
+    """
+    Yield the given 1-based pages in windows of at most `window` images, in order.
+
+    `dpi` is either one resolution for every page or a per-page mapping.
+    Rendering runs in a worker thread so the event loop is never blocked.
+    """
+    window = max(1, window)
+    pages = sorted(pages)
+    dpis = dpi if isinstance(dpi, dict) else {page: dpi for page in pages}
+    for start in range(0, len(pages), window):
+        images: List[Image.Image] = []
+        for run in _page_runs(pages[start:start + window], dpis):
+            with span("pdf.rasterize"):
+                images.extend(await asyncio.to_thread(render_pages, pdf_path, run.start, run.stop - 1, dpis[run.start]))
+        yield images
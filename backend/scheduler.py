@@ -0,0 +1,349 @@
+"""
+Fair scheduling of extraction work across tenants.
+
+Every uncached extraction (OCR plus LLM) runs inside a scheduler slot, and
+only SCHEDULER_CONCURRENCY of them run at once. Who gets the next free slot
+is decided by:
+- priority lanes: queued "interactive" work (a single upload someone is
+  waiting on) always goes before "batch" work
+- weighted fair queuing inside a lane: every request gets a virtual finish
+  tag of max(lane virtual time, tenant's last tag) + cost / tenant weight and
+  the smallest tag runs next. A tenant with 500 queued batch files gets its
+  weighted share of slots, not all of them.
+- a token bucket per tenant and lane (TENANT_RATE_PER_MIN, burst
+  TENANT_BURST; TENANT_BATCH_RATE_PER_MIN and TENANT_BATCH_BURST for the
+  batch lane), so a tenant's batch job never spends the tokens of their own
+  interactive uploads. A synchronous request that finds its bucket empty is
+  refused at once (RateLimited, HTTP 429); background work waits in the
+  queue until its tenant has a token again.
+
+A tenant is a company (profiles.company_id, set for company staff) or, for
+users without one such as vendors, the user; see resolve_tenant().
+
+Per-tenant state is dropped once a tenant is idle: nothing queued and its
+bucket back at full capacity, which is what a new tenant starts with. So
+memory follows the tenants active in the last few minutes, not every tenant
+ever seen.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional
+
+from db import Store
+from metrics import RATE_LIMITED, SCHEDULER_WAIT_SECONDS
+
+
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", str(max(2, os.cpu_count() or 1))))
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "30"))
+TENANT_RATE_PER_MIN = float(os.getenv("TENANT_RATE_PER_MIN", "30"))
+TENANT_BURST = float(os.getenv("TENANT_BURST", "10"))
+TENANT_BATCH_RATE_PER_MIN = float(os.getenv("TENANT_BATCH_RATE_PER_MIN", str(TENANT_RATE_PER_MIN)))
+TENANT_BATCH_BURST = float(os.getenv("TENANT_BATCH_BURST", str(TENANT_BURST)))
+# "company:<uuid>=2,user:<uuid>=0.5"; tenants not listed weigh 1
+SCHEDULER_TENANT_WEIGHTS = os.getenv("SCHEDULER_TENANT_WEIGHTS", "")
+# Seconds between sweeps for idle tenants' buckets and finish tags
+SCHEDULER_PRUNE_INTERVAL = 60.0
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+LANES = (INTERACTIVE, BATCH)
+
+ANONYMOUS = "anonymous"
+
+
+class RateLimited(Exception):
+    """
+    Raised for a non-blocking request when its tenant is out of tokens.
+    """
+
+    def __init__(self, tenant: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded for {tenant}, retry after {retry_after:.0f}s")
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class SchedulerBusy(Exception):
+    """
+    Raised for a non-blocking request that waited SCHEDULER_MAX_WAIT for a slot.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Extraction queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Work(NamedTuple):
+    """
+    Who a piece of work is for and how it is scheduled.
+
+    block: wait for the tenant's rate limit instead of raising RateLimited,
+    and for a slot without the SCHEDULER_MAX_WAIT limit (background work)
+    """
+
+    tenant: str = ANONYMOUS
+    lane: str = INTERACTIVE
+    block: bool = False
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def level(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def try_take(self, cost: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def refund(self, cost: float = 1.0):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def wait_time(self, cost: float = 1.0) -> float:
+        """
+        Seconds until `cost` tokens are available.
+        """
+        self._refill()
+        if self.tokens >= cost or self.rate <= 0:
+            return 0.0 if self.tokens >= cost else float("inf")
+        return (cost - self.tokens) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("work", "cost", "start", "finish", "paid", "future", "enqueued_at")
+
+    def __init__(self, work: Work, cost: float, start: float, finish: float, paid: bool, future: asyncio.Future):
+        self.work = work
+        self.cost = cost
+        self.start = start
+        self.finish = finish
+        self.paid = paid
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        tenant, _, weight = item.strip().rpartition("=")
+        if tenant and weight:
+            weights[tenant] = float(weight)
+    return weights
+
+
+class FairScheduler:
+    """
+    Admission and ordering of extraction work; see the module docstring.
+
+    Args:
+        concurrency: Slots, i.e. extractions running at once
+        rate_per_min: Interactive token refill rate per tenant (documents per minute)
+        burst: Interactive token bucket capacity per tenant
+        batch_rate_per_min: Batch lane token refill rate per tenant
+        batch_burst: Batch lane token bucket capacity per tenant
+        weights: Tenant -> weight for fair queuing (default 1)
+        max_wait: Seconds a non-blocking request waits for a slot
+    """
+
+    def __init__(
+        self,
+        concurrency: int = SCHEDULER_CONCURRENCY,
+        rate_per_min: float = TENANT_RATE_PER_MIN,
+        burst: float = TENANT_BURST,
+        batch_rate_per_min: float = TENANT_BATCH_RATE_PER_MIN,
+        batch_burst: float = TENANT_BATCH_BURST,
+        weights: Optional[Dict[str, float]] = None,
+        max_wait: float = SCHEDULER_MAX_WAIT,
+    ):
+        self.concurrency = max(1, concurrency)
+        # Lane -> (tokens per second, bucket capacity)
+        self.limits = {
+            INTERACTIVE: (rate_per_min / 60.0, max(1.0, burst)),
+            BATCH: (batch_rate_per_min / 60.0, max(1.0, batch_burst)),
+        }
+        self.weights = parse_weights(SCHEDULER_TENANT_WEIGHTS) if weights is None else weights
+        self.max_wait = max_wait
+        self.active = 0
+        self.buckets: Dict[tuple, TokenBucket] = {}  # (lane, tenant) -> bucket
+        self._queues: Dict[str, Dict[str, Deque[_Waiter]]] = {lane: {} for lane in LANES}
+        self._virtual_time: Dict[str, float] = {lane: 0.0 for lane in LANES}
+        self._last_finish: Dict[tuple, float] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._pruned_at = time.monotonic()
+
+    def _bucket(self, lane: str, tenant: str) -> TokenBucket:
+        bucket = self.buckets.get((lane, tenant))
+        if bucket is None:
+            bucket = self.buckets[(lane, tenant)] = TokenBucket(*self.limits[lane])
+        return bucket
+
+    def _prune(self):
+        """
+        Forget tenants with nothing queued whose bucket has refilled: a fresh
+        full bucket and the lane's virtual time serve them the same.
+        """
+        self._pruned_at = time.monotonic()
+        for key in set(self.buckets) | set(self._last_finish):
+            lane, tenant = key
+            bucket = self.buckets.get(key)
+            if tenant in self._queues[lane] or (bucket is not None and bucket.level() < bucket.capacity):
+                continue
+            self.buckets.pop(key, None)
+            self._last_finish.pop(key, None)
+
+    def queued(self, lane: Optional[str] = None) -> int:
+        lanes = [lane] if lane else LANES
+        return sum(len(q) for name in lanes for q in self._queues[name].values())
+
+    async def acquire(self, work: Work, cost: float = 1.0):
+        """
+        Wait for a slot; every acquire() must be paired with a release().
+
+        Raises:
+            RateLimited: work.block is False and the tenant is out of tokens
+            SchedulerBusy: work.block is False and no slot freed up within max_wait
+        """
+        if time.monotonic() - self._pruned_at >= SCHEDULER_PRUNE_INTERVAL:
+            self._prune()
+        bucket = self._bucket(work.lane, work.tenant)
+        paid = False
+        if not work.block:
+            # Synchronous callers learn about the limit now rather than after queuing
+            if not bucket.try_take(cost):
+                RATE_LIMITED.inc(lane=work.lane)
+                raise RateLimited(work.tenant, bucket.wait_time(cost))
+            paid = True
+
+        key = (work.lane, work.tenant)
+        start = max(self._virtual_time[work.lane], self._last_finish.get(key, 0.0))
+        finish = start + cost / self.weights.get(work.tenant, 1.0)
+        self._last_finish[key] = finish
+
+        waiter = _Waiter(work, cost, start, finish, paid, asyncio.get_running_loop().create_future())
+        self._queues[work.lane].setdefault(work.tenant, deque()).append(waiter)
+        self._dispatch()
+
+        try:
+            if work.block:
+                await asyncio.shield(waiter.future)
+            else:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # Granted just as we gave up: hand the slot back
+                self.release()
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            if waiter.paid:
+                bucket.refund(cost)
+            if isinstance(e, asyncio.TimeoutError):
+                raise SchedulerBusy(int(self.max_wait) or 1)
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues[waiter.work.lane].get(waiter.work.tenant)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.work.lane][waiter.work.tenant]
+
+    def _next(self) -> Optional[_Waiter]:
+        # Smallest finish tag among tenants that may run, highest lane first
+        for lane in LANES:
+            best = None
+            for tenant, queue in self._queues[lane].items():
+                waiter = queue[0]
+                if not waiter.paid and self._bucket(lane, tenant).wait_time(waiter.cost) > 0:
+                    continue
+                if best is None or waiter.finish < best.finish:
+                    best = waiter
+            if best is not None:
+                return best
+        return None
+
+    def _dispatch(self):
+        while self.active < self.concurrency:
+            waiter = self._next()
+            if waiter is None:
+                break
+            self._remove(waiter)
+            if not waiter.paid:
+                self._bucket(waiter.work.lane, waiter.work.tenant).try_take(waiter.cost)
+                waiter.paid = True
+            lane = waiter.work.lane
+            self._virtual_time[lane] = max(self._virtual_time[lane], waiter.start)
+            self.active += 1
+            SCHEDULER_WAIT_SECONDS.observe(time.monotonic() - waiter.enqueued_at, lane=lane)
+            waiter.future.set_result(None)
+        self._schedule_refill()
+
+    def _schedule_refill(self):
+        # Blocked background work has to be woken when a bucket refills
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.active >= self.concurrency:
+            return
+        waits = [
+            self._bucket(lane, tenant).wait_time(queue[0].cost)
+            for lane in LANES
+            for tenant, queue in self._queues[lane].items()
+            if not queue[0].paid
+        ]
+        waits = [wait for wait in waits if math.isfinite(wait)]
+        if waits:
+            self._timer = asyncio.get_running_loop().call_later(min(waits), self._dispatch)
+
+    def stats(self) -> dict:
+        tenants = {}
+        for lane in LANES:
+            for tenant, queue in self._queues[lane].items():
+                tenants.setdefault(tenant, {})[lane] = len(queue)
+        for (lane, tenant), bucket in self.buckets.items():
+            tenants.setdefault(tenant, {}).setdefault("tokens", {})[lane] = round(bucket.level(), 2)
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": {lane: self.queued(lane) for lane in LANES},
+            "tenants": tenants,
+        }
+
+
+async def resolve_tenant(store: Store, user_id: Optional[str]) -> str:
+    """
+    The tenant a user's work is accounted to: their company when the
+    profile has one (company staff), else the user. Vendors have no
+    company_id, so each vendor is their own tenant. Only callers without a
+    user id share ANONYMOUS.
+    """
+    if not user_id:
+        return ANONYMOUS
+    try:
+        profile = await store.profile(user_id)
+    except Exception as e:
+        print(f"Tenant lookup failed for {user_id}: {e}")
+        profile = None
+    if profile and profile.get("company_id"):
+        return f"company:{profile['company_id']}"
+    # No profile, a failed lookup or no company: the user's own bucket
+    return f"user:{user_id}"
@@ -0,0 +1,551 @@
+"""
+Per-vendor layout templates, so repeat layouts skip the LLM.
+
+Most invoices come from a few hundred vendors whose layouts never change.
+When a user confirms an extraction (POST /templates/learn), the word boxes of
+the document's first page are turned into a template for that vendor. For
+every field the template records:
+- the anchor words that label the value ("Invoice No", "Total Due")
+- where the value sits relative to them: to the right on the same line, or
+  on a line below
+- the value's box, for values without a label
+
+A template's fingerprint is the set of label words on the page, each with a
+coarse grid cell. Every further confirmation of the same layout keeps only
+the words both documents share. Values and line items drop out, and what
+remains is the vendor's fixed layout.
+
+New documents are matched through an inverted index on the fingerprint, so
+a lookup costs a few dict probes per word rather than a scan of every
+template. Similarity is the Jaccard index of the two fingerprints (shared
+label words over all label words of either), so a busy page can't match a
+small template just by containing it. A template is used only when:
+- its similarity to the document is at least TEMPLATE_MIN_SIMILARITY
+- the template's vendor name appears on the document, so a different
+  vendor's invoice in a look-alike generic layout is not read as this one
+- each field rule has been confirmed on TEMPLATE_MIN_CONFIRMATIONS distinct
+  documents (a document confirmed again, e.g. a re-upload, counts once)
+- every rule finds a parseable value
+
+Then the fields are read off the word boxes in milliseconds. Unknown
+layouts and low-confidence matches go to the LLM as before.
+
+Templates belong to the tenant that confirmed them (scheduler.resolve_tenant:
+the company for company staff, the user for vendors). Matching and learning
+only see that tenant's templates, so one tenant's confirmations never change
+how another tenant's invoices are read.
+
+Word boxes (ocr_engine.Word) come from Tesseract for OCR'd pages, mapped back
+through the preprocessing crop, and from pdftotext -bbox-layout for
+text-layer pages. Both are fractions of the whole page, so a rule learned on
+a scan applies to the born-digital PDF of the same layout, and cropping
+doesn't shift it. Templates are saved as JSON in TEMPLATE_STORE_PATH.
+"""
+import json
+import os
+import re
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import regex_engine
+from ocr_engine import Word
+
+
+TEMPLATE_STORE_PATH = os.getenv("TEMPLATE_STORE_PATH", os.path.join(".cache", "templates.json"))
+# Line items add label words the template doesn't have, so same-layout pages
+# typically score 0.4-0.7; unrelated layouts stay well below
+TEMPLATE_MIN_SIMILARITY = float(os.getenv("TEMPLATE_MIN_SIMILARITY", "0.4"))
+TEMPLATE_MIN_CONFIRMATIONS = int(os.getenv("TEMPLATE_MIN_CONFIRMATIONS", "2"))
+
+# Bumped when saved templates can't be used as they are; older files are ignored
+STORE_VERSION = 4
+
+# A page with fewer distinct label words has too little layout to go on
+MIN_SHINGLES = 8
+GRID_COLUMNS = 4
+GRID_ROWS = 16
+MAX_VALUE_WORDS = 4
+ANCHOR_WORDS = 3
+BOX_MARGIN = 0.02
+# Document ids kept per template and rule; enough to tell repeats apart
+# long after a template is ready
+MAX_DOCUMENT_IDS = 50
+
+# Field -> value kind; vendor_name comes from the template itself
+FIELDS = {"invoice_no": "text", "amount": "amount", "due_date": "date", "invoice_date": "date"}
+
+_AMOUNT = re.compile(r"\d[\d,]*(?:\.\d{1,2})?")
+_ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_TEXT_DATE_FORMATS = ("%b %d %Y", "%B %d %Y", "%d %b %Y", "%d %B %Y")
+_LABEL_PREFIX = re.compile(r"^.*[:#]\s*")
+
+
+def _label(text: str) -> Optional[str]:
+    # Label words are letters only: "Invoice", "No:", "Total"
+    if any(ch.isdigit() for ch in text):
+        return None
+    letters = re.sub(r"[^a-z]", "", text.lower())
+    return letters if len(letters) >= 2 else None
+
+
+def _alnum(text: str) -> str:
+    return re.sub(r"[^0-9a-z]", "", text.lower())
+
+
+def _name_tokens(name: str) -> List[str]:
+    return [token for token in (_alnum(part) for part in name.split()) if token]
+
+
+def parse_amount(text: str) -> Optional[float]:
+    match = _AMOUNT.search(text)
+    if not match:
+        return None
+    try:
+        return float(match.group().replace(",", ""))
+    except ValueError:
+        return None
+
+
+def parse_date(text: str) -> Optional[str]:
+    """
+    YYYY-MM-DD from a numeric, ISO or written-out ("Nov 20, 2025") date.
+    """
+    match = _ISO_DATE.search(text)
+    if match:
+        return match.group()
+    match = regex_engine._GENERIC_DATE.search(text)
+    if match:
+        return regex_engine.parse_date(match.group())
+    cleaned = re.sub(r"[,.]", " ", text).split()
+    for fmt in _TEXT_DATE_FORMATS:
+        try:
+            return datetime.strptime(" ".join(cleaned), fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def parse_value(kind: str, text: str):
+    if kind == "amount":
+        return parse_amount(text)
+    if kind == "date":
+        return parse_date(text)
+    value = _LABEL_PREFIX.sub("", text).strip()
+    return value or None
+
+
+def same_value(kind: str, found, expected) -> bool:
+    if expected in (None, ""):
+        return found is None
+    if found is None:
+        return False
+    if kind == "amount":
+        try:
+            return abs(float(found) - float(expected)) < 0.005
+        except (TypeError, ValueError):
+            return False
+    if kind == "date":
+        return str(found) == str(expected)[:10]
+    return _alnum(str(found)) == _alnum(str(expected))
+
+
+def _box(words: List[Word]) -> List[float]:
+    return [min(w[1] for w in words), min(w[2] for w in words), max(w[3] for w in words), max(w[4] for w in words)]
+
+
+def _distance(a: List[float], b: List[float]) -> float:
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+class Layout:
+    """
+    The words of one page grouped into lines in reading order, with their
+    label forms and the page's fingerprint.
+    """
+
+    def __init__(self, words: List[Word]):
+        by_line: Dict[int, List[Word]] = {}
+        for word in words:
+            by_line.setdefault(word[5], []).append(word)
+        self.lines = sorted(
+            (sorted(line, key=lambda w: w[1]) for line in by_line.values()),
+            key=lambda line: min(w[2] for w in line),
+        )
+        self.labels = [[_label(w[0]) for w in line] for line in self.lines]
+        self.tokens = [[_alnum(w[0]) for w in line] for line in self.lines]
+        self.shingles: Set[str] = set()
+        for line, labels in zip(self.lines, self.labels):
+            for word, label in zip(line, labels):
+                if label:
+                    column = min(int(word[1] * GRID_COLUMNS), GRID_COLUMNS - 1)
+                    row = min(int(word[2] * GRID_ROWS), GRID_ROWS - 1)
+                    self.shingles.add(f"{label}@{column},{row}")
+
+    def has_name(self, name: str) -> bool:
+        """
+        Whether the name's words appear in a row on one line, ignoring case
+        and punctuation ("ACME SUPPLIES, LTD." has "Acme Supplies").
+        """
+        wanted = _name_tokens(name)
+        if not wanted:
+            return False
+        size = len(wanted)
+        for tokens in self.tokens:
+            # Words without letters or digits ("|", "&") are skipped
+            tokens = [token for token in tokens if token]
+            if any(tokens[start:start + size] == wanted for start in range(len(tokens) - size + 1)):
+                return True
+        return False
+
+    def find_anchor(self, tokens: List[str], near: List[float]) -> Optional[Tuple[int, int, int]]:
+        """
+        (line, start, end) of the occurrence of the label sequence closest
+        to where it was learned.
+        """
+        best = None
+        size = len(tokens)
+        for li, labels in enumerate(self.labels):
+            for start in range(len(labels) - size + 1):
+                if labels[start:start + size] == tokens:
+                    distance = _distance(_box(self.lines[li][start:start + size]), near)
+                    if best is None or distance < best[0]:
+                        best = (distance, li, start, start + size)
+        return best[1:] if best else None
+
+
+def _remember(document_ids: List[str], document_id: str):
+    document_ids.append(document_id)
+    del document_ids[:-MAX_DOCUMENT_IDS]
+
+
+def learn_rule(layout: Layout, kind: str, value, document_id: str) -> Optional[dict]:
+    """
+    Locate the confirmed value on the page and describe how to find it
+    again. None when the value isn't on the page.
+    """
+    if value in (None, ""):
+        return {"kind": kind, "relation": "absent", "documents": [document_id]}
+
+    candidates = []
+    for li, line in enumerate(layout.lines):
+        for start in range(len(line)):
+            for size in range(1, min(MAX_VALUE_WORDS, len(line) - start) + 1):
+                span = line[start:start + size]
+                if same_value(kind, parse_value(kind, " ".join(w[0] for w in span)), value):
+                    candidates.append((li, start, size))
+                    break
+    if not candidates:
+        return None
+    # Totals sit below subtotals; other fields are taken at their first mention
+    candidates.sort(key=lambda c: (c[0], c[1]), reverse=kind == "amount")
+
+    fallback = None
+    for li, start, size in candidates:
+        span = layout.lines[li][start:start + size]
+        rule = {"kind": kind, "box": _box(span), "words": size, "documents": [document_id]}
+
+        # Label words directly before the value on its line
+        labels = layout.labels[li]
+        first = start
+        while first > 0 and start - first < ANCHOR_WORDS and labels[first - 1]:
+            first -= 1
+        if first < start:
+            rule.update(relation="right", anchor=labels[first:start], anchor_box=_box(layout.lines[li][first:start]))
+            return rule
+
+        # Otherwise label words on the line above, over the value
+        if li > 0:
+            x0, x1 = rule["box"][0] - BOX_MARGIN, rule["box"][2] + BOX_MARGIN
+            above = [i for i, w in enumerate(layout.lines[li - 1]) if layout.labels[li - 1][i] and w[1] < x1 and w[3] > x0]
+            if above:
+                first, last = above[0], above[-1] + 1
+                rule.update(relation="below", anchor=layout.labels[li - 1][first:last], anchor_box=_box(layout.lines[li - 1][first:last]))
+                return rule
+
+        if fallback is None:
+            fallback = dict(rule, relation="box")
+    return fallback
+
+
+def apply_rule(layout: Layout, rule: dict):
+    """
+    The rule's value in this layout, or None when it can't be found or parsed.
+    """
+    kind = rule["kind"]
+    relation = rule["relation"]
+    if relation == "absent":
+        return None
+
+    if relation == "box":
+        x0, y0, x1, y1 = rule["box"]
+        span = [
+            w for line in layout.lines for w in line
+            if x0 - BOX_MARGIN <= (w[1] + w[3]) / 2 <= x1 + BOX_MARGIN and y0 - BOX_MARGIN <= (w[2] + w[4]) / 2 <= y1 + BOX_MARGIN
+        ]
+        return parse_value(kind, " ".join(w[0] for w in span)) if span else None
+
+    found = layout.find_anchor(rule["anchor"], rule["anchor_box"])
+    if found is None:
+        return None
+    li, start, end = found
+    anchor_box = _box(layout.lines[li][start:end])
+    dx = anchor_box[0] - rule["anchor_box"][0]
+
+    if relation == "right":
+        following = layout.lines[li][end:]
+    else:
+        # The nearest line below the anchor that has words under the value's column
+        x0, x1 = rule["box"][0] + dx - BOX_MARGIN, rule["box"][2] + dx + BOX_MARGIN
+        following = []
+        for line in layout.lines[li + 1:li + 4]:
+            following = [w for w in line if w[1] < x1 and w[3] > x0]
+            if following:
+                break
+    if not following:
+        return None
+
+    # Fixed-width values (invoice numbers) take the learned word count; dates
+    # and amounts the shortest prefix that parses
+    sizes = [rule["words"]] if kind == "text" else range(1, min(MAX_VALUE_WORDS, len(following)) + 1)
+    for size in sizes:
+        if size <= len(following):
+            value = parse_value(kind, " ".join(w[0] for w in following[:size]))
+            if value is not None:
+                return value
+    return None
+
+
+class Template:
+    def __init__(self, template_id: str, tenant: str, vendor: str, shingles: Set[str], rules: Optional[Dict[str, dict]] = None, documents: Optional[List[str]] = None, updated_at: float = 0.0):
+        self.id = template_id
+        self.tenant = tenant
+        self.vendor = vendor
+        self.shingles = shingles
+        # Rules and the template list the ids of the documents that
+        # confirmed them, so a document only counts once
+        self.rules = rules or {}
+        self.documents = documents or []
+        self.updated_at = updated_at
+
+    def ready(self, min_confirmations: int) -> bool:
+        return all(field in self.rules and len(self.rules[field]["documents"]) >= min_confirmations for field in FIELDS)
+
+    def apply(self, layout: Layout) -> Tuple[dict, bool]:
+        """
+        (fields, complete): complete is False when a field the layout should
+        have came back empty.
+        """
+        fields = {"vendor_name": self.vendor}
+        complete = True
+        for field in FIELDS:
+            rule = self.rules.get(field)
+            fields[field] = apply_rule(layout, rule) if rule else None
+            if rule is None or (fields[field] is None and rule["relation"] != "absent"):
+                complete = False
+        return fields, complete
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "tenant": self.tenant,
+            "vendor": self.vendor,
+            "shingles": sorted(self.shingles),
+            "rules": self.rules,
+            "documents": self.documents,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Template":
+        return cls(data["id"], data["tenant"], data["vendor"], set(data["shingles"]), data["rules"], data.get("documents"), data.get("updated_at", 0.0))
+
+
+class TemplateMatch(NamedTuple):
+    """
+    outcome: "hit" (fields read from the template), "unconfirmed" (the
+    template still needs confirmations), "low_confidence" (a rule found no
+    value), "vendor_mismatch" (the layout matches but the template's vendor
+    isn't on the page) or "miss" (no template covers this layout)
+    """
+
+    outcome: str
+    template: Optional[Template] = None
+    similarity: float = 0.0
+    fields: Optional[dict] = None
+
+    def summary(self) -> Optional[dict]:
+        if self.template is None:
+            return None
+        return {"id": self.template.id, "vendor": self.template.vendor, "similarity": round(self.similarity, 3), "used": self.outcome == "hit"}
+
+
+class TemplateStore:
+    """
+    All tenants' templates, indexed by tenant and fingerprint. Matching and learning run on the
+    event loop (both take milliseconds); dump() snapshots the store there
+    and write() can run in a thread.
+
+    Args:
+        path: JSON file the templates are loaded from and saved to
+        min_similarity: Share of a template's fingerprint a document must contain
+        min_confirmations: Documents every field rule must be confirmed on
+    """
+
+    def __init__(self, path: str = TEMPLATE_STORE_PATH, min_similarity: float = TEMPLATE_MIN_SIMILARITY, min_confirmations: int = TEMPLATE_MIN_CONFIRMATIONS):
+        self.path = path
+        self.min_similarity = min_similarity
+        self.min_confirmations = min_confirmations
+        self.templates: Dict[str, Template] = {}
+        self._index: Dict[Tuple[str, str], Set[str]] = {}
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Could not load templates from {self.path}: {e}")
+            return
+        if data.get("version") != STORE_VERSION:
+            print(f"Ignoring templates in {self.path}: saved by an older version, they need to be learned again")
+            return
+        for item in data.get("templates", []):
+            self._add(Template.from_dict(item))
+
+    def dump(self) -> str:
+        return json.dumps({"version": STORE_VERSION, "templates": [template.to_dict() for template in self.templates.values()]})
+
+    def write(self, data: str):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def _add(self, template: Template):
+        self.templates[template.id] = template
+        for shingle in template.shingles:
+            self._index.setdefault((template.tenant, shingle), set()).add(template.id)
+
+    def _reindex(self, template: Template, shingles: Set[str]):
+        for shingle in template.shingles - shingles:
+            key = (template.tenant, shingle)
+            ids = self._index.get(key)
+            if ids is not None:
+                ids.discard(template.id)
+                if not ids:
+                    del self._index[key]
+        template.shingles = shingles
+        self._add(template)
+
+    def _candidates(self, tenant: str, layout: Layout) -> List[Tuple[float, Template]]:
+        hits: Counter = Counter()
+        for shingle in layout.shingles:
+            for template_id in self._index.get((tenant, shingle), ()):
+                hits[template_id] += 1
+        # Jaccard: shared / (template + document - shared)
+        scored = [
+            (count / (len(self.templates[tid].shingles) + len(layout.shingles) - count), self.templates[tid])
+            for tid, count in hits.items()
+        ]
+        return sorted((item for item in scored if item[0] >= self.min_similarity), key=lambda item: -item[0])
+
+    def match(self, tenant: str, words: List[Word]) -> TemplateMatch:
+        """
+        Read the fields of a first page through the best matching template
+        of `tenant`.
+        """
+        layout = Layout(words)
+        if len(layout.shingles) < MIN_SHINGLES:
+            return TemplateMatch("miss")
+        candidates = self._candidates(tenant, layout)
+        if not candidates:
+            return TemplateMatch("miss")
+        # The most similar layout whose vendor is named on the page
+        similarity, template = next(((s, t) for s, t in candidates if layout.has_name(t.vendor)), (None, None))
+        if template is None:
+            return TemplateMatch("vendor_mismatch", candidates[0][1], candidates[0][0])
+        if not template.ready(self.min_confirmations):
+            return TemplateMatch("unconfirmed", template, similarity)
+        fields, complete = template.apply(layout)
+        if not complete:
+            return TemplateMatch("low_confidence", template, similarity)
+        return TemplateMatch("hit", template, similarity, fields)
+
+    def learn(self, tenant: str, words: List[Word], confirmed: dict, document_id: str) -> dict:
+        """
+        Learn from a first page and the fields a user of `tenant` confirmed
+        for it. Confirming the same document again changes nothing. Fields
+        left out of `confirmed` are skipped; only an explicit None confirms
+        that a field is not on the page.
+
+        Raises:
+            ValueError: No vendor name, a vendor name that isn't printed on
+                the first page, or too little layout text on the page
+        """
+        vendor = (confirmed.get("vendor_name") or "").strip()
+        if not vendor:
+            raise ValueError("vendor_name is required")
+        layout = Layout(words)
+        if len(layout.shingles) < MIN_SHINGLES:
+            raise ValueError("Not enough text on the first page to learn a layout")
+        # Matching checks for the vendor's name, so it has to be on the page
+        if not layout.has_name(vendor):
+            raise ValueError("vendor_name must be the vendor name as printed on the first page")
+
+        template = next((t for _, t in self._candidates(tenant, layout) if _alnum(t.vendor) == _alnum(vendor)), None)
+        created = template is None
+        if created:
+            template = Template(uuid.uuid4().hex[:12], tenant, vendor, set(layout.shingles))
+            self._add(template)
+        else:
+            # Keep what both documents share: the vendor's fixed layout
+            shared = template.shingles & layout.shingles
+            if len(shared) >= MIN_SHINGLES:
+                self._reindex(template, shared)
+
+        fields = {}
+        for field, kind in FIELDS.items():
+            if field not in confirmed:
+                fields[field] = "skipped"
+                continue
+            value = confirmed[field]
+            rule = template.rules.get(field)
+            if rule is not None and same_value(kind, apply_rule(layout, rule), value):
+                if document_id not in rule["documents"]:
+                    _remember(rule["documents"], document_id)
+                fields[field] = "confirmed"
+                continue
+            learned = learn_rule(layout, kind, value, document_id)
+            if learned is not None:
+                template.rules[field] = learned
+                fields[field] = "learned"
+            else:
+                # Keep the rule we have; this value isn't on the first page
+                fields[field] = "not_found"
+
+        if document_id not in template.documents:
+            _remember(template.documents, document_id)
+        template.updated_at = time.time()
+        return {
+            "template_id": template.id,
+            "vendor": template.vendor,
+            "created": created,
+            "documents": len(template.documents),
+            "ready": template.ready(self.min_confirmations),
+            "fields": fields,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "templates": len(self.templates),
+            "ready": sum(template.ready(self.min_confirmations) for template in self.templates.values()),
+            "tenants": len({template.tenant for template in self.templates.values()}),
+            "vendors": len({(template.tenant, _alnum(template.vendor)) for template in self.templates.values()}),
+        }
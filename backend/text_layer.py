@@ -0,0 +1,127 @@
+"""
+Native text-layer extraction for born-digital PDFs.
+
+Generated invoices usually carry an embedded text layer, which poppler's
+`pdftotext` (installed alongside pdf2image) reads in milliseconds. Pages whose
+text layer is missing or garbled are reported as unusable so the caller can
+send only those pages through OCR.
+
+page_words() reads a page's word boxes from the same text layer, in the
+coordinates OCR'd words use (ocr_engine.Word), for the layout templates.
+"""
+import os
+import subprocess
+import xml.etree.ElementTree as ET
+from typing import List, Optional
+
+from ocr_engine import Word
+from tools import poppler_tool
+
+PDF_TEXT_MIN_CHARS = int(os.getenv("PDF_TEXT_MIN_CHARS", "32"))
+PDF_TEXT_MIN_QUALITY = float(os.getenv("PDF_TEXT_MIN_QUALITY", "0.5"))
+PDFTOTEXT_TIMEOUT = int(os.getenv("PDFTOTEXT_TIMEOUT", "30"))
+
+
+def extract_text_layer(pdf_path: str, page_count: int) -> List[str]:
+    """
+    Return the embedded text of every page, in order.
+
+    Pages without a text layer come back as empty strings. If pdftotext is
+    not installed or fails, every page is returned empty.
+    """
+    try:
+        result = subprocess.run(
+            [poppler_tool("pdftotext"), "-layout", "-enc", "UTF-8", "-l", str(page_count), pdf_path, "-"],
+            capture_output=True,
+            timeout=PDFTOTEXT_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"pdftotext unavailable: {e}")
+        return [""] * page_count
+
+    if result.returncode != 0:
+        return [""] * page_count
+
+    # pdftotext terminates every page with a form feed
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    pages = pages[:page_count]
+    pages += [""] * (page_count - len(pages))
+    return pages
+
+
+def page_words(pdf_path: str, page: int = 1) -> Optional[List[Word]]:
+    """
+    Word boxes of one page from `pdftotext -bbox-layout`, as fractions of the
+    page's width and height. pdftotext splits a visual row into one line per
+    text block (columns, label/value pairs), while Tesseract reads the row as
+    one line; words whose lines overlap vertically are numbered as one line
+    so both sources group them alike. None when pdftotext is unavailable or
+    fails.
+    """
+    try:
+        result = subprocess.run(
+            [poppler_tool("pdftotext"), "-bbox-layout", "-f", str(page), "-l", str(page), pdf_path, "-"],
+            capture_output=True,
+            timeout=PDFTOTEXT_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"pdftotext unavailable: {e}")
+        return None
+    if result.returncode != 0:
+        return None
+    try:
+        return parse_bbox_layout(result.stdout)
+    except ET.ParseError as e:
+        print(f"Could not parse pdftotext word boxes: {e}")
+        return None
+
+
+def parse_bbox_layout(xhtml: bytes) -> List[Word]:
+    """
+    Words of the first page in pdftotext -bbox-layout output.
+    """
+    ns = "{http://www.w3.org/1999/xhtml}"
+    page = ET.fromstring(xhtml).find(f".//{ns}page")
+    if page is None:
+        return []
+    width, height = float(page.get("width")) or 1.0, float(page.get("height")) or 1.0
+
+    lines = []
+    for line in page.iter(f"{ns}line"):
+        boxes = [
+            (word.text.strip(), float(word.get("xMin")), float(word.get("yMin")), float(word.get("xMax")), float(word.get("yMax")))
+            for word in line.iter(f"{ns}word")
+            if word.text and word.text.strip()
+        ]
+        if boxes:
+            lines.append((min(b[2] for b in boxes), max(b[4] for b in boxes), boxes))
+    lines.sort(key=lambda item: item[0])
+
+    words = []
+    row, row_bottom = -1, None
+    for top, bottom, boxes in lines:
+        # A new row unless this line's middle falls inside the current row
+        if row_bottom is None or (top + bottom) / 2 > row_bottom:
+            row += 1
+            row_bottom = bottom
+        else:
+            row_bottom = max(row_bottom, bottom)
+        for text, x0, y0, x1, y1 in boxes:
+            words.append([text, x0 / width, y0 / height, x1 / width, y1 / height, row])
+    return words
+
+
+def is_usable(text: str, min_chars: int = PDF_TEXT_MIN_CHARS, min_quality: float = PDF_TEXT_MIN_QUALITY) -> bool:
+    """
+    Decide whether a page's text layer is good enough to skip OCR.
+
+    The page needs at least `min_chars` visible characters, and at least
+    `min_quality` of them must be alphanumeric. Broken font encodings tend to
+    produce symbol soup or U+FFFD replacement characters, which fail this.
+    """
+    visible = [c for c in text if not c.isspace()]
+    if len(visible) < min_chars:
+        return False
+
+    good = sum(1 for c in visible if c.isalnum())
+    return good / len(visible) >= min_quality
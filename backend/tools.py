@@ -0,0 +1,96 @@
+"""
+Locating the external OCR and PDF tools.
+
+Tesseract and poppler are separate installs, and where they end up depends
+on the platform: on PATH on Linux, under Homebrew's prefix on macOS, and
+under Program Files (usually not on PATH) on Windows. Each lookup tries, in
+order, an explicit environment override, PATH, then the usual install
+locations for the current platform, and is cached for the life of the
+process.
+
+- TESSERACT_CMD: full path to the tesseract binary
+- POPPLER_PATH: directory holding pdftoppm, pdfinfo, pdftotext and pdfimages
+"""
+import glob
+import os
+import shutil
+import sys
+from functools import lru_cache
+from typing import List, Optional
+
+
+def _windows_dirs(*parts: str) -> List[str]:
+    roots = [os.getenv("ProgramFiles"), os.getenv("ProgramFiles(x86)"), os.getenv("LOCALAPPDATA")]
+    return [os.path.join(root, *parts) for root in roots if root]
+
+
+def _install_dirs(tool: str) -> List[str]:
+    if sys.platform == "win32":
+        if tool == "tesseract":
+            return _windows_dirs("Tesseract-OCR") + _windows_dirs("Programs", "Tesseract-OCR")
+        # Release zips unpack to poppler-<version>\Library\bin
+        found = []
+        for pattern in _windows_dirs("poppler*", "Library", "bin") + _windows_dirs("poppler*", "bin"):
+            found.extend(sorted(glob.glob(pattern), reverse=True))
+        return found
+    if sys.platform == "darwin":
+        return ["/opt/homebrew/bin", "/usr/local/bin", "/opt/local/bin"]
+    return ["/usr/bin", "/usr/local/bin", "/snap/bin"]
+
+
+def _executable(directory: str, name: str) -> Optional[str]:
+    path = os.path.join(directory, name + (".exe" if sys.platform == "win32" else ""))
+    return path if os.path.isfile(path) and os.access(path, os.X_OK) else None
+
+
+@lru_cache(maxsize=None)
+def tesseract_cmd() -> Optional[str]:
+    """
+    Path of the tesseract binary, or None if it can't be found.
+    """
+    override = os.getenv("TESSERACT_CMD")
+    if override:
+        return override
+    found = shutil.which("tesseract")
+    if found:
+        return found
+    for directory in _install_dirs("tesseract"):
+        path = _executable(directory, "tesseract")
+        if path:
+            return path
+    return None
+
+
+@lru_cache(maxsize=None)
+def poppler_path() -> Optional[str]:
+    """
+    Directory of the poppler utilities when they are not on PATH, else None
+    (also None when poppler is not installed; callers then fail as before).
+    """
+    override = os.getenv("POPPLER_PATH")
+    if override:
+        return override
+    if shutil.which("pdftoppm"):
+        return None
+    for directory in _install_dirs("poppler"):
+        if _executable(directory, "pdftoppm"):
+            return directory
+    return None
+
+
+def poppler_tool(name: str) -> str:
+    """
+    Command to run the poppler utility `name` (e.g. "pdftotext").
+    """
+    directory = poppler_path()
+    return os.path.join(directory, name) if directory else name
+
+
+def describe() -> dict:
+    """
+    Where each tool was found, for the readiness report.
+    """
+    return {
+        "tesseract": tesseract_cmd(),
+        "poppler": poppler_path() or shutil.which("pdftoppm"),
+    }
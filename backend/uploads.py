@@ -0,0 +1,220 @@
+"""
+Uploaded files, handled without loading them into memory.
+
+An Upload wraps a seekable binary file: the spooled temp file behind
+FastAPI's UploadFile, or a file on disk (batch jobs). The pipeline reads it
+in place:
+- the content hash for the extraction cache is computed in fixed-size chunks
+  through one reused buffer
+- poppler gets a path: on-disk uploads are used directly, spooled ones are
+  copied to a temp file chunk by chunk
+- PIL decodes images straight from the file handle
+
+so the raw upload is never held as one bytes object next to its copies.
+
+UploadLimit stops reading a request body as soon as it passes the limit for
+its endpoint, before the multipart parser has spooled the rest to disk.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, Optional
+
+from PIL import Image
+
+
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "25"))
+UPLOAD_MAX_BYTES = UPLOAD_MAX_MB * 1024 * 1024
+
+CHUNK_SIZE = 1024 * 1024
+# Multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """
+    Raised when an upload exceeds UPLOAD_MAX_MB.
+    """
+
+    def __init__(self, size: int, max_bytes: int = UPLOAD_MAX_BYTES):
+        super().__init__(f"File is {size / 1024 / 1024:.1f} MB, the limit is {max_bytes // 1024 // 1024} MB")
+        self.size = size
+        self.max_bytes = max_bytes
+
+
+class Upload:
+    """
+    A file being processed, read from its handle rather than copied.
+
+    Args:
+        file: Seekable binary file positioned anywhere
+        content_type: MIME type reported by the client
+        filename: Original file name
+        path: On-disk location of `file`, if it has one poppler can open
+    """
+
+    def __init__(self, file: BinaryIO, content_type: str, filename: str = "", path: Optional[str] = None):
+        self.file = file
+        self.content_type = content_type or ""
+        self.filename = filename or ""
+        self.path = path
+        self._size: Optional[int] = None
+        self._digest: Optional[str] = None
+
+    @classmethod
+    @contextmanager
+    def open_path(cls, path: str, content_type: str, filename: str = "") -> Iterator["Upload"]:
+        with open(path, "rb") as f:
+            yield cls(f, content_type, filename, path=path)
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._size = self.file.seek(0, os.SEEK_END)
+        return self._size
+
+    def check_size(self, max_bytes: int = UPLOAD_MAX_BYTES):
+        """
+        Raises:
+            UploadTooLarge: If the file is larger than max_bytes
+        """
+        if self.size > max_bytes:
+            raise UploadTooLarge(self.size, max_bytes)
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+        """
+        Yield the content in order as views into one reused buffer; each view
+        is only valid until the next one is produced.
+        """
+        self.file.seek(0)
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        readinto = getattr(self.file, "readinto", None)
+        while True:
+            if readinto is not None:
+                n = readinto(buffer)
+            else:
+                data = self.file.read(chunk_size)
+                n = len(data)
+                buffer[:n] = data
+            if not n:
+                return
+            yield view[:n]
+
+    def digest(self) -> str:
+        """
+        sha256 of the content, computed once.
+        """
+        if self._digest is None:
+            sha = hashlib.sha256()
+            for chunk in self.chunks():
+                sha.update(chunk)
+            self._digest = sha.hexdigest()
+        return self._digest
+
+    @contextmanager
+    def as_path(self, suffix: str = "") -> Iterator[str]:
+        """
+        Yield a filesystem path with the content, for tools that need one.
+        Spooled uploads are streamed to a temp file that is removed on exit.
+        """
+        if self.path:
+            yield self.path
+            return
+
+        # delete=False so poppler can reopen the file on Windows
+        tmp = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+        try:
+            with tmp:
+                self.file.seek(0)
+                shutil.copyfileobj(self.file, tmp, CHUNK_SIZE)
+            yield tmp.name
+        finally:
+            try:
+                os.unlink(tmp.name)
+            except OSError:
+                pass
+
+    def open_image(self) -> Image.Image:
+        """
+        Decode the upload as an image, reading from the file handle.
+        """
+        self.file.seek(0)
+        image = Image.open(self.file)
+        image.load()
+        return image
+
+
+class UploadLimit:
+    """
+    ASGI middleware that refuses request bodies larger than the limit for
+    their path with 413. A declared Content-Length over the limit is refused
+    before anything is read; chunked bodies are counted as they arrive and cut
+    off at the first chunk past the limit.
+
+    Args:
+        app: The wrapped ASGI app
+        limits: Path -> maximum body bytes; other paths are not limited
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or ())
+        try:
+            declared = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            declared = 0
+        if declared > limit:
+            await self._refuse(send, UploadTooLarge(declared, limit))
+            return
+
+        received = 0
+        exceeded: Optional[UploadTooLarge] = None
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = UploadTooLarge(received, limit)
+                    raise exceeded
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # The body parser turns our exception into its own error response
+            if exceeded is not None:
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if started:
+                raise
+        if exceeded is not None and not started:
+            await self._refuse(send, exceeded)
+
+    @staticmethod
+    async def _refuse(send, error: UploadTooLarge):
+        body = json.dumps({"detail": str(error)}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
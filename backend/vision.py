@@ -0,0 +1,189 @@
+"""
+Image payloads for the OpenAI vision fallback.
+
+The model reads invoices fine at well under scan resolution, so uploads are
+decoded at reduced size (JPEG draft mode decodes straight to a fraction of
+the full resolution), downscaled to VISION_MAX_SIDE, converted to grayscale
+and re-encoded as JPEG before base64. The raw upload is never base64-encoded.
+
+PDFs are rendered at VISION_RENDER_DPI, just enough for VISION_MAX_SIDE on a
+Letter/A4 page, one page at a time. Long documents send their
+first pages and the last page (where the total usually is), at most
+VISION_MAX_PAGES. Pages are packed VISION_PAGES_PER_REQUEST to a request.
+
+Encoded payloads are kept in a small in-memory LRU keyed by content hash, so
+a retried or re-uploaded document is not rendered and encoded again.
+"""
+import base64
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+from PIL import Image, ImageOps
+
+from rasterizer import count_pages, render_pages
+from uploads import Upload
+
+
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "1600"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "80"))
+VISION_RENDER_DPI = int(os.getenv("VISION_RENDER_DPI", "150"))
+VISION_MAX_PAGES = int(os.getenv("VISION_MAX_PAGES", "8"))
+VISION_PAGES_PER_REQUEST = int(os.getenv("VISION_PAGES_PER_REQUEST", "4"))
+VISION_PAYLOAD_CACHE_MB = int(os.getenv("VISION_PAYLOAD_CACHE_MB", "64"))
+
+
+class Payloads(NamedTuple):
+    """
+    The encoded pages of one document sent to the vision model.
+    """
+
+    urls: List[str]
+    # 1-based page number of each url; pages in the middle of long
+    # documents are left out
+    pages: List[int]
+    # Pages in the whole document, sent or not
+    page_count: int
+
+
+def describe_pages(pages: List[int]) -> str:
+    """
+    "1-3", "1-7 and 40": page numbers as ranges, for the prompt.
+    """
+    ranges = []
+    for page in pages:
+        if ranges and page == ranges[-1][1] + 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    parts = [f"{a}-{b}" if a != b else str(a) for a, b in ranges]
+    return parts[0] if len(parts) == 1 else ", ".join(parts[:-1]) + " and " + parts[-1]
+
+
+def encode_image(image: Image.Image, max_side: int = VISION_MAX_SIDE, quality: int = VISION_JPEG_QUALITY) -> str:
+    """
+    Downscale and encode an image as a base64 JPEG data URL.
+    """
+    if image.mode != "L":
+        image = ImageOps.grayscale(image)
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality, optimize=True)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getbuffer()).decode("ascii")
+
+
+def image_payload(upload: Upload, max_side: int = VISION_MAX_SIDE) -> str:
+    """
+    Build the data URL for an uploaded image without decoding it at full size
+    where the format allows.
+    """
+    upload.file.seek(0)
+    with Image.open(upload.file) as image:
+        # JPEG only: decode at 1/2, 1/4 or 1/8 scale, still >= max_side
+        image.draft("L", (max_side, max_side))
+        image.load()
+        return encode_image(image, max_side)
+
+
+def vision_pages(page_count: int, max_pages: int = VISION_MAX_PAGES) -> List[int]:
+    """
+    1-based pages to send: all of them, or the first max_pages - 1 plus the last.
+    """
+    if page_count <= max_pages:
+        return list(range(1, page_count + 1))
+    return list(range(1, max_pages)) + [page_count]
+
+
+def pdf_payloads(pdf_path: str, max_side: int = VISION_MAX_SIDE, dpi: int = VISION_RENDER_DPI) -> Payloads:
+    """
+    Render and encode the pages of a PDF chosen by vision_pages.
+    """
+    page_count = count_pages(pdf_path)
+    urls = []
+    pages = []
+    # One page at a time: only the encoded JPEG of each page is kept
+    for page in vision_pages(page_count):
+        for image in render_pages(pdf_path, page, page, dpi):
+            urls.append(encode_image(image, max_side))
+            pages.append(page)
+    return Payloads(urls, pages, page_count)
+
+
+class PayloadCache:
+    """
+    LRU of encoded Payloads keyed by content hash, bounded by size.
+    """
+
+    def __init__(self, max_bytes: int = VISION_PAYLOAD_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Payloads]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Payloads]:
+        with self._lock:
+            payloads = self._entries.get(key)
+            if payloads is not None:
+                self._entries.move_to_end(key)
+            return payloads
+
+    def set(self, key: str, payloads: Payloads):
+        size = sum(len(url) for url in payloads.urls)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= sum(len(url) for url in old.urls)
+            self._entries[key] = payloads
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= sum(len(url) for url in evicted.urls)
+
+
+payload_cache = PayloadCache()
+
+
+def upload_payloads(upload: Upload, max_side: int = VISION_MAX_SIDE) -> Payloads:
+    """
+    Data URLs for the pages of an upload to send to the vision model, with
+    their page numbers, served from the payload cache when possible.
+    Blocking; run in a thread.
+    """
+    key = f"{upload.digest()}:{max_side}"
+    payloads = payload_cache.get(key)
+    if payloads is None:
+        if "pdf" in upload.content_type:
+            with upload.as_path(".pdf") as pdf_path:
+                payloads = pdf_payloads(pdf_path, max_side)
+        else:
+            payloads = Payloads([image_payload(upload, max_side)], [1], 1)
+        payload_cache.set(key, payloads)
+    return payloads
+
+
+def pack(payloads: list, per_request: int = VISION_PAGES_PER_REQUEST) -> List[list]:
+    """
+    Split page payloads (or their page numbers) into groups that each go in
+    one request.
+    """
+    per_request = max(1, per_request)
+    return [payloads[i:i + per_request] for i in range(0, len(payloads), per_request)]
+
+
+def merge_fields(results: List[dict]) -> dict:
+    """
+    Combine per-group answers for one document, in page order: header
+    fields from the first group that has them, the amount from the last.
+    """
+    merged = {}
+    for field in ("vendor_name", "invoice_no", "due_date", "invoice_date"):
+        merged[field] = next((r.get(field) for r in results if r.get(field) is not None), None)
+    merged["amount"] = next((r.get("amount") for r in reversed(results) if r.get("amount") is not None), None)
+    return merged
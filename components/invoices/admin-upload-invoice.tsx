@@ -3,7 +3,6 @@
 import type React from "react"
 import { useState, useEffect } from "react"
 import { createClient } from "@/lib/supabase/client"
-import { backendAPI } from "@/lib/api/backend"
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card"
 import { Button } from "@/components/ui/button"
 import { Input } from "@/components/ui/input"
@@ -26,6 +25,8 @@ interface ExtractedData {
   invoice_date: string | null
 }
 
+const backendUrl = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8000"
+
 interface User {
   id: string
   email: string
@@ -92,7 +93,20 @@ export default function AdminUploadInvoice({ onUploadSuccess }: { onUploadSucces
       toast.info("Extracting invoice data using AI...")
       console.log('Starting extraction for file:', file.name, file.type)
       
-      const response = await backendAPI.extractInvoice(file)
+      // Admin uploads are rate-limited and queued under the admin's company
+      const { data: { session } } = await createClient().auth.getSession()
+      const form = new FormData()
+      form.append("file", file)
+      const res = await fetch(`${backendUrl}/extract_invoice`, {
+        method: "POST",
+        body: form,
+        headers: session ? { Authorization: `Bearer ${session.access_token}` } : {},
+      })
+      if (!res.ok) {
+        const body = await res.json().catch(() => ({}))
+        throw new Error(res.status === 429 ? "Upload limit reached, please wait a minute" : body.detail || "Extraction failed")
+      }
+      const response = await res.json()
       console.log('Extraction response:', response)
       
       const hasValidData = response.data.invoice_no || response.data.vendor_name || 
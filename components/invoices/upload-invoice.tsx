@@ -4,10 +4,10 @@ import type React from "react"
 
 import { useState, useEffect } from "react"
 import { createClient } from "@/lib/supabase/client"
-import { backendAPI } from "@/lib/api/backend"
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card"
 import { Button } from "@/components/ui/button"
 import { Input } from "@/components/ui/input"
+import { Checkbox } from "@/components/ui/checkbox"
 import { Alert, AlertDescription } from "@/components/ui/alert"
 import { Label } from "@/components/ui/label"
 import { toast } from "sonner"
@@ -21,6 +21,23 @@ interface ExtractedData {
   amount: number | null
   due_date: string | null
   invoice_date: string | null
+  page_hash?: string | null
+  document_id?: string | null
+  // Fields the extractor actually returned, without the form's defaults
+  extracted?: Record<string, string | number>
+  // Whether the values came from a learned template rather than the AI
+  template_used?: boolean
+}
+
+const TEMPLATE_FIELDS = ["vendor_name", "invoice_no", "amount", "due_date", "invoice_date"]
+
+// Form fields a user can confirm, keyed to the backend's template field names
+const LEARN_FIELDS: Record<string, string> = {
+  vendor_name: "vendor_name",
+  invoice_number: "invoice_no",
+  amount: "amount",
+  invoice_date: "invoice_date",
+  due_date: "due_date",
 }
 
 interface Company {
@@ -28,12 +45,78 @@ interface Company {
   name: string
 }
 
+const backendUrl = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8000"
+
+// Human-readable label for an extraction job progress event
+function describeProgress(event: string, data: any): string {
+  switch (event) {
+    case "queued":
+      return data.retry ? "Retrying..." : "Queued..."
+    case "waiting":
+      return "Waiting for the OCR engine..."
+    case "pages":
+      return data.resumed ? `${data.total} pages, resuming after ${data.resumed} OCR'd pages` : `${data.total} page(s) found`
+    case "rasterized":
+      return `Rendered ${data.pages}/${data.total} pages`
+    case "ocr":
+      return `Read ${data.pages}/${data.total} pages`
+    case "extracting":
+      return "Extracting fields with AI..."
+    case "extracted":
+      return "Checking for duplicates..."
+    default:
+      return "Extracting..."
+  }
+}
+
+// Queue an extraction job and follow its progress events until it finishes.
+// The access token lets the backend rate-limit and fairly schedule work per company/user.
+async function extractWithProgress(file: File, accessToken: string | undefined, onProgress: (label: string) => void): Promise<any> {
+  const form = new FormData()
+  form.append("file", file)
+  const created = await fetch(`${backendUrl}/extract_invoice/jobs`, {
+    method: "POST",
+    body: form,
+    headers: accessToken ? { Authorization: `Bearer ${accessToken}` } : {},
+  })
+  if (!created.ok) {
+    const body = await created.json().catch(() => ({}))
+    throw new Error(body.detail || "Failed to start extraction")
+  }
+  const { job_id } = await created.json()
+
+  return new Promise((resolve, reject) => {
+    const events = new EventSource(`${backendUrl}/extract_invoice/jobs/${job_id}/events`)
+    const progressEvents = ["queued", "started", "waiting", "pages", "rasterized", "ocr", "extracting", "extracted"]
+    for (const name of progressEvents) {
+      events.addEventListener(name, (e) => onProgress(describeProgress(name, JSON.parse((e as MessageEvent).data))))
+    }
+    events.addEventListener("done", (e) => {
+      events.close()
+      resolve(JSON.parse((e as MessageEvent).data))
+    })
+    events.addEventListener("failed", (e) => {
+      events.close()
+      reject(new Error(JSON.parse((e as MessageEvent).data).detail))
+    })
+    // EventSource reconnects on its own (resuming via Last-Event-ID); give up only if it closed
+    events.onerror = () => {
+      if (events.readyState === EventSource.CLOSED) {
+        reject(new Error("Lost connection to the extraction job"))
+      }
+    }
+  })
+}
+
 export default function UploadInvoice({ onUploadSuccess }: { onUploadSuccess?: () => void }) {
   const [file, setFile] = useState<File | null>(null)
   const [loading, setLoading] = useState(false)
   const [extracting, setExtracting] = useState(false)
+  const [extractProgress, setExtractProgress] = useState<string | null>(null)
   const [preview, setPreview] = useState<string | null>(null)
   const [extractedData, setExtractedData] = useState<ExtractedData | null>(null)
+  const [editedFields, setEditedFields] = useState<Set<string>>(new Set())
+  const [reviewed, setReviewed] = useState(false)
   const [userProfile, setUserProfile] = useState<{ full_name: string | null; email: string; id: string } | null>(null)
   const [loadingProfile, setLoadingProfile] = useState(true)
   const [companies, setCompanies] = useState<Company[]>([])
@@ -113,7 +196,10 @@ export default function UploadInvoice({ onUploadSuccess }: { onUploadSuccess?: (
       toast.info("Extracting invoice data using AI...")
       console.log('Starting extraction for file:', file.name, file.type)
       
-      const response = await backendAPI.extractInvoice(file)
+      const {
+        data: { session },
+      } = await createClient().auth.getSession()
+      const response = await extractWithProgress(file, session?.access_token, setExtractProgress)
       console.log('Extraction response:', response)
       
       // Check if we got valid data
@@ -126,6 +212,18 @@ export default function UploadInvoice({ onUploadSuccess }: { onUploadSuccess?: (
       } else {
         toast.success("Invoice data extracted successfully!")
       }
+
+      // Existing invoices the backend thinks this file duplicates
+      const duplicates = response.duplicates || []
+      if (duplicates.length > 0) {
+        const best = duplicates[0]
+        // Matches on invoices the user can't see carry only an id and score
+        toast.warning(
+          best.invoice_number
+            ? `Possible duplicate of invoice ${best.invoice_number} from ${best.vendor_name} (${Math.round(best.score * 100)}% match, ${best.reasons.join(", ")})`
+            : `Possible duplicate of an existing invoice (${Math.round(best.score * 100)}% match)`
+        )
+      }
       
       // Map the response to our format
       const extractedData: ExtractedData = {
@@ -134,10 +232,20 @@ export default function UploadInvoice({ onUploadSuccess }: { onUploadSuccess?: (
         amount: response.data.amount || 0,
         due_date: response.data.due_date || new Date().toISOString().split("T")[0],
         invoice_date: response.data.invoice_date || new Date().toISOString().split("T")[0],
+        page_hash: response.page_hash || null,
+        document_id: response.document_id || null,
+        extracted: Object.fromEntries(
+          TEMPLATE_FIELDS.filter((field) => response.data[field] && !(field === "amount" && response.data.amount <= 0)).map(
+            (field) => [field, response.data[field]],
+          ),
+        ),
+        template_used: Boolean(response.template?.used),
       }
       
       console.log('Mapped extracted data:', extractedData)
       setExtractedData(extractedData)
+      setEditedFields(new Set())
+      setReviewed(false)
       
     } catch (error: any) {
       console.error("OCR extraction error:", error)
@@ -152,9 +260,16 @@ export default function UploadInvoice({ onUploadSuccess }: { onUploadSuccess?: (
       })
     } finally {
       setExtracting(false)
+      setExtractProgress(null)
     }
   }
 
+  // Record an edit so the corrected value can be confirmed to the template learner
+  const updateField = (key: string, value: string | number | null) => {
+    setExtractedData((data) => (data ? { ...data, [key]: value } : data))
+    setEditedFields((fields) => new Set(fields).add(key))
+  }
+
   const handleUpload = async (e: React.FormEvent) => {
     e.preventDefault()
     if (!file) {
@@ -259,6 +374,7 @@ export default function UploadInvoice({ onUploadSuccess }: { onUploadSuccess?: (
         due_date: extractedData.due_date,
         invoice_date: extractedData.invoice_date,
         file_url: publicUrl,
+        page_hash: extractedData.page_hash || null,
         status: status,
         description: notes || `Auto-uploaded from ${file.name}`,
       }
@@ -290,12 +406,50 @@ export default function UploadInvoice({ onUploadSuccess }: { onUploadSuccess?: (
       }
       console.log("✅ Invoice saved successfully:", insertedData)
 
+      // Teach the backend this vendor's layout so repeat uploads skip the AI.
+      // Only values a person vouched for are confirmed: fields they edited,
+      // or extracted fields once they ticked "reviewed". Unchecked extractor
+      // output would teach the template its own mistakes, and the defaults
+      // (INV-<timestamp>, 0, today) aren't on the page at all. A template's
+      // own result is never sent back, or it would confirm itself.
+      const {
+        data: { session },
+      } = await supabase.auth.getSession()
+      const confirmed: Record<string, string | number> = {}
+      for (const [key, field] of Object.entries(LEARN_FIELDS)) {
+        const value = extractedData[key as keyof ExtractedData] as string | number | null
+        const vouched = editedFields.has(key) || (reviewed && extractedData.extracted?.[field] !== undefined)
+        if (vouched && value) confirmed[field] = value
+      }
+      // The backend anchors templates on the vendor name as printed, not the profile name
+      if (
+        !extractedData.template_used &&
+        extractedData.document_id &&
+        session &&
+        confirmed.vendor_name &&
+        Object.keys(confirmed).length > 1
+      ) {
+        fetch(`${backendUrl}/templates/learn`, {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            Authorization: `Bearer ${session.access_token}`,
+          },
+          body: JSON.stringify({
+            document_id: extractedData.document_id,
+            fields: confirmed,
+          }),
+        }).catch((error) => console.error("Template learning failed:", error))
+      }
+
       toast.success("Invoice uploaded and saved successfully!")
       
       // Reset form
       setFile(null)
       setPreview(null)
       setExtractedData(null)
+      setEditedFields(new Set())
+      setReviewed(false)
       setSelectedCompany("")
       setNotes("")
       
@@ -459,34 +613,79 @@ export default function UploadInvoice({ onUploadSuccess }: { onUploadSuccess?: (
             </div>
           )}
 
-          {/* Extracted Data Preview */}
+          {/* Extracted Data Review */}
           {extractedData && (
             <div className="space-y-3 p-4 bg-slate-800 rounded-lg border border-slate-600">
               <Label className="text-slate-200">Extracted Data from Invoice</Label>
               <div className="grid grid-cols-2 gap-3 text-sm">
-                <div>
-                  <span className="text-slate-400">Invoice #:</span>
-                  <p className="text-slate-200 font-medium">{extractedData.invoice_number || "N/A"}</p>
+                <div className="space-y-1">
+                  <Label htmlFor="review-invoice-number" className="text-slate-400">Invoice #:</Label>
+                  <Input
+                    id="review-invoice-number"
+                    value={extractedData.invoice_number ?? ""}
+                    onChange={(e) => updateField("invoice_number", e.target.value)}
+                    disabled={loading}
+                    className="bg-slate-900 border-slate-600 text-slate-200"
+                  />
                 </div>
-                <div>
-                  <span className="text-slate-400">Amount:</span>
-                  <p className="text-slate-200 font-medium">
-                    ${extractedData.amount !== null ? extractedData.amount.toFixed(2) : "0.00"}
-                  </p>
+                <div className="space-y-1">
+                  <Label htmlFor="review-amount" className="text-slate-400">Amount:</Label>
+                  <Input
+                    id="review-amount"
+                    type="number"
+                    step="0.01"
+                    value={extractedData.amount ?? ""}
+                    onChange={(e) => updateField("amount", e.target.value === "" ? null : Number(e.target.value))}
+                    disabled={loading}
+                    className="bg-slate-900 border-slate-600 text-slate-200"
+                  />
                 </div>
-                <div>
-                  <span className="text-slate-400">Invoice Date:</span>
-                  <p className="text-slate-200 font-medium">
-                    {extractedData.invoice_date ? new Date(extractedData.invoice_date).toLocaleDateString() : "N/A"}
-                  </p>
+                <div className="space-y-1">
+                  <Label htmlFor="review-invoice-date" className="text-slate-400">Invoice Date:</Label>
+                  <Input
+                    id="review-invoice-date"
+                    type="date"
+                    value={extractedData.invoice_date ?? ""}
+                    onChange={(e) => updateField("invoice_date", e.target.value)}
+                    disabled={loading}
+                    className="bg-slate-900 border-slate-600 text-slate-200"
+                  />
                 </div>
-                <div>
-                  <span className="text-slate-400">Due Date:</span>
-                  <p className="text-slate-200 font-medium">
-                    {extractedData.due_date ? new Date(extractedData.due_date).toLocaleDateString() : "N/A"}
-                  </p>
+                <div className="space-y-1">
+                  <Label htmlFor="review-due-date" className="text-slate-400">Due Date:</Label>
+                  <Input
+                    id="review-due-date"
+                    type="date"
+                    value={extractedData.due_date ?? ""}
+                    onChange={(e) => updateField("due_date", e.target.value)}
+                    disabled={loading}
+                    className="bg-slate-900 border-slate-600 text-slate-200"
+                  />
+                </div>
+                <div className="col-span-2 space-y-1">
+                  <Label htmlFor="review-vendor" className="text-slate-400">Vendor on invoice:</Label>
+                  <Input
+                    id="review-vendor"
+                    value={extractedData.vendor_name ?? ""}
+                    onChange={(e) => updateField("vendor_name", e.target.value)}
+                    disabled={loading}
+                    className="bg-slate-900 border-slate-600 text-slate-200"
+                  />
                 </div>
               </div>
+              {!extractedData.template_used && (
+                <div className="flex items-center gap-2">
+                  <Checkbox
+                    id="review-confirmed"
+                    checked={reviewed}
+                    onCheckedChange={(checked) => setReviewed(checked === true)}
+                    disabled={loading}
+                  />
+                  <Label htmlFor="review-confirmed" className="text-xs text-slate-400">
+                    I checked these values against the invoice
+                  </Label>
+                </div>
+              )}
               <p className="text-xs text-slate-500 mt-2">Vendor name will be set to: <span className="text-blue-400 font-medium">{userProfile?.full_name || userProfile?.email || "Your Profile Name"}</span></p>
             </div>
           )}
@@ -543,7 +742,7 @@ export default function UploadInvoice({ onUploadSuccess }: { onUploadSuccess?: (
                 {extracting ? (
                   <>
                     <Loader2 className="h-4 w-4 mr-2 animate-spin" />
-                    Extracting...
+                    {extractProgress || "Extracting..."}
                   </>
                 ) : (
                   <>
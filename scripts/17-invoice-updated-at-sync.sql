@@ -0,0 +1,31 @@
+-- ============================================
+-- INVOICE UPDATED_AT MAINTENANCE
+-- Lets the backend sync invoices incrementally
+-- ============================================
+--
+-- The chat retrieval index in backend/invoice_index.py only re-reads invoices
+-- whose updated_at moved past its last sync. invoices.updated_at is never
+-- bumped on UPDATE today, so keep it current with a trigger and index it for
+-- the (updated_at, id) keyset scan.
+-- ============================================
+
+-- Reuse the helper from 14-vendor-company-relationships.sql (create if missing)
+CREATE OR REPLACE FUNCTION update_updated_at_column()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS update_invoices_updated_at ON invoices;
+CREATE TRIGGER update_invoices_updated_at BEFORE UPDATE ON invoices
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_invoices_updated_at_id ON invoices(updated_at, id);
+
+-- ============================================
+-- ROLLBACK
+-- ============================================
+-- DROP TRIGGER IF EXISTS update_invoices_updated_at ON invoices;
+-- DROP INDEX IF EXISTS idx_invoices_updated_at_id;
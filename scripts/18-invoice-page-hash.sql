@@ -0,0 +1,18 @@
+-- ============================================
+-- INVOICE PAGE HASH
+-- Lets the backend spot re-submitted invoice documents
+-- ============================================
+--
+-- /extract_invoice returns a perceptual hash of the first page (page_hash,
+-- 64 hex digits) which the upload form stores with the invoice. The duplicate
+-- index in backend/duplicates.py reads it together with vendor_name,
+-- invoice_number and amount to flag likely duplicates of new uploads.
+-- Run 17-invoice-updated-at-sync.sql first; the index syncs on updated_at.
+-- ============================================
+
+ALTER TABLE invoices ADD COLUMN IF NOT EXISTS page_hash TEXT;
+
+-- ============================================
+-- ROLLBACK
+-- ============================================
+-- ALTER TABLE invoices DROP COLUMN IF EXISTS page_hash;
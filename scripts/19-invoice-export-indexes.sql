@@ -0,0 +1,24 @@
+-- ============================================
+-- INVOICE EXPORT INDEXES
+-- Keeps bulk exports on index scans
+-- ============================================
+--
+-- GET /invoices/export in backend/exports.py walks invoices in id order in
+-- keyset pages (id > last id ... ORDER BY id LIMIT n), optionally filtered by
+-- company, status and an invoice_date range. The primary key covers the
+-- unfiltered scan; these cover the filters, and (company_id, id) and
+-- (status, id) also return a single company's or status's rows in id order.
+-- invoice_approvals and invoice_disputes are embedded through their
+-- existing invoice_id indexes.
+-- ============================================
+
+CREATE INDEX IF NOT EXISTS idx_invoices_company_id_id ON invoices(company_id, id);
+CREATE INDEX IF NOT EXISTS idx_invoices_status_id ON invoices(status, id);
+CREATE INDEX IF NOT EXISTS idx_invoices_invoice_date ON invoices(invoice_date);
+
+-- ============================================
+-- ROLLBACK
+-- ============================================
+-- DROP INDEX IF EXISTS idx_invoices_company_id_id;
+-- DROP INDEX IF EXISTS idx_invoices_status_id;
+-- DROP INDEX IF EXISTS idx_invoices_invoice_date;